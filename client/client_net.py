@@ -1,5 +1,7 @@
 import asyncio
 from common.network import send_msg, recv_msg
+from common.clock import ClockSync, now_ms
+from common import runtime
 
 
 # 🟩 你自己的候選 Lobby IP 列表
@@ -10,12 +12,13 @@ LOBBY_CANDIDATES = [
 ]
 
 LOBBY_PORT = 14110
+MAX_REDIRECTS = 2   # 分片模式：房間在別的分片時，Lobby 回 redirect，最多跟著跳幾次
 
 async def connect_to_lobby():
     """嘗試依序連接多個 Lobby IP，直到成功"""
     for host in LOBBY_CANDIDATES:
         try:
-            reader, writer = await asyncio.open_connection(host, LOBBY_PORT)
+            reader, writer = await runtime.open_connection(host, LOBBY_PORT)
             print(f"✅ 已連線到 Lobby Server：{host}:{LOBBY_PORT}")
             return reader, writer
         except Exception as e:
@@ -23,10 +26,20 @@ async def connect_to_lobby():
     raise ConnectionError("❌ 所有候選 Lobby IP 都無法連線！")
 
 
+REQUEST_TIMEOUT_SEC = 15   # 等 Lobby 回覆的上限（登入要跑 KDF，比一般 request 久）
+
+
 class LobbyClient:
-    """封裝與 Lobby Server 的所有通訊邏輯"""
+    """封裝與 Lobby Server 的所有通訊邏輯
+
+    連上之後有一個背景 reader task 收 Lobby 送來的所有訊息：
+    - request 都帶 rid，回覆依 rid 交給等待中的呼叫端，多個 request 可以同時在線上（asyncio.gather）
+    - Lobby 主動推送的事件（{"event": "Room/status" | "Invite/received", "data": {...}}）放進 self.events；
+      連線中斷時放一個 {"event": "Sys/disconnected"}
+    不碰終端機：壓測、機器人之類的腳本可以直接用（verbose=False 連線訊息也不印）。
+    """
 
-    def __init__(self, hosts=None, port=14110):
+    def __init__(self, hosts=None, port=14110, verbose=True):
         self.hosts = hosts or [
             "140.113.66.30",   # my ip 
             "140.113.17.11",   # school ip
@@ -34,40 +47,148 @@ class LobbyClient:
         
         self.host = self.hosts[0]  # 預設使用第一個 host
         self.port = port
+        self.verbose = verbose
         self.reader = None
         self.writer = None
         self.user_id = None
         self.username = None
-        self.lock = asyncio.Lock()
+        self.session = None        # Lobby 發的 session token（重連、進遊戲用）
+        self.lock = asyncio.Lock()         # 寫入用：同時送出的 request 不會交錯
+        self.switch_lock = asyncio.Lock()  # 換分片連線時，其他 request 先等
+        self.pending = {}          # rid -> Future：目前這條連線上還在等回覆的 request
+        self.rid = 0
+        self.events = asyncio.Queue()
+        self.clock = ClockSync()   # 與 Lobby 之間的 RTT / 時鐘差
+
+    def _say(self, text):
+        if self.verbose:
+            print(text)
 
     async def connect(self):
         """嘗試多個 IP，直到成功連線到 Lobby"""
         for host in self.hosts:
             try:
-                print(f"🔍 嘗試連線 Lobby：{host}:{self.port} ...")
-                self.reader, self.writer = await asyncio.open_connection(host, self.port)
-                self.host = host
-                print(f"✅ 已連線到 Lobby Server：{host}:{self.port}")
+                self._say(f"🔍 嘗試連線 Lobby：{host}:{self.port} ...")
+                await self._open(host, self.port)
+                self._say(f"✅ 已連線到 Lobby Server：{host}:{self.port}")
+                await self.ping()
+                if self.session:
+                    # 重連：用 session 接回登入狀態，不用再送密碼
+                    await self.resume()
                 return True
             except Exception as e:
-                print(f"⚠️ 無法連線 {host}:{self.port} ({e})")
-        print("❌ 所有候選 IP 都無法連線！")
+                self._say(f"⚠️ 無法連線 {host}:{self.port} ({e})")
+        self._say("❌ 所有候選 IP 都無法連線！")
         return False
 
+    async def _open(self, host, port):
+        """開新連線、換掉目前的連線，並啟動它的 reader task"""
+        reader, writer = await runtime.open_connection(host, port)
+        self.reader, self.writer = reader, writer
+        self.host, self.port = host, port
+        self.pending = {}
+        asyncio.create_task(self._read_loop(reader, writer, self.pending))
+
+    async def _read_loop(self, reader, writer, pending):
+        """收這條連線上的所有訊息：回覆交給 pending 裡的 Future，事件放進 self.events"""
+        error = None
+        try:
+            while True:
+                msg = await recv_msg(reader)
+                if "event" in msg and "rid" not in msg:
+                    self.events.put_nowait(msg)
+                    continue
+                # 舊版 Lobby 不回 rid：一問一答、依序處理，回覆的就是最早送出的那個
+                rid = msg.pop("rid", None)
+                fut = pending.pop(rid if rid is not None else next(iter(pending), None), None)
+                if fut is not None and not fut.done():
+                    fut.set_result(msg)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError, ValueError) as e:
+            error = e
+        finally:
+            writer.close()
+            for fut in pending.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError("Lobby 連線中斷"))
+            pending.clear()
+            # 自己 close() 或換分片換掉的連線不算斷線
+            if self.writer is writer:
+                self.writer = None
+                self.events.put_nowait({"event": "Sys/disconnected", "data": {"error": str(error or "")}})
 
     async def close(self):
-        if self.writer:
-            self.writer.close()
-            await self.writer.wait_closed()
+        writer, self.writer = self.writer, None
+        if writer:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def next_event(self, timeout=None):
+        """等下一個 Lobby 推送的事件；timeout 秒內沒有就回傳 None"""
+        try:
+            return await asyncio.wait_for(self.events.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
 
     # -------------------------------
     # 封裝請求/回應機制
     # -------------------------------
     async def _req(self, collection, action, data=None):
         req = {"collection": collection, "action": action, "data": data or {}}
-        async with self.lock:  # ✅ 同步鎖
-            await send_msg(self.writer, req)
-            return await recv_msg(self.reader)
+        for _ in range(MAX_REDIRECTS + 1):
+            writer = self.writer
+            try:
+                resp = await self._send(req)
+            except ConnectionError:
+                # 另一個 request 剛好把連線換到別的分片：舊連線上沒等到的回覆，到新連線再送一次
+                if self.writer is None or self.writer is writer:
+                    raise
+                continue
+            target = resp.get("redirect")
+            if not target:
+                return resp
+            # 房間在別的 Lobby 分片：換連線過去（session 接回登入狀態）再送一次
+            await self._follow(target)
+            req["data"] = {**req["data"], **target.get("data", {})}
+        return resp
+
+    async def _send(self, req):
+        """送出一個 request（帶 rid），等到同一個 rid 的回覆"""
+        if self.writer is None:
+            raise ConnectionError("尚未連線到 Lobby")
+        self.rid += 1
+        rid = self.rid
+        writer, pending = self.writer, self.pending
+        fut = asyncio.get_running_loop().create_future()
+        pending[rid] = fut
+        try:
+            async with self.lock:
+                await send_msg(writer, {**req, "rid": rid})
+            return await asyncio.wait_for(fut, timeout=REQUEST_TIMEOUT_SEC)
+        finally:
+            pending.pop(rid, None)
+
+    async def _follow(self, target):
+        async with self.switch_lock:
+            if (self.host, self.port) == (target["host"], target["port"]):
+                return          # 同時送出的其他 request 已經換過去了
+            old = self.writer
+            await self._open(target["host"], target["port"])
+            if old:
+                old.close()
+            self._say(f"➡️ 已切換到 Lobby 分片 {target.get('shard')}：{self.host}:{self.port}")
+            if self.session:
+                await self.resume()
+
+    async def ping(self):
+        """量一次 RTT 並更新時鐘差，回傳這次的 RTT（ms）；舊版 Lobby 不支援就回傳 None"""
+        t0 = now_ms()
+        resp = await self._req("Sys", "ping", {"t0": t0})
+        if not resp.get("ok") or "t1" not in resp:
+            return None
+        return self.clock.sample(t0, resp["t1"], resp["t2"])
 
     # -------------------------------
     # 使用者相關
@@ -77,6 +198,7 @@ class LobbyClient:
         if resp.get("ok"):
             self.user_id = resp["id"]
             self.username = name
+            self.session = resp.get("session")
         return resp
 
     async def login(self, name, password):
@@ -84,6 +206,18 @@ class LobbyClient:
         if resp.get("ok"):
             self.user_id = resp["id"]
             self.username = name
+            self.session = resp.get("session")
+        return resp
+
+    async def resume(self):
+        """用 session token 恢復登入（Lobby 只驗章，不查 DB）；失效就清掉，需要重新登入"""
+        resp = await self._req("User", "resume", {"session": self.session})
+        if resp.get("ok"):
+            self.user_id = resp["id"]
+            self.username = resp["name"]
+            self.session = resp.get("session", self.session)
+        else:
+            self.user_id = self.username = self.session = None
         return resp
 
     async def logout(self):
@@ -93,6 +227,7 @@ class LobbyClient:
         if resp.get("ok"):
             self.user_id = None
             self.username = None
+            self.session = None
         return resp
 
     async def list_online_users(self):
@@ -105,13 +240,14 @@ class LobbyClient:
         data = {"only_available": only_available}
         return await self._req("Room", "list", data)
 
-    async def create_room(self, name, visibility="public", password=None):
+    async def create_room(self, name, visibility="public", password=None, max_players=2):
         if not self.user_id:
             return {"ok": False, "error": "請先登入"}
         
         data = {"name": name, 
                 "host_user_id": self.user_id, 
-                "visibility": visibility}
+                "visibility": visibility,
+                "max_players": max_players}
         if password:
             data["password"] = password
         
@@ -142,6 +278,22 @@ class LobbyClient:
 
         data = {"room_id": room_id, "user_id": self.user_id}
         return await self._req("Room", "leave", data)
+
+    async def room_status(self, room_id):
+        """房間目前的狀態（房裡的人變動時 Lobby 也會推送 Room/status 事件）"""
+        return await self._req("Room", "status", {"room_id": room_id, "user_id": self.user_id})
+
+    async def kick(self, room_id, user_id=None):
+        """房主踢人；沒指定 user_id 就踢最後加入的"""
+        return await self._req("Room", "kick", {"room_id": room_id, "user_id": user_id})
+
+    async def watch_room(self, room_id):
+        """取得觀戰要連的 game server / 轉播節點"""
+        return await self._req("Room", "watch", {"room_id": room_id})
+
+    async def start_game(self, room_id):
+        """房主開始遊戲，回傳 game server 的 host / port"""
+        return await self._req("Game", "start", {"room_id": room_id})
     # -------------------------------
     # 邀請相關
     # -------------------------------
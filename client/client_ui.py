@@ -1,10 +1,55 @@
 import asyncio
 from client.client_net import LobbyClient
+from common import runtime
 import os
-import time
-import msvcrt
 import subprocess
+import sys
+import threading
 
+STATUS_REFRESH_SEC = 10   # 等待房間時，沒收到 Room/status 事件也每隔幾秒自己查一次
+
+
+# -------------------------------
+# 終端機輸入（不擋住 event loop）
+# -------------------------------
+# stdin 由背景 thread 一行一行讀進 queue，等玩家輸入的時候 LobbyClient 的 reader task 照樣在收回覆和事件；
+# 等待房間的畫面同時等「玩家輸入」和「Lobby 推送的事件」，誰先到就處理誰（選項輸入後按 Enter）。
+stdin_lines = None
+
+
+def start_stdin_reader():
+    global stdin_lines
+    stdin_lines = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+
+    def read():
+        for line in sys.stdin:
+            loop.call_soon_threadsafe(stdin_lines.put_nowait, line.rstrip("\r\n"))
+        loop.call_soon_threadsafe(stdin_lines.put_nowait, None)     # EOF
+
+    threading.Thread(target=read, daemon=True).start()
+
+
+async def ainput(prompt=""):
+    """input() 的非同步版本"""
+    print(prompt, end="", flush=True)
+    line = await stdin_lines.get()
+    if line is None:
+        raise EOFError
+    return line
+
+
+async def run_child(args):
+    """開遊戲 / 觀戰視窗並等它結束（在 thread 裡等，event loop 照跑）"""
+    await asyncio.to_thread(subprocess.run, ["python", "-m", *args])
+
+
+def drain_events(client):
+    """取出目前累積的 Lobby 事件"""
+    events = []
+    while not client.events.empty():
+        events.append(client.events.get_nowait())
+    return events
 
 
 async def login_phase(client: LobbyClient):
@@ -16,11 +61,11 @@ async def login_phase(client: LobbyClient):
         print("1. 註冊")
         print("2. 登入")
         print("0. 離開")
-        cmd = input("請輸入指令：").strip()
+        cmd = (await ainput("請輸入指令：")).strip()
 
         if cmd == "1":
-            name = input("使用者名稱：")
-            pw = input("密碼：")
+            name = await ainput("使用者名稱：")
+            pw = await ainput("密碼：")
             resp = await client.register(name, pw)
             
             if resp.get("ok"):
@@ -35,19 +80,19 @@ async def login_phase(client: LobbyClient):
                     print("⚠️ 此使用者名稱已被註冊，請換一個。")
                 else:
                     print(f"❌ 註冊失敗：{error_msg}")
-            time.sleep(1.5)
+            await asyncio.sleep(1.5)
             
 
         elif cmd == "2":
-            name = input("使用者名稱：")
-            pw = input("密碼：")
+            name = await ainput("使用者名稱：")
+            pw = await ainput("密碼：")
             resp = await client.login(name, pw)
             #print("📥", resp)
             
             #login successful
             if resp.get("ok"):
                 print(f"✅ 登入成功！歡迎，{resp.get('name', name)}！")
-                time.sleep(1)
+                await asyncio.sleep(1)
                 return True
             
             #login failed
@@ -64,7 +109,7 @@ async def login_phase(client: LobbyClient):
                     print("⚠️ 該帳號已在其他地方登入。")
                 else:
                     print(f"❌ 登入失敗：{error_msg}")
-            time.sleep(1.5)
+            await asyncio.sleep(1.5)
 
         elif cmd == "0":
             return False
@@ -73,10 +118,14 @@ async def login_phase(client: LobbyClient):
         
 
 async def lobby_phase(client: LobbyClient):
+    new_invites = 0
     while True:
         clear_screen()
+        new_invites += sum(ev["event"] == "Invite/received" for ev in drain_events(client))
         
         print(f"\n🎮 玩家：{client.username}")
+        if new_invites:
+            print(f"📨 你有 {new_invites} 個新邀請（選 5 查看）")
         print("1. 顯示線上使用者")
         print("2. 顯示房間清單")
         print("3. 建立房間")
@@ -84,7 +133,7 @@ async def lobby_phase(client: LobbyClient):
         print("5. 查看邀請")
         print("6. 觀戰遊戲")
         print("7. 登出")
-        cmd = input("請輸入指令：").strip()
+        cmd = (await ainput("請輸入指令：")).strip()
 
         if cmd == "1":
             clear_screen()
@@ -105,7 +154,7 @@ async def lobby_phase(client: LobbyClient):
                     for i, name in enumerate(others, start=1):
                         print(f"{i}. {name}")
 
-            input("\n🔙 按下 Enter 鍵返回選單...")
+            await ainput("\n🔙 按下 Enter 鍵返回選單...")
 
         elif cmd == "2":
             clear_screen()
@@ -119,9 +168,9 @@ async def lobby_phase(client: LobbyClient):
             else:
                 # 逐筆列出
                 for i, r in enumerate(rooms, start=1):
-                    print(f"{i}. {r['name']}（房主：{r['host']}，類型：{r['visibility']}）")
+                    print(f"{i}. {r['name']}（房主：{r['host']}，類型：{r['visibility']}，人數：{r.get('players', 1)}/{r.get('max_players', 2)}）")
 
-            input("\n🔙 按下 Enter 鍵返回選單...")
+            await ainput("\n🔙 按下 Enter 鍵返回選單...")
 
         elif cmd == "3":
             finish = False
@@ -132,13 +181,13 @@ async def lobby_phase(client: LobbyClient):
                 print("\n🏠 建立新房間(輸入0結束創房)")
 
                 # 房間名稱
-                name = input("請輸入房間名稱：").strip()
+                name = (await ainput("請輸入房間名稱：")).strip()
                 if name == "0":
                     finish = True
                     break
                 elif not name:
                     print("❌ 房間名稱不能為空！")
-                    time.sleep(1)
+                    await asyncio.sleep(1)
                     continue
                 else:
                     break
@@ -152,17 +201,17 @@ async def lobby_phase(client: LobbyClient):
                 print("\n🏠 建立新房間(輸入0結束創房)")
                 print(f"房間名稱：{name}\n")
                 
-                visibility = input("請選擇房間類型（1=公開 / 2=私有）：").strip()
+                visibility = (await ainput("請選擇房間類型（1=公開 / 2=私有）：")).strip()
                 if visibility == "1":
                     visibility = "public"
                     password = None
                     break
                 elif visibility == "2":
                     visibility = "private"
-                    password = input("請輸入房間密碼：").strip()
+                    password = (await ainput("請輸入房間密碼：")).strip()
                     if not password:
                         print("❌ 密碼不能為空！")
-                        time.sleep(1)
+                        await asyncio.sleep(1)
                         continue
                     break
                 elif visibility == "0":
@@ -173,22 +222,33 @@ async def lobby_phase(client: LobbyClient):
             
             if finish:
                 continue
+
+            # 房間人數（含房主）
+            while True:
+                n = (await ainput("請輸入房間人數（2~16，直接 Enter = 2）：")).strip()
+                if not n:
+                    max_players = 2
+                    break
+                if n.isdigit() and 2 <= int(n) <= 16:
+                    max_players = int(n)
+                    break
+                print("⚠️ 請輸入 2~16 的數字。")
             
             # ✅ 建立房間
-            resp = await client.create_room(name, visibility=visibility, password=password)
+            resp = await client.create_room(name, visibility=visibility, password=password, max_players=max_players)
 
             # 顯示結果
             if resp.get("ok"):
                 print(f"✅ 房間「{name}」建立成功！（類型：{visibility}）")
-                time.sleep(1)
+                await asyncio.sleep(1)
                 
                 await room_wait_phase(client, resp["room_id"], name)
             else:
                 print(f"❌ 建立失敗：{resp.get('error', '未知錯誤')}")
-                time.sleep(1)
+                await asyncio.sleep(1)
                 continue
 
-            input("\n🔙 按下 Enter 鍵返回選單...")
+            await ainput("\n🔙 按下 Enter 鍵返回選單...")
 
         elif cmd == "4":
             finish = False
@@ -202,22 +262,22 @@ async def lobby_phase(client: LobbyClient):
 
                 if not rooms:
                     print("（目前沒有可加入的房間）")
-                    input("\n🔙 按下 Enter 鍵返回選單...")
+                    await ainput("\n🔙 按下 Enter 鍵返回選單...")
                     finish = True
                     break
                 
                 print("\n📋 可加入的房間清單：")
                 for i, r in enumerate(rooms, start=1):
-                    print(f"   {i}. {r['name']}（房主：{r['host']}，類型：{r['visibility']}）")
+                    print(f"   {i}. {r['name']}（房主：{r['host']}，類型：{r['visibility']}，人數：{r.get('players', 1)}/{r.get('max_players', 2)}）")
                 
                 try:
-                    choice = int(input("\n請輸入要加入的房間 ID（0 返回）：").strip())
+                    choice = int((await ainput("\n請輸入要加入的房間 ID（0 返回）：")).strip())
                     if choice == 0:
                         finish = True
                         break
                 except ValueError:
                     print("⚠️ 請輸入有效的房間 ID。")
-                    time.sleep(1)
+                    await asyncio.sleep(1)
                     continue
                 
                 if 1 <= choice <= len(rooms):
@@ -225,19 +285,19 @@ async def lobby_phase(client: LobbyClient):
                     rid = target_room["id"]
                 else:
                     print("❌ 沒有這個房間。")
-                    time.sleep(1)
+                    await asyncio.sleep(1)
                     continue
 
                 # 判斷是否需要密碼
                 password = None
                 if target_room["visibility"] == "private":
-                    password = input("請輸入房間密碼（輸入 0 返回）：").strip()
+                    password = (await ainput("請輸入房間密碼（輸入 0 返回）：")).strip()
                     if password == "0":
                         finish = True
                         break
                     elif not password:
                         print("⚠️ 密碼不能為空。")
-                        time.sleep(1)
+                        await asyncio.sleep(1)
                         continue
 
                 # 如果選擇的房間沒問題就跳出迴圈
@@ -250,15 +310,16 @@ async def lobby_phase(client: LobbyClient):
             resp = await client.join_room(rid, password)
             if resp and resp.get("ok"):
                 print(f"✅ 成功加入房間：{target_room['name']} (ID={rid})")
-                time.sleep(1)
+                await asyncio.sleep(1)
                 # 這裡可選擇進入房內等待畫面
                 await asyncio.sleep(1) 
                 await guest_wait_phase(client, rid, target_room["name"])
             else:
                 print(f"❌ 加入失敗：{resp.get('error', '未知錯誤')}")
-                input("\n🔙 按下 Enter 鍵返回選單...")
+                await ainput("\n🔙 按下 Enter 鍵返回選單...")
 
         elif cmd == "5":
+            new_invites = 0
             await invite_manage_phase(client)
         
         elif cmd == "6":
@@ -274,7 +335,7 @@ async def lobby_phase(client: LobbyClient):
 
                 if not rooms:
                     print("（目前沒有可觀戰的房間）")
-                    input("\n🔙 按下 Enter 鍵返回選單...")
+                    await ainput("\n🔙 按下 Enter 鍵返回選單...")
                     finish = True
                     break
                 
@@ -283,13 +344,13 @@ async def lobby_phase(client: LobbyClient):
                     print(f"   {i}. {r['name']}（房主：{r['host']}）")
                 
                 try:
-                    choice = int(input("\n請輸入要觀戰的房間 ID（0 返回）：").strip())
+                    choice = int((await ainput("\n請輸入要觀戰的房間 ID（0 返回）：")).strip())
                     if choice == 0:
                         finish = True
                         break
                 except ValueError:
                     print("⚠️ 請輸入有效的房間 ID。")
-                    time.sleep(1)
+                    await asyncio.sleep(1)
                     continue
                 
                 if 1 <= choice <= len(rooms):
@@ -297,7 +358,7 @@ async def lobby_phase(client: LobbyClient):
                     rid = target_room["id"]
                 else:
                     print("❌ 沒有這個房間。")
-                    time.sleep(1)
+                    await asyncio.sleep(1)
                     continue
 
                 # 如果選擇的房間沒問題就跳出迴圈
@@ -308,7 +369,7 @@ async def lobby_phase(client: LobbyClient):
             
             clear_screen()
             
-            resp = await client._req("Room", "watch", {"room_id": rid})
+            resp = await client.watch_room(rid)
             
             host = resp.get("game_host")
             port = resp.get("game_port")
@@ -316,9 +377,9 @@ async def lobby_phase(client: LobbyClient):
             if host and port:
                 #✅ 觀戰連線
                 print(f"🎮 連線到遊戲伺服器 {host}:{port} ...")
-                subprocess.run(["python","-m","game.game_watch", host, str(port)])
+                await run_child(["game.game_watch", host, str(port)])
                 
-                input("\n🔙 按下 Enter 鍵返回選單...")
+                await ainput("\n🔙 按下 Enter 鍵返回選單...")
 
         elif cmd == "7":
             resp = await client.logout()
@@ -328,7 +389,7 @@ async def lobby_phase(client: LobbyClient):
             else:
                 print(f"⚠️ 登出失敗：{resp.get('error', '未知錯誤')}")
 
-            time.sleep(1)
+            await asyncio.sleep(1)
             return
 
 
@@ -336,87 +397,114 @@ async def lobby_phase(client: LobbyClient):
             print("❌ 無效指令。")
 
 
-async def room_wait_phase(client, room_id, room_name):
-    """房主等待其他玩家加入的階段（非阻塞鍵盤輸入版）"""
-    guest_joined = False
-    guest_name = None
-    stop_flag = False
-    last_guest_state = None
-    press_button = 0
-    last_refresh = 0
-
-    async def check_guest_join():
-        """背景任務：每秒檢查房間狀態"""
-        nonlocal guest_joined, guest_name, stop_flag
-        while not stop_flag:
-            try:
-                # 向伺服器查詢房間狀態
-                resp = await client._req("Room", "status", {"room_id": room_id})
-                if resp and resp.get("ok"):
-                    guest_joined = resp.get("guest_joined", False)
-                    guest_name = resp.get("guest_name", None)
-                else:
-                    guest_joined = False
-                    guest_name = None
-            except Exception as e:
-                # 不中斷 loop，只印出錯誤
-                print(f"⚠️ 無法檢查房間狀態：{e}")
-            await asyncio.sleep(1)
+async def next_input(client, pending):
+    """同時等玩家輸入和 Lobby 推送的事件，回傳這次到的 [("key", line) / ("event", msg)]
+
+    pending 放還沒等到的 task，下次接著等（兩個同時到也不會漏掉）；STATUS_REFRESH_SEC 內都沒有就回傳 []
+    """
+    if "key" not in pending:
+        pending["key"] = asyncio.ensure_future(stdin_lines.get())
+    if "event" not in pending:
+        pending["event"] = asyncio.ensure_future(client.events.get())
+    done, _ = await asyncio.wait(pending.values(), timeout=STATUS_REFRESH_SEC, return_when=asyncio.FIRST_COMPLETED)
+    ready = [(kind, task.result()) for kind, task in pending.items() if task in done]
+    for kind, item in ready:
+        pending.pop(kind)
+        if kind == "key" and item is None:
+            raise EOFError
+    return ready
 
-    # 啟動背景檢查任務
-    listener = asyncio.create_task(check_guest_join())
+
+def drop_key_wait(pending):
+    """接下來要直接用 ainput 讀一行：先收掉 next_input 還在等的 stdin task，不然第一個 Enter 會被它吃掉"""
+    task = pending.pop("key", None)
+    if task is not None:
+        task.cancel()
+
+
+def room_event(item, room_id):
+    """Lobby 事件 → 這個房間的新狀態（不是這個房間的 Room/status 就回傳 None）；連線中斷丟 ConnectionError"""
+    if item["event"] == "Sys/disconnected":
+        raise ConnectionError("與 Lobby 的連線中斷")
+    data = item.get("data", {})
+    if item["event"] == "Room/status" and data.get("room_id") == room_id:
+        return data
+    return None
+
+
+async def room_wait_phase(client, room_id, room_name):
+    """房主等待其他玩家加入的階段：畫面跟著 Lobby 推送的 Room/status 更新"""
+    drain_events(client)
+    status = await client.room_status(room_id)
+    pending = {}
+    redraw = True
 
     try:
         while True:
-            if (guest_joined != last_guest_state) or (time.time() - last_refresh > 10) \
-                or press_button == 2:
+            guest_joined = status.get("guest_joined", False)
+            guest_name = status.get("guest_name")
+            players = (status.get("players", 2 if guest_joined else 1), status.get("max_players", 2))
+
+            if redraw:
                 clear_screen()
-                press_button = 0
+                redraw = False
                 print(f"\n🏠 房間等待中：{room_name} (ID={room_id})")
                 if guest_joined:
-                    print(f"🎉 玩家 {guest_name} 已加入！")
+                    print(f"🎉 玩家 {guest_name} 已加入！（{players[0]}/{players[1]}）")
                     print("【1】開始遊戲")
-                    print("【2】踢出玩家")
+                    print("【2】踢出玩家（最後加入的）")
                     print("【3】解散房間")
+                    if players[0] < players[1]:
+                        print("【4】繼續邀請")
                 else:
                     print("（等待其他玩家加入...）")
                     print("【1】顯示線上使用者")
                     print("【2】發送邀請")
                     print("【3】離開並關閉房間")
-                #print("\n💡 畫面會在狀態改變時更新")
-                last_refresh = time.time()
-                last_guest_state = guest_joined
+                print("\n💡 輸入選項後按 Enter，有玩家進出時畫面會自動更新")
+
+            ready = await next_input(client, pending)
+            if not ready:
+                # 一段時間沒有事件：自己查一次（保險用）
+                resp = await client.room_status(room_id)
+                if resp != status:
+                    status, redraw = resp, True
+                continue
 
-            # 🔹 非阻塞鍵盤讀取
-            if msvcrt.kbhit():
-                key = msvcrt.getch().decode("utf-8", errors="ignore")
+            for kind, item in ready:
+                if kind == "event":
+                    new_status = room_event(item, room_id)
+                    if new_status is not None and new_status.get("ok"):
+                        status, redraw = new_status, True
+                    continue
+
+                key = item.strip()
+                redraw = True
+
+                # 房間還沒滿：【4】走下面「發送邀請」的流程
+                invite_more = guest_joined and key == "4" and players[0] < players[1]
 
                 # --- 已有 guest 的選單 ---
-                if guest_joined:
+                if guest_joined and not invite_more:
                     if key == "1":  # 開始遊戲
                         clear_screen()
                         print("🚀 開始遊戲！")
-                        resp = await client._req("Game", "start", {"room_id": room_id})
+                        resp = await client.start_game(room_id)
 
                         if resp.get("ok"):
                             host = resp.get("game_host")
                             port = resp.get("game_port")
                             print(f"🎮 啟動遊戲客戶端連線到 {host}:{port}")
 
-                            #print(f"🧩 啟動參數：['python', '-m', 'game.game_server', '{port}','{client.user_id}']")
-                            subprocess.run(["python", "-m", "game.client_game", host, str(port), str(client.user_id)])
+                            await run_child(["game.client_game", host, str(port), str(client.user_id), client.session or ""])
                             await client.close_room(room_id)
                         else:
                             print(f"⚠️ 無法啟動遊戲：{resp.get('error')}")
-
-                        stop_flag = True
-                        break
+                        return
 
                     elif key == "2":  # 踢出玩家
                         print(f"👢 已將 {guest_name} 踢出。")
-                        await client._req("Room", "kick", {"room_id": room_id})
-                        guest_joined = False
-                        guest_name = None
+                        await client.kick(room_id)
                         await asyncio.sleep(1)
 
                     elif key == "3":  # 解散
@@ -425,14 +513,14 @@ async def room_wait_phase(client, room_id, room_name):
                             print(f"👋 已關閉房間「{room_name}」")
                         else:
                             print(f"⚠️ 關閉失敗：{resp.get('error', '未知錯誤')}")
-                        stop_flag = True
-                        break
+                        return
 
                 # --- 沒 guest 的選單 ---
                 else:
+                    if invite_more:
+                        key = "2"
                     if key == "1":
                         clear_screen()
-                        press_button = 1
                         resp = await client.list_online_users()
                         users = resp.get("users", [])
                         others = [name for uid, name in users if uid != client.user_id]
@@ -442,28 +530,24 @@ async def room_wait_phase(client, room_id, room_name):
                         else:
                             for i, name in enumerate(others, start=1):
                                 print(f"   {i}. {name}")
-                        input("\n🔙 按下 Enter 鍵返回...")
-                        press_button = 2
+                        await ainput("\n🔙 按下 Enter 鍵返回...")
 
                     elif key == "2":
                         clear_screen()
-                        press_button = 1
                         resp = await client.list_online_users()
                         users = resp.get("users", [])
                         others = [(uid, name) for uid, name in users if uid != client.user_id]
                         if not others:
                             print("⚠️ 目前沒有其他線上玩家可邀請。")
                             await asyncio.sleep(1)
-                            press_button = 2
                             continue
 
                         print("\n📨 選擇要邀請的玩家：")
                         for i, (_, name) in enumerate(others, start=1):
                             print(f"   {i}. {name}")
 
-                        choice = input("輸入編號（0 取消）：").strip()
+                        choice = (await ainput("輸入編號（0 取消）：")).strip()
                         if choice == "0":
-                            press_button = 2
                             continue
                         try:
                             index = int(choice) - 1
@@ -473,11 +557,10 @@ async def room_wait_phase(client, room_id, room_name):
                                 print(f"✅ 已發送邀請給 {target_name}")
                             else:
                                 print(f"❌ 邀請失敗：{resp.get('error')}")
-                                input("\n🔙 按下 Enter 鍵返回...")
+                                await ainput("\n🔙 按下 Enter 鍵返回...")
                         except (ValueError, IndexError):
                             print("⚠️ 無效輸入。")
                         await asyncio.sleep(1)
-                        press_button = 2
 
                     elif key == "3":
                         resp = await client.close_room(room_id)
@@ -485,94 +568,82 @@ async def room_wait_phase(client, room_id, room_name):
                             print(f"👋 已關閉房間「{room_name}」")
                         else:
                             print(f"⚠️ 關閉失敗：{resp.get('error', '未知錯誤')}")
-                        stop_flag = True
-                        break
-
-            await asyncio.sleep(0.05)  # 稍微讓出 CPU
+                        return
 
     finally:
-        stop_flag = True
-        listener.cancel()
+        for task in pending.values():
+            task.cancel()
 
 
 async def guest_wait_phase(client, room_id, room_name):
-    """加入者等待房主開始遊戲（無需重整畫面）"""
-    stop_flag = False
-
-    async def check_room_status():
-        """背景任務：定期檢查房間狀態"""
-        nonlocal stop_flag
-        while not stop_flag:
-            try:
-                resp = await client._req("Room", "status", {"room_id": room_id})
-                if not resp or not resp.get("ok"):
-                    print("\n❌ 房間已被解散。")
-                    await asyncio.sleep(1)
-                    stop_flag = True
-                    break
+    """加入者等待房主開始遊戲：房主開始、踢人、解散都由 Lobby 推送 Room/status 通知"""
 
-                status = resp.get("status")
-                guest_id = resp.get("guest_id")
+    async def on_status(resp):
+        """看房間狀態決定下一步；回傳 True 表示離開等待畫面"""
+        if not resp or not resp.get("ok"):
+            print("\n❌ 房間已被解散。")
+            await asyncio.sleep(1)
+            return True
 
-                if not guest_id:
-                    print("\n👢 你已被房主踢出房間。")
-                    await asyncio.sleep(1)
-                    stop_flag = True
-                    break
+        if not resp.get("in_room", resp.get("guest_id")):
+            print("\n👢 你已被房主踢出房間。")
+            await asyncio.sleep(1)
+            return True
 
-                if status == "play":
-                    clear_screen()
-                    print("\n🚀 房主已開始遊戲！")
-                    
-                    game_host = resp.get("game_host")
-                    game_port = resp.get("game_port")
-                    
-                    if game_host and game_port:
-                        print(f"🎮 連線到遊戲伺服器 {game_host}:{game_port} ...")
-
-                        #print(f"🧩 啟動參數：['python', '-m', 'game.game_server', '{game_port}','''{client.user_id}']")
-                        subprocess.run(["python","-m","game.client_game", game_host, str(game_port),str(client.user_id)])
-                        input("\n🔙 按下 Enter 鍵返回選單...")
-                    else:
-                        print("⚠️ 無法取得遊戲伺服器資訊 (host/port)")
-                    
-                    stop_flag = True
-                    break
+        if resp.get("status") == "play":
+            clear_screen()
+            print("\n🚀 房主已開始遊戲！")
 
-            except Exception as e:
-                print(f"⚠️ 無法檢查房間狀態：{e}")
-                stop_flag = True
-                break
+            game_host = resp.get("game_host")
+            game_port = resp.get("game_port")
 
-            await asyncio.sleep(1)
+            if game_host and game_port:
+                print(f"🎮 連線到遊戲伺服器 {game_host}:{game_port} ...")
+                await run_child(["game.client_game", game_host, str(game_port), str(client.user_id), client.session or ""])
+                drop_key_wait(pending)        # 這次是事件觸發的，等待畫面的 stdin task 還在
+                await ainput("\n🔙 按下 Enter 鍵返回選單...")
+            else:
+                print("⚠️ 無法取得遊戲伺服器資訊 (host/port)")
+            return True
+        return False
 
     # 顯示一次畫面
+    drain_events(client)
     clear_screen()
     print(f"\n🚪 加入房間：{room_name} (ID={room_id})")
     print("⏳ 等待房主開始遊戲...")
-    print("\n【1】離開房間")
-    
-    listener = asyncio.create_task(check_room_status())
+    print("\n【1】離開房間（輸入後按 Enter）")
 
+    pending = {}
     try:
-        while not stop_flag:
-            if msvcrt.kbhit():
-                key = msvcrt.getch().decode("utf-8", errors="ignore")
-                if key == "1":
+        status = await client.room_status(room_id)
+        while True:
+            if status is not None and await on_status(status):
+                return
+            status = None
+
+            ready = await next_input(client, pending)
+            if not ready:
+                status = await client.room_status(room_id)      # 一段時間沒有事件：自己查一次
+                continue
+
+            for kind, item in ready:
+                if kind == "event":
+                    status = room_event(item, room_id) or status
+                elif item.strip() == "1":
                     resp = await client.leave_room(room_id)
                     if resp.get("ok"):
                         print("👋 你已離開房間。")
-                        stop_flag = True
                         await asyncio.sleep(1)
                     else:
                         print(f"⚠️ 離開失敗：{resp.get('error', '未知錯誤')}")
-                    stop_flag = True
-                    break
+                    return
 
-            await asyncio.sleep(0.05)
+    except (ConnectionError, asyncio.TimeoutError) as e:
+        print(f"⚠️ 無法檢查房間狀態：{e}")
     finally:
-        stop_flag = True
-        listener.cancel()
+        for task in pending.values():
+            task.cancel()
 
 
 async def invite_manage_phase(client):
@@ -590,7 +661,7 @@ async def invite_manage_phase(client):
         invites = resp.get("invites", [])
         if not invites:
             print("📭 目前沒有邀請。")
-            input("\n🔙 按下 Enter 鍵返回主選單...")
+            await ainput("\n🔙 按下 Enter 鍵返回主選單...")
             return
 
         # 顯示邀請列表
@@ -601,7 +672,7 @@ async def invite_manage_phase(client):
         print("例如：1 y ＝ 同意邀請編號 1，2 n ＝ 拒絕邀請編號 2")
         print("輸入 0 返回主選單。")
 
-        cmd = input("\n👉 請輸入指令：").strip()
+        cmd = (await ainput("\n👉 請輸入指令：")).strip()
         if cmd == "0":
             print("🔙 返回主選單...")
             await asyncio.sleep(1)
@@ -638,10 +709,11 @@ async def invite_manage_phase(client):
         else:
             msg = f"⚠️ {resp2.get('error', '無法處理邀請。')}"
             print(msg)
-            input("\n按 Enter 鍵繼續...")
+            await ainput("\n按 Enter 鍵繼續...")
         
 
 async def main():
+    start_stdin_reader()
     client = LobbyClient()
     await client.connect()
     print("✅ 已連線到 Lobby Server")
@@ -663,4 +735,4 @@ def clear_screen():
         os.system("clear")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    runtime.run(main(), report=False)
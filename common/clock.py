@@ -0,0 +1,58 @@
+import time
+
+# -------------------------------
+# NTP 式時間同步
+# -------------------------------
+# 一次 ping/pong 有四個時間戳（ms）：
+#   t0 發送端送出 ping     t1 對方收到 ping
+#   t2 對方送出 pong       t3 發送端收到 pong
+#
+#   rtt    = (t3 - t0) - (t2 - t1)
+#   offset = ((t1 - t0) + (t2 - t3)) / 2      # 對方時鐘 - 本機時鐘
+#
+# 每條連線一個 ClockSync，用 EWMA 平滑；RTT 特別大的那次（排隊、重傳）
+# offset 誤差也大，所以 offset 的權重會隨 RTT 變大而變小。
+
+ALPHA = 0.125            # EWMA 權重（跟 TCP 的 SRTT 一樣）
+PING_INTERVAL_SEC = 1.0
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class ClockSync:
+    def __init__(self):
+        self.rtt_ms = None        # 平滑後的 RTT
+        self.offset_ms = 0.0      # 平滑後的時鐘差（對方 - 本機）
+        self.samples = 0
+
+    def ping(self) -> dict:
+        return {"type": "ping", "t0": now_ms()}
+
+    @staticmethod
+    def pong(ping: dict, t1: int) -> dict:
+        """收到 ping 的一方回覆；t1 是收到 ping 的時間"""
+        return {"type": "pong", "t0": ping.get("t0"), "t1": t1, "t2": now_ms()}
+
+    def sample(self, t0: int, t1: int, t2: int, t3: int = None):
+        """收到 pong 時呼叫，更新 RTT / offset，回傳這一次的 rtt"""
+        t3 = now_ms() if t3 is None else t3
+        rtt = max(0, (t3 - t0) - (t2 - t1))
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        if self.rtt_ms is None:
+            self.rtt_ms = rtt
+            self.offset_ms = offset
+        else:
+            w = ALPHA * min(1.0, self.rtt_ms / rtt) if rtt else ALPHA
+            self.rtt_ms += ALPHA * (rtt - self.rtt_ms)
+            self.offset_ms += w * (offset - self.offset_ms)
+        self.samples += 1
+        return rtt
+
+    def to_local(self, remote_ms: int) -> int:
+        """對方時鐘的時間戳 → 本機時間"""
+        return int(remote_ms - self.offset_ms)
+
+    def to_remote(self, local_ms: int) -> int:
+        return int(local_ms + self.offset_ms)
@@ -0,0 +1,61 @@
+import zlib
+
+# -------------------------------
+# 每條連線的串流壓縮（zlib + 預設字典）
+# -------------------------------
+# snapshot 幾乎都是 0 和單一字母，而且每 100ms 一張、前後兩張差不多。
+# 同一條連線共用一個 compressobj，每個封包結束時 Z_SYNC_FLUSH：
+# 後面的封包可以直接引用前一張 snapshot 的內容，一張 ~1.8KB 的 1v1 snapshot 壓完剩 ~45 bytes。
+# 預設字典（ZDICT）放了 snapshot 的欄位名稱和空棋盤，連線的第一張也壓得動。
+#
+# - 客戶端在 hello 帶 "compress": CODEC 表示收得懂；server 之後送的大封包就會壓縮
+#   （header 的 COMPRESS_FLAG，見 common.network）。字典內容改了就要換 CODEC 版本號
+# - 比 COMPRESS_MIN_BYTES 小的封包（ping、welcome…）照舊不壓
+# - window 縮小到 8KB：每條連線的壓縮狀態 ~48KB（zlib 預設是 ~256KB），觀戰者很多時才撐得住
+
+CODEC = "zlib-v1"
+COMPRESS_MIN_BYTES = 256
+COMPRESS_LEVEL = 6
+WINDOW_BITS = 13
+MEM_LEVEL = 5
+
+_ROW = "[" + ", ".join(["0"] * 10) + "]"
+_PLAYER = ('{"id": 1, "garbage": 0, "score": 0, "level": 0, "lines": 0, "alive": true, "board": ['
+           + ", ".join([_ROW] * 20) + '], "active": {"kind": "T", "x": 3, "y": 0, "rot": 0}, '
+           '"next": ["I", "O", "T", "S", "Z"], "hold": null, "can_hold": true}')
+_PACKED = '"board": [' + ", ".join(['".........."'] * 20) + ']'
+ZDICT = ('{"type": "snapshot", "detail": "thumb", ' + _PACKED + ', "game_over", "winner", '
+         '{"type":"snapshot","server_ms":1700000000000,"players":[' + _PLAYER + ', ' + _PLAYER + ']}').encode("utf-8")
+
+
+class Deflater:
+    """送出端：一條連線一個"""
+
+    def __init__(self, level: int = COMPRESS_LEVEL):
+        self._c = zlib.compressobj(level, zlib.DEFLATED, WINDOW_BITS, MEM_LEVEL, zdict=ZDICT)
+
+    def compress(self, body: bytes) -> bytes:
+        return self._c.compress(body) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+
+class Inflater:
+    """接收端：一條連線一個，封包要照順序解"""
+
+    def __init__(self):
+        self._d = zlib.decompressobj(WINDOW_BITS, zdict=ZDICT)
+
+    def decompress(self, data: bytes, max_len: int) -> bytes:
+        try:
+            out = self._d.decompress(data, max_len)
+        except zlib.error as e:
+            raise ValueError(f"解壓縮失敗: {e}")
+        if self._d.unconsumed_tail:
+            raise ValueError(f"解壓縮後超過 {max_len} bytes")
+        return out
+
+
+def negotiate(outbox, hello: dict) -> bool:
+    """hello 帶了 compress=CODEC：這條連線之後的封包都壓縮"""
+    if hello.get("compress") == CODEC and outbox.deflater is None:
+        outbox.deflater = Deflater()
+    return outbox.deflater is not None
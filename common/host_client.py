@@ -0,0 +1,49 @@
+import asyncio
+
+from common.network import send_msg, recv_msg
+from common.log import get_logger
+from common.metrics import metrics
+from common import runtime
+
+# -------------------------------
+# Lobby → game.game_host 的控制連線
+# -------------------------------
+# 協定跟其他 server 一樣是 Length-prefixed JSON：{"collection": "Host", "action": ..., "data": {...}}
+# Lobby 只 import 這個小 client，不用把 game_server 整包拉進來（跟 lobby.directory.DirectoryClient 一樣）。
+
+log = get_logger("game_host")
+
+CONTROL_HOST = "127.0.0.1"
+CONTROL_PORT = 14120             # Lobby → supervisor
+REQUEST_TIMEOUT_SEC = 5          # 控制連線等回覆的上限（卡住的 worker / supervisor 不會讓 Game/start 一直等）
+
+
+class HostClient:
+    """一條常駐連線、一問一答（跟 DirectoryClient 一樣）"""
+
+    def __init__(self, host: str = CONTROL_HOST, port: int = CONTROL_PORT):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+
+    async def request(self, action: str, **data) -> dict:
+        """超過 REQUEST_TIMEOUT_SEC 沒回覆就斷線、回傳 ok=False（Lobby 改用獨立 process 開局）"""
+        async with self.lock:
+            try:
+                return await asyncio.wait_for(self._call(action, data), timeout=REQUEST_TIMEOUT_SEC)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__      # TimeoutError 沒有訊息
+                metrics.inc("game_host_errors")
+                log.warning("⚠️ Game host 通訊錯誤", action=action, error=error)
+                if self.writer is not None:
+                    self.writer.close()
+                self.reader = self.writer = None
+                return {"ok": False, "error": error}
+
+    async def _call(self, action: str, data: dict) -> dict:
+        if self.writer is None:
+            self.reader, self.writer = await runtime.open_connection(self.host, self.port)
+        await send_msg(self.writer, {"collection": "Host", "action": action, "data": data})
+        return await recv_msg(self.reader)
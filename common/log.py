@@ -0,0 +1,94 @@
+import logging
+import os
+import sys
+import time
+
+# -------------------------------
+# 分級、限流、結構化的 log
+# -------------------------------
+# 用環境變數 NT_LOG 控制等級：debug / info / warning / error / off
+#   NT_LOG=off python -m lobby.lobby_server   → 完全不輸出
+# 同一個 logger 同一則訊息每秒最多輸出 RATE_LIMIT_PER_SEC 次，
+# 超過的部分只計數，下一次放行時附上 suppressed=N。
+
+LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "warn": logging.WARNING,
+    "error": logging.ERROR,
+    "off": logging.CRITICAL + 10,
+}
+
+RATE_LIMIT_PER_SEC = int(os.environ.get("NT_LOG_RATE", "20"))
+
+_configured = False
+
+
+def _configure():
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    level = LEVELS.get(os.environ.get("NT_LOG", "info").lower(), logging.INFO)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-5s %(name)s %(message)s", "%H:%M:%S"))
+    root = logging.getLogger("nt")
+    root.addHandler(handler)
+    root.setLevel(level)
+    root.propagate = False
+
+
+class Log:
+    """包一層 logging.Logger：log.info("訊息", key=value, ...)"""
+
+    def __init__(self, name: str):
+        _configure()
+        self._logger = logging.getLogger(f"nt.{name}")
+        self._window = {}    # msg -> [視窗起點, 視窗內次數, 被壓掉的次數]
+
+    def enabled(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def _allow(self, msg: str) -> int:
+        """回傳 -1 表示丟掉；否則回傳之前被壓掉的次數"""
+        now = time.monotonic()
+        w = self._window.get(msg)
+        if w is None or now - w[0] >= 1.0:
+            suppressed = w[2] if w else 0
+            self._window[msg] = [now, 1, 0]
+            return suppressed
+        if w[1] >= RATE_LIMIT_PER_SEC:
+            w[2] += 1
+            return -1
+        w[1] += 1
+        return 0
+
+    def _log(self, level: int, msg: str, fields: dict):
+        # 等級不夠直接 return，連字串都不組
+        if not self._logger.isEnabledFor(level):
+            return
+        suppressed = self._allow(msg)
+        if suppressed < 0:
+            return
+        if suppressed:
+            fields["suppressed"] = suppressed
+        if fields:
+            msg = msg + " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        self._logger.log(level, msg)
+
+    def debug(self, msg: str, **fields):
+        self._log(logging.DEBUG, msg, fields)
+
+    def info(self, msg: str, **fields):
+        self._log(logging.INFO, msg, fields)
+
+    def warning(self, msg: str, **fields):
+        self._log(logging.WARNING, msg, fields)
+
+    def error(self, msg: str, **fields):
+        self._log(logging.ERROR, msg, fields)
+
+
+def get_logger(name: str) -> Log:
+    return Log(name)
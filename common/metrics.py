@@ -0,0 +1,175 @@
+import asyncio
+import os
+import sys
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from common.network import send_msg, recv_msg
+
+# -------------------------------
+# 行程內的輕量 metrics
+# -------------------------------
+# counter   : 只增不減的計數（每個 collection/action 的請求數…）
+# gauge     : 目前值（send queue 深度、連線數…）
+# histogram : 固定 bucket 的耗時分布（ms），另記 count / sum / max
+#
+# 名稱用 "name{label=value}" 當 key，避免每次都建 tuple/dict。
+# 讀取用 stats endpoint：只綁 127.0.0.1，收到任何封包就回一份 snapshot。
+#   python -m common.metrics 14412     → 印出 DB Server 的統計
+
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+UNKNOWN_REQUEST = {"collection": "unknown", "action": "unknown"}
+
+ENABLED = os.environ.get("NT_METRICS", "1") != "0"
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, v: float):
+        self.counts[bisect_left(BUCKETS_MS, v)] += 1
+        self.count += 1
+        self.total += v
+        if v > self.max:
+            self.max = v
+
+    def quantile(self, q: float):
+        """用 bucket 上界估計分位數"""
+        if not self.count:
+            return 0.0
+        need = q * self.count
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= need:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": round(self.max, 3),
+        }
+
+
+class Registry:
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def key(name: str, labels: dict) -> str:
+        if not labels:
+            return name
+        return name + "{" + ",".join(f"{k}={v}" for k, v in labels.items()) + "}"
+
+    def inc(self, name: str, n: int = 1, **labels):
+        if not ENABLED:
+            return
+        k = self.key(name, labels)
+        self.counters[k] = self.counters.get(k, 0) + n
+
+    def set(self, name: str, value, **labels):
+        if not ENABLED:
+            return
+        self.gauges[self.key(name, labels)] = value
+
+    def unset(self, name: str, **labels):
+        self.gauges.pop(self.key(name, labels), None)
+
+    def observe(self, name: str, ms: float, **labels):
+        if not ENABLED:
+            return
+        k = self.key(name, labels)
+        h = self.histograms.get(k)
+        if h is None:
+            h = self.histograms[k] = Histogram()
+        h.observe(ms)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - t) * 1000, **labels)
+
+    def snapshot(self) -> dict:
+        return {
+            "uptime_sec": round(time.time() - self.started, 1),
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "histograms_ms": {k: h.to_dict() for k, h in self.histograms.items()},
+        }
+
+
+# 每個行程一份
+metrics = Registry()
+
+
+def request_labels(collection, action, known) -> dict:
+    """對方送來的 collection / action 當 label：只收 known 裡的組合，其他一律記成 unknown
+
+    每個 label 組合都會在 registry 留一個 counter / histogram，不能讓連線端任意增加。
+    """
+    if isinstance(collection, str) and isinstance(action, str) and (collection, action) in known:
+        return {"collection": collection, "action": action}
+    return UNKNOWN_REQUEST
+
+
+# -------------------------------
+# stats endpoint
+# -------------------------------
+async def _handle_stats(reader, writer):
+    try:
+        while True:
+            await recv_msg(reader)
+            await send_msg(writer, {"ok": True, "stats": metrics.snapshot()})
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionResetError, OSError):
+            pass
+
+
+async def start_stats_server(port: int, host: str = "127.0.0.1"):
+    """在本機開 stats port；NT_METRICS=0 或 port 被占用時回傳 None"""
+    if not ENABLED:
+        return None
+    try:
+        return await asyncio.start_server(_handle_stats, host, port)
+    except OSError:
+        return None
+
+
+async def fetch_stats(port: int, host: str = "127.0.0.1") -> dict:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        await send_msg(writer, {"collection": "Stats", "action": "get"})
+        return (await recv_msg(reader))["stats"]
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    import json
+    if len(sys.argv) < 2:
+        print("用法: python -m common.metrics <stats_port> [host]")
+        sys.exit(1)
+    stats = asyncio.run(fetch_stats(int(sys.argv[1]), *(sys.argv[2:3])))
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
@@ -1,23 +1,329 @@
+import re
 import struct
 import json
 import asyncio
+from collections import deque
 
-MAX_LEN = 65536
+from common.compress import COMPRESS_MIN_BYTES
+
+MAX_LEN = 65536                      # 單一 frame 的 body 上限
+CHUNK_FLAG = 0x80000000              # header 最高位 = 1：這則訊息後面還有下一塊
+COMPRESS_FLAG = 0x40000000           # 次高位 = 1：body 是壓縮過的（common.compress，連線建立時協商）
+LEN_MASK = 0x3FFFFFFF
+MAX_MESSAGE_LEN = 4 * 1024 * 1024    # 分塊訊息合併後的上限（每條連線同時只會組一則）
+_HEADER = struct.Struct('!I')
+_TYPE_RE = re.compile(rb'\{"type": ?"([A-Za-z0-9_]+)"')   # encode_msg / 手工拼的 snapshot 都把 type 放第一個
+
+# 大訊息（body 超過 MAX_LEN：多人房的 keyframe、很長的房間列表…）拆成多個 frame：
+#   [n1|CHUNK_FLAG][塊 1] [n2|CHUNK_FLAG][塊 2] ... [nk][最後一塊]
+# 每塊最多 MAX_LEN；一般大小的訊息跟以前完全一樣（最高位是 0）。
+# 收端一塊一塊讀，合併後超過 max_message_len 就當作惡意連線（ValueError），不會無限吃記憶體。
+# 壓縮過的訊息每一塊的 header 都帶 COMPRESS_FLAG，合併之後再解壓縮（解壓後一樣受 max_message_len 限制）。
+
+def iter_frames(data: bytes, flags: int = 0):
+    """把 body 切成 frame（小訊息就是一個 frame）"""
+    n = len(data)
+    if n <= MAX_LEN:
+        yield _HEADER.pack(n | flags) + data
+        return
+    if n > MAX_MESSAGE_LEN:
+        raise ValueError(f"封包過大: {n} bytes")
+    view = memoryview(data)
+    for i in range(0, n, MAX_LEN):
+        chunk = view[i:i + MAX_LEN]
+        yield _HEADER.pack(len(chunk) | flags | (CHUNK_FLAG if i + MAX_LEN < n else 0)) + chunk
+
+def pack_frame(data: bytes) -> bytes:
+    """已經是 JSON bytes 的 body 加上長度 header（超過 MAX_LEN 自動分塊）"""
+    n = len(data)
+    if n <= MAX_LEN:
+        return _HEADER.pack(n) + data
+    return b"".join(iter_frames(data))
+
+def encode_msg(obj: dict) -> bytes:
+    """把 JSON 物件編成一個完整封包（header + body），可重複送給多個連線"""
+    return pack_frame(json.dumps(obj, ensure_ascii=False).encode('utf-8'))
 
 async def send_msg(writer: asyncio.StreamWriter, obj: dict):
     """封裝 JSON 封包並以 Length-Prefixed 格式傳送"""
     data = json.dumps(obj, ensure_ascii=False).encode('utf-8')
-    n = len(data)
-    if n > MAX_LEN:
-        raise ValueError(f"封包過大: {n} bytes")
-    writer.write(struct.pack('!I', n) + data)
-    await writer.drain()
+    if len(data) <= MAX_LEN:
+        writer.write(_HEADER.pack(len(data)) + data)
+        await writer.drain()
+        return
+    # 大訊息：一塊一塊寫、每塊都等 drain，transport 的 buffer 裡最多只有一兩塊
+    for frame in iter_frames(data):
+        writer.write(frame)
+        await writer.drain()
+
+async def _recv_chunks(reader: asyncio.StreamReader, header: bytes, max_message_len: int, raw: bool) -> bytes:
+    """讀完一則分塊 / 壓縮的訊息（第一個 header 已經讀到）；raw=True 時保留每塊的 header（轉送用）"""
+    parts = []
+    total = 0
+    while True:
+        (n,) = _HEADER.unpack(header)
+        more = n & CHUNK_FLAG
+        n &= LEN_MASK
+        if not (0 < n <= MAX_LEN):
+            raise ValueError(f"封包長度無效: {n}")
+        total += n
+        if total > max_message_len:
+            raise ValueError(f"訊息過大: 超過 {max_message_len} bytes")
+        if raw:
+            parts.append(header)
+        parts.append(await reader.readexactly(n))
+        if not more:
+            return b"".join(parts)
+        header = await reader.readexactly(4)
 
-async def recv_msg(reader: asyncio.StreamReader):
-    """接收並解析一個完整封包"""
+async def recv_frame(reader: asyncio.StreamReader, max_message_len: int = MAX_MESSAGE_LEN) -> bytes:
+    """接收一個完整封包但不解析，回傳 header + body（轉送用；分塊訊息回傳所有的塊，用 decode_frame 解析）"""
     header = await reader.readexactly(4)
-    (n,) = struct.unpack('!I', header)
+    (n,) = _HEADER.unpack(header)
+    if n & ~LEN_MASK:
+        return await _recv_chunks(reader, header, max_message_len, raw=True)
     if not (0 < n <= MAX_LEN):
         raise ValueError(f"封包長度無效: {n}")
-    body = await reader.readexactly(n)
+    return header + await reader.readexactly(n)
+
+def frame_body(frame: bytes) -> bytes:
+    """封包（可能分塊）去掉 header，接回原本的 body"""
+    (n,) = _HEADER.unpack_from(frame)
+    if not n & CHUNK_FLAG:
+        return frame[4:]
+    view = memoryview(frame)
+    parts = []
+    pos = 0
+    while pos < len(frame):
+        (n,) = _HEADER.unpack_from(view, pos)
+        n &= LEN_MASK
+        parts.append(view[pos + 4:pos + 4 + n])
+        pos += 4 + n
+    return b"".join(parts)
+
+def decode_frame(frame: bytes) -> dict:
+    """解析 recv_frame / encode_msg 產生的封包（沒壓縮的）"""
+    return json.loads(frame_body(frame))
+
+def frame_type(frame: bytes):
+    """只看 body 開頭取出 type（轉送時用來分類，不用整包解析）；開頭不是 type 才整包 decode"""
+    m = _TYPE_RE.match(frame, 4)
+    if m:
+        return m.group(1).decode('ascii')
+    return decode_frame(frame).get("type")
+
+def compress_frame(frame: bytes, deflater) -> bytes:
+    """用這條連線的 Deflater 壓縮一個已編碼的封包；太小的照原樣送"""
+    if len(frame) - 4 < COMPRESS_MIN_BYTES:
+        return frame
+    return b"".join(iter_frames(deflater.compress(frame_body(frame)), COMPRESS_FLAG))
+
+async def recv_msg(reader: asyncio.StreamReader, max_message_len: int = MAX_MESSAGE_LEN, inflater=None):
+    """接收並解析一個完整封包；有協商壓縮的連線要帶這條連線的 Inflater"""
+    if isinstance(reader, FrameProtocol):
+        return await reader.recv()
+    header = await reader.readexactly(4)
+    (n,) = _HEADER.unpack(header)
+    if n & ~LEN_MASK:
+        body = await _recv_chunks(reader, header, max_message_len, raw=False)
+        if n & COMPRESS_FLAG:
+            if inflater is None:
+                raise ValueError("收到壓縮封包，但這條連線沒有協商壓縮")
+            body = inflater.decompress(body, max_message_len)
+    else:
+        if not (0 < n <= MAX_LEN):
+            raise ValueError(f"封包長度無效: {n}")
+        body = await reader.readexactly(n)
     return json.loads(body.decode('utf-8'))
+
+
+# -------------------------------
+# BufferedProtocol 版的收端（高頻的 game server 用）
+# -------------------------------
+# StreamReader + recv_msg 每個封包要兩次 readexactly（header、body），中間還會多做幾次複製。
+# FrameProtocol 讓 kernel 直接 recv_into 一塊預先配置的 buffer，一次收到幾個封包就在 buffer 上用
+# memoryview 切幾個，直接 decode 成 str 給 json.loads，解析好的 dict 放進佇列。
+#
+# - reader：FrameProtocol 本身；recv_msg(reader) 照用，行為跟 StreamReader 版相同
+#   （EOF → IncompleteReadError，長度不合法 / JSON 壞掉 → ValueError）
+# - writer：FrameWriter，介面跟 StreamWriter 一樣（write / drain / close / wait_closed / transport）
+# - 佇列裡沒人讀的封包超過 MAX_PENDING_MSGS 就暫停讀取（對方送太快時靠 TCP 擋回去）
+# - 分塊訊息：每塊複製出來暫存，最後一塊到了才合併解析；合併後超過 max_message_len 就斷線
+#
+# 建立 server 用 runtime.start_server(..., framed=True)。
+
+RECV_BUF_SIZE = 64 * 1024
+MIN_RECV_SPACE = 4096            # buffer 尾端剩不到這麼多就先把未處理的資料搬到最前面
+MAX_PENDING_MSGS = 256
+
+
+class FrameWriter:
+    """FrameProtocol 的送出端"""
+
+    def __init__(self, transport, protocol):
+        self.transport = transport
+        self._protocol = protocol
+
+    def write(self, data: bytes):
+        self.transport.write(data)
+
+    async def drain(self):
+        await self._protocol.wait_writable()
+
+    def is_closing(self) -> bool:
+        return self.transport.is_closing()
+
+    def close(self):
+        self.transport.close()
+
+    async def wait_closed(self):
+        await self._protocol.closed
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+
+class FrameProtocol(asyncio.BufferedProtocol):
+    def __init__(self, client_connected_cb=None, max_message_len: int = MAX_MESSAGE_LEN):
+        self.client_connected_cb = client_connected_cb
+        self.max_message_len = max_message_len
+        self.parts = []              # 分塊訊息目前收到的塊
+        self.parts_len = 0
+        self.buf = bytearray(RECV_BUF_SIZE)
+        self.view = memoryview(self.buf)
+        self.start = 0               # 還沒解析的資料：buf[start:end]
+        self.end = 0
+        self.messages = deque()
+        self.error = None            # 佇列讀完之後要丟出的例外
+        self.eof = False
+        self.transport = None
+        self.writer = None
+        self.task = None
+        self._loop = asyncio.get_running_loop()
+        self._waiter = None          # recv() 等下一個封包
+        self._read_paused = False
+        self._write_paused = False
+        self._drain_waiters = deque()
+        self.closed = self._loop.create_future()
+
+    # ---- asyncio callbacks ----
+    def connection_made(self, transport):
+        self.transport = transport
+        self.writer = FrameWriter(transport, self)
+        if self.client_connected_cb is not None:
+            self.task = self._loop.create_task(self.client_connected_cb(self, self.writer))
+            self.task.add_done_callback(self._cb_done)
+
+    def _cb_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self._loop.call_exception_handler({"message": "連線處理發生例外", "exception": task.exception(),
+                                               "transport": self.transport})
+            self.transport.close()
+
+    def get_buffer(self, sizehint):
+        if len(self.buf) - self.end < MIN_RECV_SPACE:
+            pending = self.end - self.start
+            if pending + MIN_RECV_SPACE > len(self.buf):
+                # 單一 frame 比 buffer 還大（上限 MAX_LEN）：換一塊大一點的
+                buf = bytearray(max(len(self.buf) * 2, MAX_LEN + 4 + MIN_RECV_SPACE))
+                buf[:pending] = self.view[self.start:self.end]
+                self.buf, self.view = buf, memoryview(buf)
+            elif self.start:
+                self.buf[:pending] = self.buf[self.start:self.end]
+            self.start, self.end = 0, pending
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes):
+        self.end += nbytes
+        view, start, end = self.view, self.start, self.end
+        try:
+            while end - start >= 4:
+                (n,) = _HEADER.unpack_from(view, start)
+                if n & COMPRESS_FLAG:
+                    raise ValueError("收端不接受壓縮封包")
+                more = n & CHUNK_FLAG
+                n &= LEN_MASK
+                if not (0 < n <= MAX_LEN):
+                    raise ValueError(f"封包長度無效: {n}")
+                if end - start - 4 < n:
+                    break
+                body = view[start + 4:start + 4 + n]
+                start += 4 + n
+                if not (more or self.parts):
+                    self.messages.append(json.loads(str(body, 'utf-8')))
+                    continue
+                self.parts_len += n
+                if self.parts_len > self.max_message_len:
+                    raise ValueError(f"訊息過大: 超過 {self.max_message_len} bytes")
+                self.parts.append(bytes(body))
+                if not more:
+                    self.messages.append(json.loads(b"".join(self.parts).decode('utf-8')))
+                    self.parts.clear()
+                    self.parts_len = 0
+        except ValueError as e:
+            self.error = e
+            self.transport.close()
+        if start == end:
+            start = end = 0          # 剛好切完：下一次從頭開始收，不用搬資料
+        self.start, self.end = start, end
+        self._wakeup()
+        if len(self.messages) >= MAX_PENDING_MSGS and not self._read_paused:
+            self._read_paused = True
+            self.transport.pause_reading()
+
+    def eof_received(self):
+        self.eof = True
+        self._wakeup()
+        return False
+
+    def connection_lost(self, exc):
+        self.eof = True
+        if exc is not None and self.error is None:
+            self.error = exc
+        self._wakeup()
+        while self._drain_waiters:
+            fut = self._drain_waiters.popleft()
+            if not fut.done():
+                fut.set_exception(ConnectionResetError("Connection lost"))
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def pause_writing(self):
+        self._write_paused = True
+
+    def resume_writing(self):
+        self._write_paused = False
+        while self._drain_waiters:
+            fut = self._drain_waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+
+    # ---- reader / writer ----
+    def _wakeup(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def recv(self):
+        while not self.messages:
+            if self.error is not None:
+                raise self.error
+            if self.eof:
+                raise asyncio.IncompleteReadError(bytes(self.view[self.start:self.end]), 4)
+            self._waiter = self._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        msg = self.messages.popleft()
+        if self._read_paused and len(self.messages) < MAX_PENDING_MSGS // 2:
+            self._read_paused = False
+            self.transport.resume_reading()
+        return msg
+
+    async def wait_writable(self):
+        if self.closed.done():
+            raise ConnectionResetError("Connection lost")
+        if self._write_paused:
+            fut = self._loop.create_future()
+            self._drain_waiters.append(fut)
+            await fut
@@ -0,0 +1,150 @@
+import asyncio
+import time
+from collections import deque
+
+from common.log import get_logger
+from common.metrics import metrics
+from common.network import compress_frame
+
+log = get_logger("outbox")
+
+# -------------------------------
+# 每條連線的送出佇列
+# -------------------------------
+# 呼叫端（例如 game_loop 的 tick）只做 push()，真正的 write/drain 由背景 task 負責，
+# 所以一個網路很慢的玩家不會卡住整個 tick。
+#
+# - kind 相同的封包會合併：佇列裡還沒送出的舊 snapshot 直接被新的取代
+# - 佇列超過 max_depth、或連續 max_lag_sec 都送不完 → 視為慢速接收端，直接踢掉
+# - deflater：對方在 hello 協商了壓縮（common.compress.negotiate）就在寫出前壓縮；
+#   合併掉的舊 snapshot 不會進壓縮串流，所以壓縮狀態跟對方收到的內容一致
+
+MAX_DEPTH = 32
+MAX_LAG_SEC = 5.0
+
+
+class Outbox:
+    def __init__(self, writer: asyncio.StreamWriter, name: str,
+                 max_depth: int = MAX_DEPTH, max_lag_sec: float = MAX_LAG_SEC,
+                 on_evict=None):
+        self.writer = writer
+        self.name = name
+        self.max_depth = max_depth
+        self.max_lag_sec = max_lag_sec
+        self.on_evict = on_evict
+        self.deflater = None
+        self.closed = False
+        self.evicted = False
+        self._q = deque()           # [kind, frame]
+        self._by_kind = {}          # kind -> 還在佇列中的那一筆
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._behind_since = None   # 開始「送不完」的時間
+        self._task = asyncio.create_task(self._run())
+
+    def __len__(self):
+        return len(self._q)
+
+    def push(self, frame: bytes, kind: str = None) -> bool:
+        """放入一個已編碼的封包；回傳 False 表示此連線已關閉/被踢"""
+        if self.closed:
+            return False
+
+        if kind is not None:
+            item = self._by_kind.get(kind)
+            if item is not None:
+                # 舊的還沒送出 → 只保留最新的
+                item[1] = frame
+                metrics.inc("outbox_coalesced", kind=kind)
+                self._check_lag()
+                return not self.closed
+            item = [kind, frame]
+            self._by_kind[kind] = item
+        else:
+            item = [None, frame]
+
+        self._q.append(item)
+        self._idle.clear()
+        self._wakeup.set()
+
+        if len(self._q) > self.max_depth:
+            self.evict("queue full")
+        else:
+            self._check_lag()
+        return not self.closed
+
+    def _check_lag(self):
+        if self._behind_since is not None and time.monotonic() - self._behind_since > self.max_lag_sec:
+            self.evict("too slow")
+
+    async def _run(self):
+        try:
+            while not self.closed or self._q:
+                if not self._q:
+                    self._behind_since = None
+                    self._idle.set()
+                    if self.closed:
+                        break
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                if self._behind_since is None:
+                    self._behind_since = time.monotonic()
+
+                # 把目前佇列一次寫進 transport，再 drain 一次
+                while self._q:
+                    kind, frame = self._q.popleft()
+                    if kind is not None:
+                        self._by_kind.pop(kind, None)
+                    if self.deflater is not None:
+                        n = len(frame)
+                        frame = compress_frame(frame, self.deflater)
+                        metrics.inc("compress_in_bytes", n)
+                        metrics.inc("compress_out_bytes", len(frame))
+                    self.writer.write(frame)
+                await self.writer.drain()
+        except asyncio.CancelledError:
+            pass
+        except (ConnectionError, OSError) as e:
+            self.evict(f"send failed: {e}", slow=False)
+        finally:
+            self._idle.set()
+
+    def evict(self, reason: str, slow: bool = True):
+        if self.evicted:
+            return
+        self.evicted = True
+        self.closed = True
+        self._q.clear()
+        self._by_kind.clear()
+        self._task.cancel()
+        if slow:
+            metrics.inc("outbox_evictions")
+            log.warning("🐢 踢掉慢速連線", name=self.name, reason=reason)
+        else:
+            log.debug("🔌 連線已中斷", name=self.name, reason=reason)
+        try:
+            self.writer.transport.abort()
+        except Exception:
+            pass
+        if self.on_evict:
+            self.on_evict(self)
+
+    async def close(self, timeout: float = 2.0):
+        """送完佇列中的封包（最多等 timeout 秒）後關閉連線"""
+        if not self.evicted:
+            self.closed = True
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                self.evict("close timeout")
+                return
+        self._task.cancel()
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except (ConnectionResetError, OSError):
+            pass
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import socket
+import sys
+
+from common.log import get_logger
+from common.network import FrameProtocol, MAX_MESSAGE_LEN
+
+# -------------------------------
+# 共用的執行環境：event loop + socket 設定
+# -------------------------------
+# 各 server / client 的進入點都用 runtime.run(main())，連線都走 runtime.start_server / runtime.open_connection：
+#
+# - event loop：有裝 uvloop（Linux / macOS）就用，沒有就是 asyncio 預設的 loop。
+#   Windows 照舊用各模組開頭設定的 WindowsSelectorEventLoopPolicy。
+#   NT_LOOP=asyncio 強制用預設 loop（比較效能、排查問題時用）
+# - TCP_NODELAY：inputs / snapshot 都是幾十到幾百 bytes 的小封包，不能被 Nagle 攢著等 ACK
+#   （asyncio 自己的 transport 其實也會開，這裡明確設定，uvloop / 其他 loop 一樣保證）
+# - keepalive：對方整台機器掉線、NAT 表過期時，OS 會在 ~1 分鐘內發現，連線不會永遠掛著
+# - socket buffer：預設交給 OS 自動調整（Linux 手動設定 SO_SNDBUF / SO_RCVBUF 會關掉 autotuning），
+#   NT_SNDBUF / NT_RCVBUF 可以指定 bytes 數
+#
+# 啟動時印一行目前的設定；NT_LOG=debug 時，第一條連線建立後再印出 socket 實際拿到的 buffer 大小。
+
+log = get_logger("runtime")
+
+LOOP = os.environ.get("NT_LOOP", "auto")             # auto / asyncio / uvloop
+KEEPALIVE_IDLE_SEC = 30          # 閒置多久開始送 keepalive 探測
+KEEPALIVE_INTERVAL_SEC = 10      # 探測間隔
+KEEPALIVE_COUNT = 3              # 連續幾次沒回應就斷線
+SNDBUF = int(os.environ.get("NT_SNDBUF", "0"))       # 0 = OS 自動調整
+RCVBUF = int(os.environ.get("NT_RCVBUF", "0"))
+
+_reported = False
+
+
+def fast_loop():
+    """回傳可用的較快 event loop 模組（uvloop），沒有就回傳 None"""
+    if LOOP == "asyncio" or sys.platform.startswith("win"):
+        return None
+    try:
+        import uvloop
+        return uvloop
+    except ImportError:
+        if LOOP == "uvloop":
+            log.warning("⚠️ NT_LOOP=uvloop 但沒有安裝 uvloop，改用 asyncio 預設 loop")
+        return None
+
+
+def settings() -> dict:
+    fast = fast_loop()
+    return {
+        "loop": fast.__name__ if fast else "asyncio",
+        "nodelay": True,
+        "keepalive": f"{KEEPALIVE_IDLE_SEC}s/{KEEPALIVE_INTERVAL_SEC}s/{KEEPALIVE_COUNT}",
+        "sndbuf": SNDBUF or "auto",
+        "rcvbuf": RCVBUF or "auto",
+    }
+
+
+def run(main, report: bool = True):
+    """asyncio.run() 的替代：選 event loop、印出設定"""
+    fast = fast_loop()
+    if report:
+        log.info("⚙️ runtime", **settings())
+    if fast is None:
+        return asyncio.run(main)
+    if hasattr(asyncio, "Runner"):
+        with asyncio.Runner(loop_factory=fast.new_event_loop) as runner:
+            return runner.run(main)
+    asyncio.set_event_loop_policy(fast.EventLoopPolicy())    # Python 3.10 以前
+    return asyncio.run(main)
+
+
+def tune_socket(sock):
+    """TCP_NODELAY + keepalive + buffer 大小；不是 TCP socket（或 OS 不支援）就略過"""
+    global _reported
+    if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # 各平台有的選項不一樣（macOS 沒有 TCP_KEEPIDLE，舊版 Windows 只有 SO_KEEPALIVE）
+        for name, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE_SEC), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL_SEC),
+                            ("TCP_KEEPCNT", KEEPALIVE_COUNT)):
+            if hasattr(socket, name):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+        if SNDBUF:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SNDBUF)
+        if RCVBUF:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF)
+    except OSError as e:
+        log.debug("⚠️ socket 設定失敗", error=e)
+        return
+    if not _reported:
+        _reported = True
+        log.debug("🔧 socket", nodelay=sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY),
+                  sndbuf=sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+                  rcvbuf=sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF))
+
+
+def tune(writer: asyncio.StreamWriter):
+    tune_socket(writer.get_extra_info("socket"))
+
+
+async def start_server(client_connected_cb, host, port, framed: bool = False,
+                       max_message_len: int = MAX_MESSAGE_LEN, **kwargs):
+    """asyncio.start_server()，每條接進來的連線先套用 socket 設定
+
+    framed=True：收端改用 network.FrameProtocol（reader 只能用 recv_msg 讀，適合每秒大量小封包的 server），
+    max_message_len 是每則收到的訊息（含分塊）合併後的上限
+    """
+    async def accept(reader, writer):
+        tune(writer)
+        return await client_connected_cb(reader, writer)
+    if framed:
+        loop = asyncio.get_running_loop()
+        return await loop.create_server(lambda: FrameProtocol(accept, max_message_len), host, port, **kwargs)
+    return await asyncio.start_server(accept, host, port, **kwargs)
+
+
+async def open_connection(host, port, **kwargs):
+    """asyncio.open_connection()，連上後套用 socket 設定"""
+    reader, writer = await asyncio.open_connection(host, port, **kwargs)
+    tune(writer)
+    return reader, writer
@@ -0,0 +1,85 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+# -------------------------------
+# 簽章 session token
+# -------------------------------
+# Lobby 登入成功時發給客戶端，之後：
+#   - 重連 Lobby：User/resume 帶 token，Lobby 在記憶體驗章就好，不用再問 DB、不用跑 KDF
+#   - 連 game server：hello 帶 token，game server 用同一把 secret 驗章取得 user_id
+#
+# token = base64url(payload JSON) "." base64url(HMAC-SHA256(secret, payload))
+# payload = {"uid": user_id, "name": 名稱, "exp": 到期的 unix 秒數}
+#
+# 同一把 secret 也拿來簽 game server → Lobby 的控制連線（Game/hello 帶 control_auth），
+# Lobby 只接受驗章過的連線送 Game/report、Game/ended，一般玩家連線送來的一律拒絕。
+#
+# secret 從 NT_SESSION_SECRET 讀；沒設定就隨機產生一把並寫回環境變數，
+# 這樣 Lobby 啟動的 game server 會繼承同一把（但 Lobby 重啟後舊 token 全部失效）。
+# 分片模式下各分片改用目錄服務發的同一把（set_secret）。
+
+SECRET_ENV = "NT_SESSION_SECRET"
+SESSION_TTL_SEC = 12 * 3600
+
+_secret = os.environ.get(SECRET_ENV)
+EPHEMERAL_SECRET = not _secret
+if EPHEMERAL_SECRET:
+    _secret = os.urandom(32).hex()
+    os.environ[SECRET_ENV] = _secret
+_KEY = _secret.encode("utf-8")
+
+
+def set_secret(secret: str):
+    """換成共用的 secret（分片模式下由目錄服務統一發給各個 lobby 分片）"""
+    global _KEY, EPHEMERAL_SECRET
+    _KEY = secret.encode("utf-8")
+    EPHEMERAL_SECRET = False
+    os.environ[SECRET_ENV] = secret          # 之後啟動的 game server 也用這一把
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64(hmac.new(_KEY, payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue(user_id: int, name: str, ttl: int = SESSION_TTL_SEC) -> str:
+    payload = _b64(json.dumps({"uid": user_id, "name": name, "exp": int(time.time()) + ttl},
+                              ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify(token) -> dict:
+    """驗章 + 檢查到期；成功回傳 payload（uid / name / exp），否則 None"""
+    if not isinstance(token, str) or token.count(".") != 1:
+        return None
+    payload, sig = token.split(".")
+    try:
+        if not hmac.compare_digest(sig, _sign(payload)):
+            return None
+        claims = json.loads(_unb64(payload))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(claims, dict) or claims.get("exp", 0) < time.time():
+        return None
+    return claims
+
+
+def control_auth(room_id, port, secret: str = None) -> str:
+    """game server 控制連線的簽章（綁定房號 + port）；secret 不給就用目前這把"""
+    key = _KEY if secret is None else secret.encode("utf-8")
+    return _b64(hmac.new(key, f"game:{room_id}:{port}".encode("utf-8"), hashlib.sha256).digest())
+
+
+def check_control_auth(auth, room_id, port) -> bool:
+    return isinstance(auth, str) and auth.isascii() and hmac.compare_digest(auth, control_auth(room_id, port))
@@ -1,12 +1,18 @@
 import sqlite3
 import hashlib
+import hmac
+import time
 from datetime import datetime
 import uuid
 import os
+from common.log import get_logger
 
 
 DB_PATH = "data.db"
 INIT_SQL_FILE = os.path.join(os.path.dirname(__file__), "init_sql.sql")
+NO_ACCOUNT_ID = 0              # gameresults.opponent_id：對手沒有帳號（bot、沒帶 session 的 client）
+
+log = get_logger("db")
 
 #part1:初始化資料庫連線與結構
 
@@ -22,14 +28,75 @@ def init_db():
     with get_conn() as conn:
         conn.executescript(sql_script)
         conn.commit()
-    print("✅ Database initialized from init_sql.sql")
+    log.info("✅ Database initialized from init_sql.sql")
 
 #part2:users操作函式
 
-def hash_password(password: str) -> str:
-    """用 SHA256 雜湊密碼"""
+# 密碼雜湊：salted scrypt，格式 "scrypt$N$r$p$salt$hash"
+# - 成本參數可以調；參數跟現在設定不同的雜湊（包含舊版無 salt 的 SHA256）會在登入成功時自動重算
+# - KDF 一次要幾十 ms，db_server 會丟到 thread pool 跑（hashlib.scrypt 執行時會放開 GIL）
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+VERIFY_CACHE_SEC = 600          # 驗證成功後多久內同一組帳密不用再跑 KDF（重連、斷線重登）
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * n * r * (p + 1) + (1 << 20), dklen=32)
+
+
+def legacy_hash_password(password: str) -> str:
+    """舊版：無 salt 的 SHA256（只用來驗證還沒升級的帳號）"""
     return hashlib.sha256(password.encode("utf-8")).hexdigest()
 
+
+def hash_password(password: str) -> str:
+    """salted scrypt（慢，不要在 event loop 裡直接呼叫）"""
+    salt = os.urandom(SALT_BYTES)
+    dk = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${dk.hex()}"
+
+
+def verify_password(password: str, stored: str):
+    """回傳 (密碼是否正確, 是否需要用目前的參數重新雜湊)"""
+    if stored.startswith("scrypt$"):
+        try:
+            _, n, r, p, salt, dk = stored.split("$")
+            n, r, p = int(n), int(r), int(p)
+            ok = hmac.compare_digest(_scrypt(password, bytes.fromhex(salt), n, r, p), bytes.fromhex(dk))
+        except ValueError:
+            return False, False
+        return ok, ok and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    ok = hmac.compare_digest(stored, legacy_hash_password(password))
+    return ok, ok
+
+
+# 驗證快取：name -> (HMAC(name, 雜湊, 密碼), 到期時間)
+# 只存在記憶體、用每次啟動隨機的 key，不會留下可以離線破解的東西；雜湊一變（改密碼、升級）就自動失效
+_VERIFY_KEY = os.urandom(32)
+_verify_cache = {}
+
+
+def _verify_digest(name: str, stored: str, password: str) -> bytes:
+    return hmac.new(_VERIFY_KEY, f"{name}\0{stored}\0{password}".encode("utf-8"), hashlib.sha256).digest()
+
+
+def verify_cached(name: str, stored: str, password: str) -> bool:
+    entry = _verify_cache.get(name)
+    if entry is None:
+        return False
+    digest, expires = entry
+    if time.monotonic() > expires:
+        _verify_cache.pop(name, None)
+        return False
+    return hmac.compare_digest(digest, _verify_digest(name, stored, password))
+
+
+def remember_verified(name: str, stored: str, password: str):
+    _verify_cache[name] = (_verify_digest(name, stored, password), time.monotonic() + VERIFY_CACHE_SEC)
+
 #use
 def lobby_init():
     """Lobby 初始化時呼叫：重設所有使用者登入狀態"""
@@ -42,18 +109,23 @@ def lobby_init():
         
         conn.commit()
     
-    print("🧹 Lobby Init: 所有使用者已標記為離線。")
+    log.info("🧹 Lobby Init: 所有使用者已標記為離線。")
     return {"ok": True, "msg": "All users reset to offline."}
 
 
 def create_user(name: str, password: str):
     """註冊新使用者（註冊後自動登入）"""
+    return insert_user(name, hash_password(password))
+
+
+def insert_user(name: str, password_hash: str):
+    """寫入已經算好雜湊的新使用者（db_server 在 thread pool 算完 KDF 後呼叫）"""
     try:
         with get_conn() as conn:
             cur = conn.cursor()
             cur.execute(
                 "INSERT INTO users (name, password_hash, is_logged_in, last_login_at) VALUES (?, ?, 1, datetime('now'))",
-                (name, hash_password(password)),
+                (name, password_hash),
             )
             conn.commit()
             user_id = cur.lastrowid
@@ -63,29 +135,50 @@ def create_user(name: str, password: str):
 
 #use
 def login_user(name: str, password: str):
-    """登入使用者"""
+    """登入使用者（同步版；db_server 走 get_credentials → KDF 在 thread pool → finish_login）"""
+    row = get_credentials(name)
+    if not row:
+        return {"ok": False, "error": "User not found."}
+
+    user_id, pw_hash = row
+    ok, rehash = verify_password(password, pw_hash)
+    if not ok:
+        return {"ok": False, "error": "Invalid password."}
+    return finish_login(user_id, name, hash_password(password) if rehash else None)
+
+
+def get_credentials(name: str):
+    """(user_id, password_hash)；沒有這個使用者回傳 None"""
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT id, password_hash, is_logged_in FROM users WHERE name=?", (name,))
-        row = cur.fetchone()
-        if not row:
-            return {"ok": False, "error": "User not found."}
-
-        user_id, pw_hash, is_logged_in = row
-        if pw_hash != hash_password(password):
-            return {"ok": False, "error": "Invalid password."}
+        cur.execute("SELECT id, password_hash FROM users WHERE name=?", (name,))
+        return cur.fetchone()
 
-        # ✅ 檢查是否已登入
-        if is_logged_in:
-            return {"ok": False, "error": "User already logged in elsewhere."}
 
-        # 更新登入狀態
+def finish_login(user_id: int, name: str, new_hash: str = None):
+    """密碼驗證通過後：標記登入（已登入就拒絕），需要的話順便換成新的雜湊"""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        # ✅ 檢查是否已登入（條件寫在 UPDATE 裡，同時兩個登入只會有一個成功）
         cur.execute(
-            "UPDATE users SET is_logged_in=1, last_login_at=? WHERE id=?",
-            (datetime.now().isoformat(), user_id),
+            "UPDATE users SET is_logged_in=1, last_login_at=?, password_hash=COALESCE(?, password_hash) "
+            "WHERE id=? AND is_logged_in=0",
+            (datetime.now().isoformat(), new_hash, user_id),
         )
         conn.commit()
-        return {"ok": True, "id": user_id, "name": name}
+        if cur.rowcount == 0:
+            return {"ok": False, "error": "User already logged in elsewhere."}
+    if new_hash:
+        log.info("🔐 密碼雜湊已升級", id=user_id)
+    return {"ok": True, "id": user_id, "name": name}
+
+def mark_online(user_id: int):
+    """session 重連（沒有重新輸入密碼）時補上登入狀態"""
+    with get_conn() as conn:
+        conn.execute("UPDATE users SET is_logged_in=1, last_login_at=? WHERE id=?",
+                     (datetime.now().isoformat(), user_id))
+        conn.commit()
+    return {"ok": True, "id": user_id}
 
 #use
 def logout_user(user_id: int):
@@ -104,7 +197,7 @@ def logout_user(user_id: int):
         )
         conn.commit()
 
-    print(f"🗂 使用者登出: id={user_id}, name={username}")
+    log.info("🗂 使用者登出", id=user_id, name=username)
     return {"ok": True, "id": user_id, "name": username, "msg": "User logged out."}
 
 #use
@@ -120,56 +213,63 @@ def get_online_users():
 
 def report_game_result(data):
     """
-    將一場兩人對戰結果寫入 gameresults 表
+    將一場對戰結果寫入 gameresults 表（每位玩家一筆，2~16 人都適用）
     data:
     {
+        "report_id": "9f1c...",      # 選填；同一個 report_id 只會寫入一次（game server 重送用）
         "room_id": 3,
         "winner": 101,
         "result": {
             "p1": {"user_id": 101, "score": 12000, "level": 7},
-            "p2": {"user_id": 205, "score": 9500,  "level": 6}
+            "p2": {"user_id": 205, "score": 9500,  "level": 6},
+            ...
         }
     }
+    opponent_id：兩人對戰就是對方；多人對戰記錄「除了自己以外分數最高的玩家」
+    沒有帳號的玩家（bot、沒帶 session 的舊版 client）不寫入，其他人照樣記錄；
+    對手都沒有帳號時 opponent_id 記 NO_ACCOUNT_ID。一個有帳號的玩家都沒有就沒東西可寫（ok、count=0）。
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-
         room_id = data.get("room_id")
+        report_id = data.get("report_id")
         winner_id = data.get("winner")
         result = data.get("result", {})
 
-        p1 = result.get("p1")
-        p2 = result.get("p2")
-
-        if not p1 or not p2:
+        if not result:
             raise ValueError("❌ report_game_result: 缺少玩家資料")
+        everyone = list(result.values())
+        players = [p for p in everyone if p.get("user_id") is not None]
+        if not players:
+            log.info("🤖 沒有有帳號的玩家，不寫入戰績", room=room_id, report=report_id)
+            return {"ok": True, "count": 0}
 
-        # 🧩 玩家 A
-        cur.execute("""
-            INSERT INTO gameresults (user_id, opponent_id, score, level, win)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
-            p1["user_id"], p2["user_id"], p1.get("score", 0), p1.get("level", 0),
-            1 if p1["user_id"] == winner_id else 0
-        ))
-
-        # 🧩 玩家 B
-        cur.execute("""
-            INSERT INTO gameresults (user_id, opponent_id, score, level, win)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
-            p2["user_id"], p1["user_id"], p2.get("score", 0), p2.get("level", 0),
-            1 if p2["user_id"] == winner_id else 0
-        ))
+        rows = []
+        for p in players:
+            others = [o for o in everyone if o is not p]
+            best_other = max(others, key=lambda o: o.get("score", 0)) if others else {}
+            opponent_id = best_other.get("user_id")
+            rows.append((
+                p["user_id"], NO_ACCOUNT_ID if opponent_id is None else opponent_id,
+                p.get("score", 0), p.get("level", 0), 1 if p["user_id"] == winner_id else 0
+            ))
 
-        conn.commit()
-        conn.close()
+        # 🧩 一次 executemany，同一個 transaction（去重紀錄也在同一個 transaction 裡）
+        with get_conn() as conn:
+            if report_id is not None:
+                try:
+                    conn.execute("INSERT INTO reported_games (report_id, room_id) VALUES (?, ?)", (report_id, room_id))
+                except sqlite3.IntegrityError:
+                    log.info("🔁 重複的比賽回報，略過", report=report_id, room=room_id)
+                    return {"ok": True, "count": 0, "duplicate": True}
+            conn.executemany("""
+                INSERT INTO gameresults (user_id, opponent_id, score, level, win)
+                VALUES (?, ?, ?, ?, ?)
+            """, rows)
 
-        print(f"🧾 已寫入房間 {room_id} 的遊戲結果：{p1['user_id']} vs {p2['user_id']}")
-        return {"ok": True, "count": 2}
+        log.info("🧾 已寫入遊戲結果", room=room_id, count=len(rows), users=[r[0] for r in rows])
+        return {"ok": True, "count": len(rows)}
 
     except Exception as e:
-        print("❌ report_game_result 寫入失敗:", e)
+        log.error("❌ report_game_result 寫入失敗", error=e)
         return {"ok": False, "error": str(e)}
 
@@ -2,7 +2,13 @@ import asyncio
 import logging
 from database import db_fun as db
 from common.network import send_msg, recv_msg
+from common.log import get_logger
+from common.metrics import metrics, request_labels, start_stats_server
+from common import runtime
+import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 if sys.platform.startswith("win"):
@@ -11,6 +17,54 @@ logging.getLogger("asyncio").setLevel(logging.CRITICAL)
 
 HOST = "127.0.0.1"
 PORT = 14411
+STATS_PORT = 14412
+# _dispatch_credentials / _dispatch 認得的 request（metrics 只用這些當 label，其他記成 unknown）
+KNOWN_REQUESTS = frozenset({("Lobby", "init"), ("User", "create"), ("User", "login"), ("User", "logout"),
+                            ("User", "mark_online"), ("User", "list_online"), ("Game", "report")})
+MAX_INFLIGHT_REQUESTS = 64   # 每條連線最多同時處理幾個帶 rid 的 request（lobby 全部玩家共用一條連線，開大一點）
+
+log = get_logger("db")
+
+# 密碼 KDF 在 thread pool 跑，event loop 不會被一次幾十 ms 的 scrypt 卡住
+KDF_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="kdf")
+
+
+async def run_kdf(fn, *args):
+    t = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(KDF_POOL, fn, *args)
+    finally:
+        metrics.observe("db_kdf_ms", (time.perf_counter() - t) * 1000, fn=fn.__name__)
+
+
+async def create_user(name: str, password: str):
+    pw_hash = await run_kdf(db.hash_password, password)
+    resp = db.insert_user(name, pw_hash)
+    if resp.get("ok"):
+        db.remember_verified(name, pw_hash, password)
+    return resp
+
+
+async def login_user(name: str, password: str):
+    row = db.get_credentials(name)
+    if not row:
+        return {"ok": False, "error": "User not found."}
+
+    user_id, stored = row
+    new_hash = None
+    if db.verify_cached(name, stored, password):
+        # 剛驗證過（重連 / 重登）：不用再跑 KDF
+        metrics.inc("db_verify_cache", result="hit")
+    else:
+        metrics.inc("db_verify_cache", result="miss")
+        ok, rehash = await run_kdf(db.verify_password, password, stored)
+        if not ok:
+            return {"ok": False, "error": "Invalid password."}
+        if rehash:
+            new_hash = await run_kdf(db.hash_password, password)
+        db.remember_verified(name, new_hash or stored, password)
+    return db.finish_login(user_id, name, new_hash)
+
 
 # ----------------------------
 # 處理單一請求
@@ -20,18 +74,40 @@ async def handle_request(req: dict):
     action = req.get("action")
     data = req.get("data", {})
 
+    t = time.perf_counter()
+    try:
+        if collection == "User" and action in ("create", "login"):
+            return await _dispatch_credentials(action, data)
+        return _dispatch(collection, action, data)
+    finally:
+        labels = request_labels(collection, action, KNOWN_REQUESTS)
+        metrics.inc("db_requests", **labels)
+        metrics.observe("db_query_ms", (time.perf_counter() - t) * 1000, **labels)
+
+
+async def _dispatch_credentials(action, data):
+    """需要跑 KDF 的 request（註冊、登入）"""
+    try:
+        if action == "create":
+            return await create_user(data["name"], data["password"])
+        return await login_user(data["name"], data["password"])
+    except KeyError as e:
+        return {"ok": False, "error": f"Missing field: {e}"}
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+
+def _dispatch(collection, action, data):
     try:
         # ---------- User ----------
         if collection == "Lobby":
             if action == "init":
                 return db.lobby_init()
         elif collection == "User":
-            if action == "create":
-                return db.create_user(data["name"], data["password"])
-            elif action == "login":
-                return db.login_user(data["name"], data["password"])
-            elif action == "logout":
+            if action == "logout":
                 return db.logout_user(data["id"])
+            elif action == "mark_online":
+                return db.mark_online(data["id"])
             elif action == "list_online":
                 return {"ok": True, "users": db.get_online_users()}
 
@@ -48,25 +124,53 @@ async def handle_request(req: dict):
         return {"ok": False, "error": str(e)}
 
 
+async def respond(writer, req: dict, lock, slots):
+    try:
+        resp = await handle_request(req)
+    finally:
+        slots.release()
+    resp["rid"] = req["rid"]      # 回覆順序可能跟 request 不同，對方用 rid 對應
+    try:
+        async with lock:          # 分塊的大回覆不能跟別的回覆交錯
+            await send_msg(writer, resp)
+    except (ConnectionError, OSError):
+        pass
+
+
 # ----------------------------
 # 處理每個連線
 # ----------------------------
 async def handle_client(reader, writer):
     addr = writer.get_extra_info('peername')
-    print(f"📡 連線來自 {addr}")
+    log.info("📡 連線", addr=addr)
+    metrics.inc("db_connections")
+    lock = asyncio.Lock()
+    slots = asyncio.Semaphore(MAX_INFLIGHT_REQUESTS)
+    inflight = set()
 
     try:
         while True:
             req = await recv_msg(reader)
             if req is None:
                 break
-            print(f"📥 收到: {req}")
+            log.debug("📥 收到", collection=req.get("collection"), action=req.get("action"))
+            if "rid" in req:
+                # 帶 rid 的 request 各自處理、做完就回（登入在等 KDF 時不擋住後面的 request）
+                # 同時處理的數量到上限就先不讀，對方送太快時靠 TCP 擋回去
+                await slots.acquire()
+                task = asyncio.create_task(respond(writer, req, lock, slots))
+                inflight.add(task)
+                task.add_done_callback(inflight.discard)
+                continue
             resp = await handle_request(req)
-            await send_msg(writer, resp)
+            async with lock:
+                await send_msg(writer, resp)
     except asyncio.IncompleteReadError:
-        print(f"❌ 客戶端 {addr} 中斷連線")
+        log.info("❌ 客戶端中斷連線", addr=addr)
     finally:
-        print(f"🔌 關閉連線 {addr}")
+        if inflight:
+            await asyncio.gather(*inflight, return_exceptions=True)
+        log.info("🔌 關閉連線", addr=addr)
         # 🧩 安全關閉區段
         try:
             writer.close()
@@ -81,13 +185,15 @@ async def handle_client(reader, writer):
 # ----------------------------
 async def main():
     db.init_db()
-    server = await asyncio.start_server(handle_client, HOST, PORT)
+    server = await runtime.start_server(handle_client, HOST, PORT)
     addr = server.sockets[0].getsockname()
-    print(f"✅ DB Server 啟動於 {addr}")
+    log.info("✅ DB Server 啟動", addr=addr)
+    if await start_stats_server(STATS_PORT):
+        log.info("📊 stats endpoint", port=STATS_PORT)
 
     async with server:
         await server.serve_forever()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    runtime.run(main())
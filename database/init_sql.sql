@@ -22,7 +22,7 @@ CREATE TABLE IF NOT EXISTS users (
 CREATE TABLE IF NOT EXISTS gameresults (
     id INTEGER PRIMARY KEY AUTOINCREMENT,              -- 主鍵，自動流水號
     user_id INTEGER NOT NULL,                          -- 玩家 ID（外鍵對 users.id）
-    opponent_id INTEGER NOT NULL,                      -- 對手玩家 ID（外鍵對 users.id）
+    opponent_id INTEGER NOT NULL,                      -- 對手玩家 ID（外鍵對 users.id；0 = 對手沒有帳號）
 
     score INTEGER DEFAULT 0 CHECK(score >= 0),         -- 最終分數
     level INTEGER DEFAULT 0 CHECK(level >= 0),         -- 最終等級（依規則上升）
@@ -32,3 +32,15 @@ CREATE TABLE IF NOT EXISTS gameresults (
     FOREIGN KEY (opponent_id) REFERENCES users(id)
 );
 
+
+-- ========================================
+--  Table 6. reported_games
+--  功能：已寫入的比賽回報（report_id 由 game server 產生）
+--  game server 收不到 ack 會重送同一份結果，靠這張表去重
+-- ========================================
+
+CREATE TABLE IF NOT EXISTS reported_games (
+    report_id TEXT PRIMARY KEY,                        -- game server 產生的回報 ID
+    room_id INTEGER,                                   -- 房間 ID
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP          -- 寫入時間
+);
@@ -3,11 +3,47 @@ import random
 
 TETROMINOES = ["I","O","T","S","Z","J","L"]
 
+BAG_SIZE = len(TETROMINOES)
+BLOCK_BAGS = 64                      # 一次預先洗好 64 包（448 個方塊）
+
+
+class SevenBag:
+    """可任意跳位的 7-bag 序列：piece(i) 直接取第 i 個方塊
+
+    - 每個 block 用 (seed, block) 各自的 RNG 洗牌，所以第 k 塊不需要先產生前面全部
+    - 洗好的 block 會快取起來，之後取值只是 list 索引
+    - 同一個 seed 給每位玩家各自一個 cursor（index），大家拿到的序列完全一樣
+    """
+
+    def __init__(self, seed: int):
+        self.seed = seed
+        self._blocks = {}            # block 編號 -> 該 block 的所有方塊
+
+    def _block(self, b: int) -> list:
+        pieces = self._blocks.get(b)
+        if pieces is None:
+            rng = random.Random(self.seed * 1000003 + b)
+            pieces = []
+            for _ in range(BLOCK_BAGS):
+                bag = TETROMINOES[:]
+                rng.shuffle(bag)     # Fisher-Yates by random.shuffle
+                pieces.extend(bag)
+            self._blocks[b] = pieces
+        return pieces
+
+    def piece(self, i: int) -> str:
+        b, off = divmod(i, BAG_SIZE * BLOCK_BAGS)
+        return self._block(b)[off]
+
+    def pieces(self, start: int, n: int) -> list:
+        """第 start 個起連續 n 個方塊（補 next_queue 用）"""
+        return [self.piece(i) for i in range(start, start + n)]
+
+
 def seven_bag_stream(seed: int):
-    rng = random.Random(seed)
-    bag = []
+    """舊介面：從頭依序產生同一個 seed 的方塊序列"""
+    bag = SevenBag(seed)
+    i = 0
     while True:
-        bag = TETROMINOES[:]
-        rng.shuffle(bag)             # Fisher-Yates by random.shuffle
-        for k in bag:
-            yield k
+        yield bag.piece(i)
+        i += 1
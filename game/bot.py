@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import random
+import time
+
+from common.network import send_msg, recv_msg
+from common.log import get_logger
+from common.clock import ClockSync, now_ms
+from common import runtime
+from game.input_guard import MAX_PPS
+
+# -------------------------------
+# 無畫面的 AI 玩家（壓力測試 / 練習用）
+# -------------------------------
+# 跟 client_game 一樣連上 game_server、送 inputs，但不開 pygame。
+# 每個新方塊用啟發式（洞、高度、凹凸、消行）評估所有落點，挑分數最高的。
+#
+#   python -m game.bot <host> <port> [數量]              # 同一場加入 N 個 bot（通常 1 或 2）
+#   python -m game.bot <host:port> [host:port ...]        # 每場各放 2 個 bot（壓測多場對戰）
+#   選項：--pps 每秒放幾個方塊（最多 MAX_PPS，再快會被伺服器的輸入限速擋下）   --strength 0~1（越低越常下錯）
+#
+# 棋盤用 bitboard：每一列是一個 10 bit 的 int，碰撞 / 消行 / 算洞都是位元運算，
+# 一個核心可以同時跑上百個 bot。
+
+log = get_logger("bot")
+
+# 與 game_server 相同的旋轉表
+SHAPES = {
+    "I": [
+        [(0,0),(1,0),(2,0),(3,0)],
+        [(2,-1),(2,0),(2,1),(2,2)],
+        [(0,1),(1,1),(2,1),(3,1)],
+        [(1,-1),(1,0),(1,1),(1,2)]
+    ],
+    "O": [
+        [(0,0),(1,0),(0,1),(1,1)]
+    ],
+    "T": [
+        [(1,0),(0,1),(1,1),(2,1)],
+        [(1,0),(1,1),(2,1),(1,2)],
+        [(0,1),(1,1),(2,1),(1,2)],
+        [(1,0),(0,1),(1,1),(1,2)]
+    ],
+    "L": [
+        [(0,0),(0,1),(0,2),(1,2)],
+        [(0,1),(1,1),(2,1),(0,2)],
+        [(0,0),(1,0),(1,1),(1,2)],
+        [(2,0),(0,1),(1,1),(2,1)]
+    ],
+    "J": [
+        [(1,0),(1,1),(1,2),(0,2)],
+        [(0,0),(0,1),(1,1),(2,1)],
+        [(0,0),(1,0),(0,1),(0,2)],
+        [(0,1),(1,1),(2,1),(2,2)]
+    ],
+    "S": [
+        [(1,0),(2,0),(0,1),(1,1)],
+        [(1,0),(1,1),(2,1),(2,2)],
+        [(1,1),(2,1),(0,2),(1,2)],
+        [(0,0),(0,1),(1,1),(1,2)]
+    ],
+    "Z": [
+        [(0,0),(1,0),(1,1),(2,1)],
+        [(2,0),(1,1),(2,1),(1,2)],
+        [(0,1),(1,1),(1,2),(2,2)],
+        [(1,0),(0,1),(1,1),(0,2)]
+    ]
+}
+
+ROWS, COLS = 20, 10
+FULL_ROW = (1 << COLS) - 1
+
+# 啟發式權重（高度、消行、洞、凹凸）
+W_HEIGHT = -0.51
+W_LINES = 0.76
+W_HOLES = -0.36
+W_BUMP = -0.18
+
+
+def _compile(cells):
+    """一個旋轉狀態 → ([(dy, 列遮罩)], 最左 dx, 最右 dx, 最上 dy)"""
+    masks = {}
+    for a, b in cells:
+        masks[b] = masks.get(b, 0) | (1 << a)
+    xs = [a for a, _ in cells]
+    return sorted(masks.items()), min(xs), max(xs), min(b for _, b in cells)
+
+
+PIECES = {k: [_compile(c) for c in rots] for k, rots in SHAPES.items()}
+
+
+def to_rows(board):
+    """snapshot 的 20x10 棋盤 → 20 個 int（bit c = 第 c 欄有方塊）"""
+    return [sum(1 << c for c, v in enumerate(row) if v) for row in board]
+
+
+def _shift(m, x):
+    # 有些旋轉狀態最左格不在 dx=0（例如直立的 I），x 可能是負的
+    return m << x if x >= 0 else m >> -x
+
+
+def fits(rows, piece, x, y):
+    """跟 game_server.collide 相反：True 表示放得下"""
+    masks, lo, hi, _ = piece
+    if x + lo < 0 or x + hi >= COLS:
+        return False
+    for dy, m in masks:
+        r = y + dy
+        if r < 0 or r >= ROWS or rows[r] & _shift(m, x):
+            return False
+    return True
+
+
+def drop_y(rows, piece, x, y):
+    while fits(rows, piece, x, y + 1):
+        y += 1
+    return y
+
+
+def place(rows, piece, x, y):
+    """鎖定後的新棋盤與消行數"""
+    new = rows[:]
+    for dy, m in piece[0]:
+        new[y + dy] |= _shift(m, x)
+    kept = [r for r in new if r != FULL_ROW]
+    lines = ROWS - len(kept)
+    return [0] * lines + kept, lines
+
+
+def evaluate(rows, lines):
+    covered = 0          # 目前為止上方有方塊的欄
+    holes = 0
+    heights = [0] * COLS
+    for i, row in enumerate(rows):
+        holes += bin(covered & ~row & FULL_ROW).count("1")
+        new = row & ~covered
+        while new:
+            low = new & -new
+            heights[low.bit_length() - 1] = ROWS - i
+            new ^= low
+        covered |= row
+    bump = sum(abs(heights[c] - heights[c + 1]) for c in range(COLS - 1))
+    return W_HEIGHT * sum(heights) + W_LINES * lines + W_HOLES * holes + W_BUMP * bump
+
+
+def plan(rows, active, noise=0.0, rng=random):
+    """找最佳落點，回傳要送的輸入序列（旋轉 → 左右移動 → HD），找不到就回傳 None
+
+    只走 game_server 做得到的路徑：原地旋轉（沒有踢牆）、逐格平移、最後硬降。
+    旋轉後會超出頂端（I 的直立狀態）就先 SD 一格。
+    """
+    kind, rot0, x0, y0 = active["kind"], active["rot"], active["x"], active["y"]
+    rots = PIECES[kind]
+    n = len(rots)
+    if not fits(rows, rots[rot0 % n], x0, y0):
+        return None
+
+    best, best_evs = None, None
+    for turns in range(n):
+        # 走比較短的方向轉
+        step, count = (1, turns) if turns <= n // 2 else (-1, n - turns)
+        evs = []
+        y = y0
+        rot = rot0 % n
+        path = [rots[(rot + step * i) % n] for i in range(1, count + 1)]
+        if any(y + p[3] < 0 for p in path):
+            if not fits(rows, rots[rot], x0, y + 1):
+                continue
+            evs.append("SD")
+            y += 1
+        ok = True
+        for _ in range(count):
+            rot = (rot + step) % n
+            if not fits(rows, rots[rot], x0, y):
+                ok = False
+                break
+            evs.append("CW" if step == 1 else "CCW")
+        if not ok:
+            continue
+
+        piece = rots[rot]
+        # 往左、往右各自一路平移，每個能到的 x 都算一次
+        for dx in (-1, 1):
+            x = x0 if dx == -1 else x0 + 1
+            moves = 0 if dx == -1 else 1
+            while fits(rows, piece, x, y):
+                landed, lines = place(rows, piece, x, drop_y(rows, piece, x, y))
+                score = evaluate(landed, lines)
+                if noise:
+                    score += rng.gauss(0, noise)
+                if best is None or score > best:
+                    best = score
+                    best_evs = evs + ["L" if dx == -1 else "R"] * moves + ["HD"]
+                x += dx
+                moves += 1
+    return best_evs
+
+
+class Bot:
+    def __init__(self, name="Bot", pps=2.0, strength=1.0, seed=None, user_id=None, session=None):
+        self.name = name
+        self.user_id = user_id       # 沒有帳號就是 None（結果不寫入 DB）
+        self.session = session       # Lobby 發的 session token（game server 用它認定 user_id）
+        self.pps = pps
+        self.noise = max(0.0, 1.0 - strength) * 2.0
+        self.rng = random.Random(seed)
+        self.player_id = None
+        self.input_seq = 0
+        self.pieces = 0
+        self.waiting_rows = None     # 送出落點時的棋盤；變了才代表方塊已鎖定
+        self.waiting_since = 0.0
+        self.next_move_at = 0.0
+
+    async def run(self, host, port):
+        reader, writer = await runtime.open_connection(host, port)
+        try:
+            w = await recv_msg(reader)
+            self.player_id = w.get("player_id")
+            if self.player_id is None:
+                log.warning("⚠️ 對戰已滿，bot 離開", name=self.name)
+                return None
+            await send_msg(writer, {"type": "hello", "name": self.name, "user_id": self.user_id, "session": self.session})
+
+            while True:
+                m = await recv_msg(reader)
+                t = m.get("type")
+                if t == "snapshot":
+                    await self.on_snapshot(writer, m)
+                elif t == "ping":
+                    await send_msg(writer, ClockSync.pong(m, now_ms()))
+                elif t == "game_over":
+                    log.info("🏁 bot 結束", name=self.name, player=self.player_id,
+                             winner=m.get("winner"), pieces=self.pieces)
+                    return m
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            log.warning("⚠️ bot 斷線", name=self.name, error=e)
+        finally:
+            writer.close()
+
+    async def on_snapshot(self, writer, snap):
+        me = next((p for p in snap.get("players", []) if p["id"] == self.player_id), None)
+        if not me or not me.get("alive") or not me.get("active"):
+            return
+
+        now = time.monotonic()
+        rows = to_rows(me["board"])
+        if self.waiting_rows is not None:
+            # 上一顆還沒鎖定（或伺服器還沒回報）→ 先不動；太久沒變就重新規劃
+            if rows == self.waiting_rows and now - self.waiting_since < 1.0:
+                return
+            self.waiting_rows = None
+        if now < self.next_move_at:
+            return
+
+        evs = plan(rows, me["active"], self.noise, self.rng)
+        if not evs:
+            return
+        t0 = int(time.time() * 1000)
+        await send_msg(writer, {
+            "type": "inputs",
+            "seq": self.input_seq,
+            "t0_ms": t0,
+            "evs": [[ev, 0] for ev in evs],
+        })
+        self.input_seq += len(evs)
+        self.pieces += 1
+        self.waiting_rows = rows
+        self.waiting_since = now
+        self.next_move_at = now + 1.0 / self.pps
+
+
+async def main(targets, per_match, pps, strength):
+    bots = []
+    for host, port in targets:
+        for i in range(per_match):
+            bot = Bot(f"Bot{len(bots) + 1}", pps=pps, strength=strength)
+            bots.append(asyncio.create_task(bot.run(host, port)))
+            # game_server 依連線順序分配 P1 / P2，稍微錯開
+            await asyncio.sleep(0.05)
+    await asyncio.gather(*bots)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Headless Tetris bots")
+    ap.add_argument("target", nargs="+", help="<host> <port> [數量] 或 host:port ...")
+    ap.add_argument("--pps", type=float, default=2.0, help=f"每秒放幾個方塊（最多 {MAX_PPS}）")
+    ap.add_argument("--strength", type=float, default=1.0, help="0~1，越低越常下錯")
+    args = ap.parse_args()
+    if not 0 < args.pps <= MAX_PPS:
+        ap.error(f"--pps 要在 0~{MAX_PPS} 之間（伺服器的輸入限速是照這個上限算的）")
+
+    if ":" in args.target[0]:
+        targets = [(a.rsplit(":", 1)[0], int(a.rsplit(":", 1)[1])) for a in args.target]
+        per_match = 2
+    elif len(args.target) >= 2:
+        targets = [(args.target[0], int(args.target[1]))]
+        per_match = int(args.target[2]) if len(args.target) > 2 else 1
+    else:
+        ap.error("需要 <host> <port> 或 host:port")
+
+    runtime.run(main(targets, per_match, args.pps, args.strength))
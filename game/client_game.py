@@ -1,5 +1,11 @@
 import pygame, asyncio, time
-from common.network import send_msg, recv_msg
+from common.network import send_msg, recv_msg, encode_msg
+from common.compress import Inflater, CODEC
+from common.outbox import Outbox
+from common.clock import ClockSync, now_ms
+from common import runtime
+from game.render import COLOR_TABLE, BoardView, TextView, get_font, cell_sprite
+from game.views import expand_snapshot
 import sys
 
 
@@ -49,6 +55,7 @@ SHAPES = {
 WIDTH, HEIGHT = 900, 640
 CELL = 24
 MARGIN = 20
+RECONNECT_SEC = 8                # 斷線後嘗試重連多久（要比伺服器的 RESUME_GRACE_SEC 短）
 
 HOST, PORT = "127.0.0.1", 16800
 
@@ -60,19 +67,8 @@ if len(sys.argv) >= 4:
     user_id = int(sys.argv[3])
 else:
     user_id = 0
-
-
-
-
-COLOR_TABLE = {
-    "I": (0, 200, 200),     # Cyan → 稍灰
-    "O": (230, 230, 90),    # Yellow → 柔和
-    "T": (150, 80, 190),    # Purple → 淡一點
-    "S": (80, 200, 80),     # Green → 不那麼亮
-    "Z": (200, 80, 80),     # Red → 減亮度
-    "J": (80, 100, 200),    # Blue → 柔藍
-    "L": (220, 150, 60)     # Orange → 暖但不刺眼
-}
+# Lobby 發的 session token：game server 以它認定身分（user_id 只給舊版 server 用）
+session_token = sys.argv[4] if len(sys.argv) >= 5 else None
 
 
 class NetClient:
@@ -80,56 +76,104 @@ class NetClient:
         self.reader = None
         self.writer = None
         self.player_id = None
-        self.state = {"me":None, "op":None, "time_left":0.0}
+        self.state = {"me":None, "ops":{}, "time_left":0.0}   # ops: 對手 id -> 最新的 view
         self.running = True
         
         
         self.hold = None
         self.can_hold = True
 
+        # 同一個 frame 內的輸入先收集，frame 結束時合併成一個 inputs 封包
+        self.outbox = None
+        self.pending_inputs = []   # [(ev, when_ms)]
+        self.input_seq = 0         # 下一個輸入的序號
+
+        # 斷線重連：welcome 給的 token，掉線時拿它回到同一個位置
+        self.resume_token = None
+        self.addr = None
+        self.inflater = None      # 跟 server 協商了壓縮：下行的 snapshot 要用它解
+
 
     async def connect(self, host, port, name="Player"):
-        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.addr = (host, port)
+        self.reader, self.writer = await runtime.open_connection(host, port)
+        self.inflater = Inflater()
         # welcome
         w = await recv_msg(self.reader)
         self.player_id = w["player_id"]
-        await send_msg(self.writer, {"type":"hello","name": name, "user_id": user_id})
+        self.resume_token = w.get("resume_token")
+        await send_msg(self.writer, {"type":"hello","name": name, "user_id": user_id, "session": session_token,
+                                     "compress": CODEC})
         # 等 start
         while True:
-            m = await recv_msg(self.reader)
+            m = await recv_msg(self.reader, inflater=self.inflater)
             if m["type"] == "start":
                 self.start_info = m
                 break
+        # 之後的上行封包交給背景 task 送，render loop 不等 drain
+        self.outbox = Outbox(self.writer, "inputs")
         # 啟動收訊息
         asyncio.create_task(self._reader_loop())
 
+    async def _reconnect(self) -> bool:
+        """連線掉了：在伺服器的 grace window 內重連、送 resume，成功就換上新的 reader / outbox"""
+        if not self.resume_token:
+            return False
+        self.outbox.evict("connection lost", slow=False)
+        deadline = time.monotonic() + RECONNECT_SEC
+        while self.running and time.monotonic() < deadline:
+            try:
+                reader, writer = await asyncio.wait_for(runtime.open_connection(*self.addr), timeout=2.0)
+                inflater = Inflater()       # 新連線、新的壓縮串流
+                await recv_msg(reader)      # welcome（新的 token 用不到，位置沿用舊的）
+                await send_msg(writer, {"type": "resume", "token": self.resume_token, "compress": CODEC})
+                while True:
+                    m = await asyncio.wait_for(recv_msg(reader, inflater=inflater), timeout=2.0)
+                    if m.get("type") == "resumed":
+                        break
+                    if m.get("type") == "resume_failed":
+                        writer.close()
+                        print("❌ 無法回到對戰（已超過重連時間或對戰已結束）")
+                        return False
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, OSError):
+                await asyncio.sleep(0.5)
+                continue
+            self.reader, self.writer, self.inflater = reader, writer, inflater
+            self.outbox = Outbox(writer, "inputs")
+            print("🔁 已重新連線")
+            return True
+        return False
+
     async def _reader_loop(self):
         while self.running:
-            m = await recv_msg(self.reader)
+            try:
+                m = await recv_msg(self.reader, inflater=self.inflater)
+            except (asyncio.IncompleteReadError, ConnectionError, OSError):
+                print("📴 連線中斷，重新連線中...")
+                if await self._reconnect():
+                    continue
+                self.running = False
+                break
             if not m: break
             t = m["type"]
             if t == "snapshot":
                 self._update_snapshot(m)
+            elif t == "ping":
+                # 伺服器量 RTT / 時鐘差用，收到馬上回
+                self.outbox.push(encode_msg(ClockSync.pong(m, now_ms())))
             elif t == "game_over":
                 result = m.get("result", {})
                 winner = m.get("winner")
 
-                # 🧩 各玩家結果
-                p1 = result.get("p1", {})
-                p2 = result.get("p2", {})
-
-                # 確認自己是哪一位
-                me_is_p1 = (getattr(self, "player_id", None) == 1)
-                me = result.get("p1") if me_is_p1 else result.get("p2")
-                op = result.get("p2") if me_is_p1 else result.get("p1")
-
-                # 取出資料
+                # 🧩 各玩家結果（key 是 p{player_id}）
+                me = result.get(f"p{self.player_id}", {})
                 sc_me, lv_me = me.get("score", 0), me.get("level", 0)
-                sc_op, lv_op = op.get("score", 0), op.get("level", 0)
 
                 print("\n🏁 === 遊戲結束 ===")
                 print(f"🧍‍♂️ 你的分數：{sc_me}   等級：{lv_me}")
-                print(f"🎮 對手分數：{sc_op}   等級：{lv_op}")
+                for key, info in result.items():
+                    if key != f"p{self.player_id}":
+                        print(f"🎮 {info.get('name', key)} 分數：{info.get('score', 0)}   等級：{info.get('level', 0)}")
 
                 # 勝負判斷
                 if winner is None:
@@ -144,89 +188,55 @@ class NetClient:
                 self.running = False
 
     def _update_snapshot(self, snap):
+        # 伺服器依頻率分開送：自己的棋盤（完整、高頻）與對手的棋盤（精簡、低頻、delta），
+        # 一個 snapshot 可能只含其中一邊；對手的欄位沒送（例如棋盤沒變）就沿用上一次的
         me_id = self.player_id
-        p1, p2 = snap["players"]
-        a = p1 if p1["id"] == me_id else p2
-        b = p2 if p1["id"] == me_id else p1
-        self.state["me"] = a
-        self.state["op"] = b
+        ops = self.state["ops"]
+        for p in expand_snapshot(snap)["players"]:
+            if p["id"] == me_id:
+                self.state["me"] = p
+            else:
+                old = ops.get(p["id"])
+                ops[p["id"]] = {**old, **p} if old else p
         self.state["time_left"] = snap.get("time_left", 0.0)
 
-    async def send_input(self, ev:str):
-        now_ms = int(time.time()*1000)
-        await send_msg(self.writer, {"type":"input","when_ms":now_ms,"ev":ev})
+    def queue_input(self, ev:str):
+        self.pending_inputs.append((ev, int(time.time()*1000)))
+
+    def flush_inputs(self):
+        """把這個 frame 收集到的輸入合併成一個封包送出（不 await）"""
+        if not self.pending_inputs:
+            return
+        t0 = self.pending_inputs[0][1]
+        msg = {
+            "type": "inputs",
+            "seq": self.input_seq,             # 第一個輸入的序號，其餘依序 +1
+            "t0_ms": t0,
+            "evs": [[ev, when - t0] for ev, when in self.pending_inputs],   # [事件, 相對 t0 的 ms]
+        }
+        self.input_seq += len(self.pending_inputs)
+        self.pending_inputs.clear()
+        self.outbox.push(encode_msg(msg))
 
 # --- Pygame ---
+# 棋盤/字型/方塊都走 game.render 的快取，每幀只更新有變動的區域
 
-def draw_board(screen, board, ox, oy, cell_size=CELL,color=None):
-    """畫出整個棋盤（背景格子 + 方塊 + 外框）"""
-
-    # --- 1️⃣ 背景底格（空格顯示淺灰棋盤） ---
-    for r in range(20):
-        for c in range(10):
-            # 背景每格的顏色 (深灰+淺灰交錯可選)
-            base_color = (40, 40, 40) if (r + c) % 2 == 0 else (45, 45, 45)
-            rect = pygame.Rect(
-                ox + c * cell_size,
-                oy + r * cell_size,
-                cell_size - 1,
-                cell_size - 1
-            )
-            pygame.draw.rect(screen, base_color, rect)
-
-    # --- 2️⃣ 方塊 ---
-    for r in range(20):
-        for c in range(10):
-            v = board[r][c]
-            if not v:
-                continue
-            if color:
-                col = color
-            else:
-                col = COLOR_TABLE.get(v, (200, 200, 200))
-            rect = pygame.Rect(
-                ox + c * cell_size,
-                oy + r * cell_size,
-                cell_size - 1,
-                cell_size - 1
-            )
-            pygame.draw.rect(screen, col, rect)
-
-    # --- 3️⃣ 外框 ---
-    pygame.draw.rect(
-        screen,
-        (200, 200, 200),
-        (ox - 2, oy - 2, 10 * cell_size + 4, 20 * cell_size + 4),
-        2
-    )
-
-
-def draw_active(screen, active, ox, oy, cell_size=CELL):
-    if not active:
-        return
-    kind = active["kind"]
-    rot = active["rot"]
-    x, y = active["x"], active["y"]
-    color = COLOR_TABLE.get(kind, (200,200,200))
-    shape = SHAPES[kind][rot]
-    for (a, b) in shape:
-        rect = pygame.Rect(ox + (x + a) * cell_size, oy + (y + b) * cell_size, cell_size - 1, cell_size - 1)
-        pygame.draw.rect(screen, color, rect)
+BG = (22, 22, 24)
 
 
 def draw_hold(screen, hold_kind, ox, oy, cell=12):
-    """畫出暫存方塊 (縮小版)"""
-    font_small = pygame.font.SysFont(None, 18)
+    """畫出暫存方塊 (縮小版)，回傳更新範圍"""
+    area = pygame.Rect(ox - 6, oy - 22, 6 * cell + 2, 6 * cell + 18)
+    screen.fill(BG, area)
     pygame.draw.rect(screen, (80, 80, 90), (ox-5, oy-5, 6*cell, 6*cell), 2, border_radius=6)
-    label = font_small.render("HOLD", True, (230, 230, 230))
+    label = get_font(None, 18).render("HOLD", True, (230, 230, 230))
     screen.blit(label, (ox, oy - 20))
-    if not hold_kind:
-        return
-    shape = SHAPES[hold_kind][0]  # 顯示第一個旋轉狀態即可
-    color = COLOR_TABLE.get(hold_kind, (200,200,200))       # 暫存顏色
-    for (x, y) in shape:
-        rect = pygame.Rect(ox + (x+1)*cell, oy + (y+1)*cell, cell-1, cell-1)
-        pygame.draw.rect(screen, color, rect)
+    if hold_kind:
+        shape = SHAPES[hold_kind][0]  # 顯示第一個旋轉狀態即可
+        sprite = cell_sprite(COLOR_TABLE.get(hold_kind, (200,200,200)), cell)   # 暫存顏色
+        for (x, y) in shape:
+            screen.blit(sprite, (ox + (x+1)*cell, oy + (y+1)*cell))
+    return area
 
 
 async def game_main():
@@ -237,117 +247,141 @@ async def game_main():
     pygame.key.set_repeat(200, 75) # 按鍵重複輸入延遲與間隔
     
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
-    pygame.display.set_caption("Tetris (No Attack)")
+    pygame.display.set_caption("Tetris (Versus)")
     clock = pygame.time.Clock()
 
-    font = pygame.font.SysFont(None, 28)
-    
+    # === 座標設定 ===
+    BOARD_W = 10 * CELL
+    BOARD_H = 20 * CELL
+
+    CELL_OP = int(CELL * 0.6)
+    BOARD_H_OP = 20 * CELL_OP
+
+    # 🔹 將整體往右移 100px
+    OFFSET_X = 100
+
+    ox_me = 100 + OFFSET_X                 # 自己棋盤位置
+    oy_me = (HEIGHT - BOARD_H) // 2 - 20
+
+    ox_op = ox_me + BOARD_W + 180          # 對手棋盤位置（靠右上）
+    oy_op = oy_me
+
+    cell_hold = int(CELL_OP * 1.2)
+    hold_x = ox_op
+    hold_y = oy_op + BOARD_H_OP + 30
+    info_y = hold_y + 6 * cell_hold + 12
+
+    # 多人房：對手改成右側一格一格的小棋盤，HOLD / 分數移到自己棋盤左邊
+    n_players = net.start_info.get("players", 2)
+    CELL_MINI = 7
+    if n_players > 2:
+        cell_hold = CELL_OP
+        hold_x = 30
+        hold_y = oy_me + 20
+        info_y = hold_y + 6 * cell_hold + 12
+
+    op_ids = [i for i in range(1, n_players + 1) if i != net.player_id]
+    op_views = {}
+    for i, pid in enumerate(op_ids):
+        if n_players == 2:
+            op_views[pid] = BoardView(ox_op, oy_op, CELL_OP, palette=((40, 40, 50),), border=(180, 180, 180), shapes=SHAPES)
+        else:
+            col, row = i % 5, i // 5
+            x = ox_me + BOARD_W + 40 + col * (10 * CELL_MINI + 12)
+            y = oy_me + row * (20 * CELL_MINI + 12)
+            op_views[pid] = BoardView(x, y, CELL_MINI, palette=((40, 40, 50),), border=(180, 180, 180), shapes=SHAPES)
+
+    me_view = BoardView(ox_me, oy_me, CELL, shapes=SHAPES)
+    font_info = get_font("Microsoft JhengHei", 28)
+    text_lv = TextView((hold_x, info_y), font_info, bg=BG)
+    text_sc = TextView((hold_x, info_y + 30), font_info, bg=BG)
+    last_hold = ()          # 還沒畫過
+    last_garbage = None
+    meter = pygame.Rect(ox_me - 14, oy_me, 8, BOARD_H)    # 待收垃圾行的 meter（棋盤左側）
+
+    full_redraw = True
 
     while net.running:
         for e in pygame.event.get():
             if e.type == pygame.QUIT:
                 net.running = False
 
+            elif e.type == pygame.VIDEOEXPOSE:
+                full_redraw = True
+
             elif e.type == pygame.KEYDOWN:
                 if e.key == pygame.K_LEFT:
-                    await net.send_input("L")
+                    net.queue_input("L")
                 elif e.key == pygame.K_RIGHT:
-                    await net.send_input("R")
+                    net.queue_input("R")
                 elif e.key == pygame.K_UP:
-                    await net.send_input("CW")
+                    net.queue_input("CW")
                 elif e.key == pygame.K_z:
-                    await net.send_input("CCW")
+                    net.queue_input("CCW")
                 elif e.key == pygame.K_DOWN:
-                    await net.send_input("SD")
+                    net.queue_input("SD")
                 elif e.key == pygame.K_SPACE:
-                    await net.send_input("HD")
+                    net.queue_input("HD")
                 elif e.key == pygame.K_c:
-                    await net.send_input("HOLD")
+                    net.queue_input("HOLD")
+
+        net.flush_inputs()
 
-        screen.fill((22,22,24))
+        dirty = []
+        if full_redraw:
+            screen.fill(BG)
+            dirty.append(screen.get_rect())
 
         me = net.state["me"]
-        op = net.state["op"]
-
-        # === 座標設定 ===
-        BOARD_W = 10 * CELL
-        BOARD_H = 20 * CELL
-
-        CELL_OP = int(CELL * 0.6)
-        BOARD_W_OP = 10 * CELL_OP
-        BOARD_H_OP = 20 * CELL_OP
-
-        # 🔹 將整體往右移 100px
-        OFFSET_X = 100
-
-        ox_me = 100 + OFFSET_X                 # 自己棋盤位置
-        oy_me = (HEIGHT - BOARD_H) // 2 - 20
-
-        ox_op = ox_me + BOARD_W + 180          # 對手棋盤位置（靠右上）
-        oy_op = oy_me
-
-        # --- 對手棋盤（含 active 掉落方塊） ---
-        if op:
-            # --- 對手棋盤 ---
-            for r in range(20):
-                for c in range(10):
-                    v = op["board"][r][c]
-                    rect = pygame.Rect(ox_op + c * CELL_OP, oy_op + r * CELL_OP, CELL_OP - 1, CELL_OP - 1)
-                    if v:
-                        col = COLOR_TABLE.get(v, (150, 150, 150))
-                        pygame.draw.rect(screen, col, rect)
-                    else:
-                        pygame.draw.rect(screen, (40, 40, 50), rect)
-
-            # --- 掉落方塊 (active) ---
-            if op["active"]:
-                kind = op["active"]["kind"]
-                rot = op["active"]["rot"]
-                x, y = op["active"]["x"], op["active"]["y"]
-                shape = SHAPES[kind][rot]
-                color = COLOR_TABLE.get(kind, (200,200,200))
-                for (a, b) in shape:
-                    rect = pygame.Rect(
-                        ox_op + (x + a) * CELL_OP,
-                        oy_op + (y + b) * CELL_OP,
-                        CELL_OP - 1,
-                        CELL_OP - 1
-                    )
-                    pygame.draw.rect(screen, color, rect)
-
-            # --- 外框 ---
-            pygame.draw.rect(screen, (180,180,180),
-                            (ox_op-2, oy_op-2, BOARD_W_OP+4, BOARD_H_OP+4), 2)
+
+        # --- 對手棋盤（1v1 含 active 掉落方塊；多人房只有棋盤） ---
+        for pid, op in net.state["ops"].items():
+            op_view = op_views.get(pid)
+            if not op_view or "board" not in op:
+                continue
+            op_view.update(op["board"], color=None if op.get("alive", True) else (90, 90, 90))
+            r = op_view.draw(screen, op.get("active"), force=full_redraw)
+            if r:
+                dirty.append(r)
 
         # --- 自己棋盤（左側主要畫面） ---
         if me:
-            if me["alive"]:
-                draw_board(screen, me["board"], ox_me, oy_me)
-                draw_active(screen, me["active"], ox_me, oy_me)
-            else:
-                draw_board(screen, me["board"], ox_me, oy_me, color=(100,100,100))
-                font_dead = pygame.font.SysFont("Microsoft JhengHei", 40)
-                txt_dead = font_dead.render("你已死亡", True, (255,120,120))
-                screen.blit(txt_dead, (
-                    ox_me + (BOARD_W // 2 - txt_dead.get_width() // 2),
-                    oy_me + (BOARD_H // 2 - txt_dead.get_height() // 2)
-                ))
+            dead = not me["alive"]
+            me_view.update(me["board"], color=(100, 100, 100) if dead else None)
+            r = me_view.draw(screen, None if dead else me["active"], force=full_redraw)
+            if r:
+                dirty.append(r)
+                if dead:
+                    txt_dead = get_font("Microsoft JhengHei", 40).render("你已死亡", True, (255,120,120))
+                    screen.blit(txt_dead, (
+                        ox_me + (BOARD_W // 2 - txt_dead.get_width() // 2),
+                        oy_me + (BOARD_H // 2 - txt_dead.get_height() // 2)
+                    ))
+
+            # --- 待收垃圾 meter：每一行一格，從底部往上 ---
+            g = me.get("garbage", 0)
+            if full_redraw or g != last_garbage:
+                last_garbage = g
+                screen.fill(BG, meter)
+                h = min(g, 20) * CELL
+                if h:
+                    screen.fill((220, 60, 60), (meter.x, meter.bottom - h, meter.width, h))
+                dirty.append(meter)
 
             # --- HOLD 區塊 ---
-            cell_hold = int(CELL_OP * 1.2)
-            hold_x = ox_op
-            hold_y = oy_op + BOARD_H_OP + 30
-            draw_hold(screen, me.get("hold"), hold_x, hold_y, cell=cell_hold)
+            if full_redraw or me.get("hold") != last_hold:
+                last_hold = me.get("hold")
+                dirty.append(draw_hold(screen, last_hold, hold_x, hold_y, cell=cell_hold))
 
             # --- 分數與等級（在 HOLD 下方） ---
-            font_info = pygame.font.SysFont("Microsoft JhengHei", 28)
-            info_y = hold_y + 6 * cell_hold + 12
-            text_lv = font_info.render(f"Level：{me.get('level', 0)}", True, (230,230,230))
-            text_sc = font_info.render(f"Score：{me['score']}", True, (230,230,230))
-            screen.blit(text_lv, (hold_x, info_y))
-            screen.blit(text_sc, (hold_x, info_y + 30))
-
-        pygame.display.flip()
+            for view, text in ((text_lv, f"Level：{me.get('level', 0)}"), (text_sc, f"Score：{me['score']}")):
+                r = view.draw(screen, text, force=full_redraw)
+                if r:
+                    dirty.append(r)
+
+        if dirty:
+            pygame.display.update(dirty)
+        full_redraw = False
         clock.tick(60)
         await asyncio.sleep(0)  # 不阻塞 loop
 
@@ -361,8 +395,8 @@ async def game_main():
 
         screen.fill((0, 0, 0))
         # ✅ 使用支援中文的字型（不含 emoji）
-        font_big = pygame.font.SysFont("Microsoft JhengHei", 48)
-        font_small = pygame.font.SysFont("Microsoft JhengHei", 32)
+        font_big = get_font("Microsoft JhengHei", 48)
+        font_small = get_font("Microsoft JhengHei", 32)
 
         # 標題
         title_txt = f"遊戲結束"
@@ -382,21 +416,16 @@ async def game_main():
 
         r = result["result"]
 
-        # 🟩 保險寫法：確保有 p1 / p2
-        p1_score = r.get("p1", {}).get("score", 0)
-        p2_score = r.get("p2", {}).get("score", 0)
-
-        # ✅ 取得自己 ID
-        my_id = net.state["me"]["id"]
+        # ✅ 取得自己的結果（result 的 key 是 p{player_id}）
+        mine = r.get(f"p{net.player_id}", {})
+        my_score = mine.get("score", 0)
 
-        # ✅ 根據身分決定顯示順序
-        if my_id == 1:
-            my_score, op_score = p1_score, p2_score
+        # ✅ 組字串：1v1 顯示雙方分數，多人顯示名次
+        if len(r) == 2:
+            op_score = next((v.get("score", 0) for k, v in r.items() if k != f"p{net.player_id}"), 0)
+            score_txt = f"分數：你 {my_score}  vs  對手 {op_score}"
         else:
-            my_score, op_score = p2_score, p1_score
-
-        # ✅ 組字串
-        score_txt = f"分數：你 {my_score}  vs  對手 {op_score}"
+            score_txt = f"分數：{my_score}　名次：{mine.get('rank', '?')} / {len(r)}"
         text3 = font_small.render(score_txt, True, (200, 200, 200))
         screen.blit(text3, (WIDTH // 2 - text3.get_width() // 2, HEIGHT // 2 + 80))
 
@@ -408,4 +437,4 @@ async def game_main():
     
 
 if __name__ == "__main__":
-    asyncio.run(game_main())
+    runtime.run(game_main(), report=False)
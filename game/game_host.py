@@ -0,0 +1,341 @@
+import asyncio
+import logging
+import os
+import socket
+import subprocess
+import sys
+from collections import deque
+
+from common.network import send_msg, recv_msg
+from common.log import get_logger
+from common.metrics import metrics, start_stats_server
+from common import session
+from common import runtime
+from common.host_client import CONTROL_HOST, CONTROL_PORT, REQUEST_TIMEOUT_SEC
+from game.game_server import run_match, HOST
+from game.result_channel import ResultChannel
+
+if sys.platform.startswith("win"):
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+logging.getLogger("asyncio").setLevel(logging.CRITICAL)
+
+# -------------------------------
+# 多核心對戰主機：supervisor + N 個 worker process
+# -------------------------------
+# 原本每場對戰一個 game_server process（Lobby 開、跑完就離開）。場次一多，process 數和啟動成本都跟著長。
+# 這裡改成固定 N 個 worker（預設 = CPU 核心數），每個 worker 一個 event loop、同時跑很多場 run_match()：
+#
+#   python -m game.game_host [workers] [control_port]
+#
+#   Lobby ──Host/start──▶ supervisor ──start──▶ worker k（目前負載最低的）
+#                              │                    └─ run_match(room_id, port, ...)
+#                              └─ 回覆 game_host / game_port，Lobby 照舊轉給玩家
+#
+# - 每場對戰仍然一個 port（由 supervisor 的 port 範圍分配），玩家直接連到該場所在的 worker，
+#   client 端協定完全不變。這就是「Lobby 端的路由表」：room → (host, port) → worker。
+# - 不用 SO_REUSEPORT：同一場的玩家必須進到同一個 process（Game 狀態在記憶體裡），
+#   kernel 依連線 hash 分流會把同一場拆到不同 worker；Windows 也沒有這個選項。
+# - 負載 = worker 上所有對戰的玩家數總和（16 人房比 1v1 重），新場次放到最輕的 worker。
+# - supervisor 每秒問一次各 worker 還在跑哪些場次，結束的 port 收回；
+#   worker 掛掉就重開，上面的房間代替它通知 Lobby（Game/ended，reason=crashed）。
+#
+# Lobby 端設定 NT_GAME_HOST=127.0.0.1:14120 就改用這裡開對戰，沒設定（或連不上）照舊一場一個 process。
+# Lobby 那端的 client（HostClient）和控制協定的常數在 common.host_client。
+
+log = get_logger("game_host")
+
+STATS_PORT = 14121
+WORKER_CONTROL_BASE = 14200      # supervisor → worker k：127.0.0.1:(14200 + k)
+WORKER_STATS_BASE = 14300        # worker k 的 stats endpoint：14300 + k
+GAME_PORTS = (17000, 17400)      # 對戰 port 範圍：跟 Lobby 自己開 game server / relay 的範圍分開
+                                 # （host 開不了局時 Lobby 會自動改開獨立 process，兩邊同時在用）
+STATUS_INTERVAL_SEC = 1          # 多久跟 worker 對一次帳（收回已結束場次的 port、檢查 worker 是否還活著）
+WORKER_CONNECT_SEC = 10          # 剛開的 worker 最多等多久 listen
+
+
+def port_bindable(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        try:
+            s.bind((HOST, port))
+            return True
+        except OSError:
+            return False
+
+
+# -------------------------------
+# worker：一個 event loop 跑很多場
+# -------------------------------
+# matches = {port: asyncio.Task}
+matches = {}
+spool_flushed = False
+
+
+def match_done(port: int, task: asyncio.Task):
+    matches.pop(port, None)
+    metrics.set("worker_matches", len(matches))
+    if not task.cancelled() and task.exception():
+        metrics.inc("worker_match_errors")
+        log.warning("⚠️ 對戰異常結束", port=port, error=task.exception())
+
+
+def worker_request(req: dict) -> dict:
+    global spool_flushed
+    action = req.get("action")
+    data = req.get("data", {})
+
+    if action == "start":
+        # Lobby 發的 session token 要用同一把 secret 驗章
+        if session.EPHEMERAL_SECRET and data.get("session_secret"):
+            session.set_secret(data["session_secret"])
+        port = data["port"]
+        task = asyncio.create_task(run_match(data["room_id"], port, data["players"], data["lobby_port"],
+                                             flush_spool=not spool_flushed))
+        spool_flushed = True         # spool 每個 worker 補送一次就好
+        matches[port] = task
+        task.add_done_callback(lambda t, port=port: match_done(port, t))
+        metrics.set("worker_matches", len(matches))
+        return {"ok": True, "matches": len(matches)}
+
+    elif action == "status":
+        return {"ok": True, "ports": list(matches)}
+
+    return {"ok": False, "error": f"未知 action: {action}"}
+
+
+async def handle_supervisor(reader, writer):
+    try:
+        while True:
+            req = await recv_msg(reader)
+            if req is None:
+                break
+            try:
+                resp = worker_request(req)
+            except KeyError as e:
+                resp = {"ok": False, "error": f"Missing field: {e}"}
+            await send_msg(writer, resp)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def worker_main(index: int):
+    server = await runtime.start_server(handle_supervisor, CONTROL_HOST, WORKER_CONTROL_BASE + index)
+    log.info("✅ Game worker 啟動", worker=index, pid=os.getpid())
+    await start_stats_server(WORKER_STATS_BASE + index)
+    async with server:
+        await server.serve_forever()
+
+
+# -------------------------------
+# supervisor：開 worker、放置場次、回收 port
+# -------------------------------
+class Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.proc = None
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()     # 一問一答
+        # matches = {port: {"room_id", "players", "lobby_port"}}
+        self.matches = {}
+
+    @property
+    def load(self) -> int:
+        return sum(m["players"] for m in self.matches.values())
+
+    def spawn(self):
+        self.proc = subprocess.Popen(["python", "-m", "game.game_host", "--worker", str(self.index)])
+        self.reader = self.writer = None
+        log.info("🧵 啟動 worker", worker=self.index, pid=self.proc.pid)
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    async def _connect(self) -> bool:
+        deadline = asyncio.get_running_loop().time() + WORKER_CONNECT_SEC
+        while self.alive():
+            try:
+                self.reader, self.writer = await runtime.open_connection(CONTROL_HOST, WORKER_CONTROL_BASE + self.index)
+                return True
+            except OSError:
+                if asyncio.get_running_loop().time() > deadline:
+                    break
+                await asyncio.sleep(0.2)     # 剛啟動，還沒 listen
+        return False
+
+    async def _call(self, action: str, data: dict):
+        await send_msg(self.writer, {"collection": "Worker", "action": action, "data": data})
+        return await recv_msg(self.reader)
+
+    async def request(self, action: str, **data):
+        """呼叫端要先拿 self.lock；連線有問題（或超過 REQUEST_TIMEOUT_SEC 沒回覆）回傳 None"""
+        if self.writer is None and not await self._connect():
+            return None
+        try:
+            resp = await asyncio.wait_for(self._call(action, data), timeout=REQUEST_TIMEOUT_SEC)
+            if resp is not None:
+                return resp
+        except asyncio.TimeoutError:
+            metrics.inc("host_worker_timeouts", worker=self.index)
+            log.warning("⌛ worker 沒有回應", worker=self.index, action=action, timeout=REQUEST_TIMEOUT_SEC)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            log.warning("⚠️ worker 控制連線中斷", worker=self.index, error=e)
+        self.writer.close()
+        self.reader = self.writer = None
+        return None
+
+
+workers = []
+free_ports = deque(range(*GAME_PORTS))
+
+
+def acquire_port() -> int:
+    for _ in range(len(free_ports)):
+        port = free_ports.popleft()
+        if port_bindable(port):
+            return port
+        free_ports.append(port)          # 被別的程式佔用，排回最後
+    raise RuntimeError("❌ 沒有可用的 port")
+
+
+def release_port(port: int):
+    # 排到最後：剛關掉的 port 可能還在 TIME_WAIT
+    free_ports.append(port)
+
+
+async def place_match(data: dict) -> dict:
+    """新場次放到負載最低的 worker 上"""
+    candidates = [w for w in workers if w.alive()]
+    if not candidates:
+        return {"ok": False, "error": "沒有可用的 worker"}
+    worker = min(candidates, key=lambda w: w.load)
+    try:
+        port = acquire_port()
+    except RuntimeError as e:
+        return {"ok": False, "error": str(e)}
+
+    match = {"room_id": data["room_id"], "players": data["players"], "lobby_port": data["lobby_port"]}
+    async with worker.lock:
+        resp = await worker.request("start", port=port, session_secret=data.get("session_secret"), **match)
+        if not resp or not resp.get("ok"):
+            release_port(port)
+            return {"ok": False, "error": (resp or {}).get("error", "worker 沒有回應")}
+        # 代替掛掉的 worker 通知 Lobby 時，要用這一場 Lobby 的 secret 簽控制連線
+        worker.matches[port] = {**match, "secret": data.get("session_secret")}
+
+    metrics.inc("host_matches_started", worker=worker.index)
+    log.info("🎮 放置對戰", room=match["room_id"], worker=worker.index, port=port, load=worker.load)
+    return {"ok": True, "game_host": HOST, "game_port": port, "worker": worker.index}
+
+
+async def notify_crashed(port: int, match: dict):
+    """worker 掛掉：代替它通知 Lobby 房間可以重開"""
+    channel = ResultChannel(HOST, match["lobby_port"], {"room_id": match["room_id"], "port": port},
+                            secret=match.get("secret"))
+    await channel.request({"collection": "Game", "action": "ended",
+                           "data": {"room_id": match["room_id"], "port": port, "reason": "crashed"}})
+    await channel.close()
+
+
+async def sync_worker(worker: Worker):
+    async with worker.lock:
+        if not worker.alive():
+            code = worker.proc.poll()
+            log.warning("💀 worker 結束，重新啟動", worker=worker.index, code=code, matches=len(worker.matches))
+            metrics.inc("host_worker_restarts", worker=worker.index)
+            lost, worker.matches = worker.matches, {}
+            for port, match in lost.items():
+                release_port(port)
+                if match["lobby_port"]:
+                    asyncio.create_task(notify_crashed(port, match))
+            worker.spawn()
+            return
+
+        resp = await worker.request("status")
+        if not resp or not resp.get("ok"):
+            return
+        running = set(resp["ports"])
+        for port in [p for p in worker.matches if p not in running]:
+            worker.matches.pop(port)
+            release_port(port)
+        for port in running - worker.matches.keys():
+            # start 逾時、port 已經收回，但 worker 其實開了這場（Lobby 已改用獨立 process）：
+            # 先記在這個 worker 名下，不再發給別場，等它自己結束再收回
+            if port in free_ports:
+                free_ports.remove(port)
+            worker.matches[port] = {"room_id": None, "players": 0, "lobby_port": None}
+    metrics.set("host_worker_players", worker.load, worker=worker.index)
+    metrics.set("host_worker_matches", len(worker.matches), worker=worker.index)
+
+
+async def status_loop():
+    while True:
+        await asyncio.sleep(STATUS_INTERVAL_SEC)
+        await asyncio.gather(*(sync_worker(w) for w in workers))
+
+
+async def handle_request(req: dict) -> dict:
+    action = req.get("action")
+    data = req.get("data", {})
+
+    if action == "start":
+        return await place_match(data)
+
+    elif action == "status":
+        return {"ok": True, "workers": [{"worker": w.index, "alive": w.alive(), "matches": len(w.matches),
+                                         "players": w.load} for w in workers]}
+
+    return {"ok": False, "error": f"未知 action: {action}"}
+
+
+async def handle_client(reader, writer):
+    addr = writer.get_extra_info("peername")
+    log.info("📡 Lobby 連線", addr=addr)
+    try:
+        while True:
+            req = await recv_msg(reader)
+            if req is None:
+                break
+            try:
+                resp = await handle_request(req)
+            except KeyError as e:
+                resp = {"ok": False, "error": f"Missing field: {e}"}
+            metrics.inc("host_requests", action=req.get("action"))
+            await send_msg(writer, resp)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        log.info("❌ Lobby 中斷連線", addr=addr)
+    finally:
+        writer.close()
+
+
+async def supervisor_main(n_workers: int, port: int):
+    if session.EPHEMERAL_SECRET:
+        # 沒設定 NT_SESSION_SECRET：worker 不繼承 supervisor 隨機產生的那把，改用 Lobby 開局時帶來的
+        os.environ.pop(session.SECRET_ENV, None)
+    for i in range(n_workers):
+        worker = Worker(i)
+        worker.spawn()
+        workers.append(worker)
+
+    server = await runtime.start_server(handle_client, CONTROL_HOST, port)
+    log.info("✅ Game host 啟動", host=HOST, port=port, workers=n_workers, game_ports=GAME_PORTS)
+    if await start_stats_server(STATS_PORT):
+        log.info("📊 stats endpoint", port=STATS_PORT)
+    checker = asyncio.create_task(status_loop())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        checker.cancel()
+        for worker in workers:
+            if worker.alive():
+                worker.proc.terminate()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--worker":
+        runtime.run(worker_main(int(sys.argv[2])))
+    else:
+        n = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+        runtime.run(supervisor_main(n, int(sys.argv[2]) if len(sys.argv) > 2 else CONTROL_PORT))
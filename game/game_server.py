@@ -1,10 +1,15 @@
-import asyncio, time
+import asyncio, time, heapq, random
 from collections import deque, defaultdict
 from typing import Dict, Any
-from common.network import send_msg, recv_msg  # 你現成的
+from common.network import send_msg, recv_msg, encode_msg, pack_frame, MAX_LEN  # 你現成的
+from common.log import get_logger
+from common.metrics import metrics, start_stats_server
+from common.outbox import Outbox
+from common import runtime
 import sys
 import socket
 import json
+import secrets
 
 def get_host_ip():
     """自動偵測這台機器對外可連線的 IP"""
@@ -23,22 +28,34 @@ HOST = get_host_ip()
 PORT = 16800
 LOBBY_PORT = 14110
 ROOM_ID = None
+MAX_PLAYERS = 2                  # 這一場的玩家數（2 = 原本的 1v1，最多 16）
 
-if len(sys.argv) > 1:
-    try:
-        PORT = int(sys.argv[1])
-    except ValueError:
-        print("⚠️ 無效的 port 參數，使用預設值 10010")
-if len(sys.argv) > 2:
-    ROOM_ID = int(sys.argv[2])
+log = get_logger("game")
 
 
 TPS = 30                         # 模擬頻率（ticks per second）
-SNAPSHOT_INTERVAL_MS = 100
+# 依接收者決定 snapshot 的頻率與內容
+SELF_SNAPSHOT_MS = 100           # 自己的棋盤：完整欄位、高頻
+OPPONENT_SNAPSHOT_MS = 300       # 對手的棋盤：精簡欄位（沒有 next/hold）、低頻
+SPECTATOR_SNAPSHOT_MS = 100      # 觀戰者：所有玩家都用精簡欄位
+OPPONENT_KEYFRAME_MS = 2000      # 對手資料是 delta（棋盤沒變就不送），每隔一段時間補一次完整的
 MATCH_SEC = None                   # 計時賽 60s
 GRAVITY_DROP_MS = 800            # 重力（固定）
-
-from game.bag import seven_bag_stream
+ATTACK_ENABLED = True            # 對戰模式：消行會送垃圾行給對手
+MAX_INPUT_BATCH = 64             # 一個 inputs 封包最多幾個事件
+ACCEPT_UNSIGNED_USER_ID = False  # 舊版 hello 直接帶 user_id（沒驗證，任何人都能冒名寫入戰績）
+RESUME_GRACE_SEC = 10            # 斷線後保留位置的時間；期間棋盤暫停，超過就判定棄權
+JOIN_TIMEOUT_SEC = 120           # 開房後玩家遲遲沒到齊就關掉，不佔著 port
+EMPTY_ROW = (0,) * 10
+
+from game.bag import SevenBag
+from game.garbage import GarbageQueue, ATTACK_TABLE
+from game.input_guard import InputValidator, parse_inputs, parse_input
+from common.clock import ClockSync, PING_INTERVAL_SEC
+from game.views import thumb_snapshot, pack_board, THUMB_INTERVAL_MS
+from game.result_channel import ResultChannel
+from common import session
+from common.compress import negotiate
 
 # --- 簡化：方塊旋轉與碰撞、鎖定、消行的細節請逐步補完 ---
 # 我先留 TODO，先跑起「流程＋同步」；你可把既有 Tetris 邏輯移入。
@@ -89,6 +106,7 @@ class Player:
     def __init__(self, pid:int, writer:asyncio.StreamWriter, name:str):
         self.id = pid
         self.writer = writer
+        self.outbox = None     # Outbox：snapshot 等下行封包都走這裡
         self.name = name
         self.input_q = deque()
         self.board = [[0]*10 for _ in range(20)]
@@ -102,38 +120,84 @@ class Player:
         self.level = 0
         self.lines_cleared_total = 0
         self.user_id = None 
+        self.next_input_seq = 0   # 下一個預期的輸入序號（重複的批次直接丟掉）
+        self.guard = None         # InputValidator
+        self.clock = ClockSync()  # ping/pong 估出的 RTT 與時鐘差（客戶端 - 伺服器）
+        self.board_ver = 0        # 棋盤每變一次 +1（對手 delta 用）
+        self.garbage = None       # GarbageQueue：待收的垃圾行
+        self.resume_token = None  # welcome 時發給客戶端，斷線重連時用
+        self.connected = True
+        self.disconnected_at = None
+        self.session = 0          # 每次（重新）連上 +1，舊連線的收尾就不會蓋掉新的
+        self.attack_seq = 0       # 多人房輪流攻擊用
+        self.bag_pos = 0          # 自己在共用方塊序列中的位置（已放進 next_queue 的數量）
 
     def enqueue_input(self, ev:str, when_ms:int):
         self.input_q.append((when_ms, ev))
 
 class Game:
-    def __init__(self):
+    def __init__(self, room_id=None, port: int = PORT, max_players: int = MAX_PLAYERS, channel: ResultChannel = None):
         self.players: Dict[int, Player,int] = {}
-        self.watchers: Dict[str, asyncio.StreamWriter] = {}
+        self.room_id = room_id
+        self.port = port
+        self.max_players = max_players
+        self.channel = channel                     # 對 Lobby 的常駐控制連線（結果回報、結束通知）
+        self.opp_sent_ver: Dict[int, int] = {}     # 上一次對手 delta 送出時各玩家的 board_ver
+        self.last_opp_keyframe_ms = 0
+        self.watchers: Dict[str, Outbox] = {}
+        self.watcher_detail: Dict[str, str] = {}   # wid -> "full" | "thumb"
         
         self.start_monotonic = None
         self.t0_server_ms = None
         self.finish = False
         self.seed = int(time.time()*1000) & 0xFFFFFFFF
-        self.bag = seven_bag_stream(self.seed)
-        self.last_snapshot_ms = 0
+        self.bag = SevenBag(self.seed)   # 每位玩家各自的 cursor，序列相同
+        self.last_sent_ms = {"self": 0, "opponent": 0, "spectator": 0}
         self.gravity_ms = GRAVITY_DROP_MS
-        self.mode = {"mode": "endless", "seconds": None}
-        
-
+        self.mode = {"mode": "versus" if ATTACK_ENABLED else "endless", "seconds": None}
+        self.watcher_seq = 0
+        self.last_thumb_ms = 0
+
+    def add_watcher(self, writer, detail: str = "full") -> str:
+        self.watcher_seq += 1
+        wid = f"W{self.watcher_seq}"
+        self.watchers[wid] = Outbox(writer, wid, on_evict=lambda o: self.remove_watcher(wid))
+        self.watcher_detail[wid] = detail
+        return wid
+
+    def remove_watcher(self, wid: str):
+        self.watchers.pop(wid, None)
+        self.watcher_detail.pop(wid, None)
+
+    def outboxes(self):
+        """所有玩家與觀戰者的 Outbox"""
+        return [p.outbox for p in self.players.values() if p.outbox is not None] + list(self.watchers.values())
+
+    def clear_metrics(self):
+        """這場結束：拿掉帶這場 port 的 gauge（worker 一場接一場，留著只會越積越多）"""
+        metrics.unset("send_queue_depth", match=self.port)
+        metrics.unset("watchers", match=self.port)
+        for pid in self.players:
+            metrics.unset("player_srtt_ms", match=self.port, player=pid)
+            metrics.unset("player_clock_offset_ms", match=self.port, player=pid)
 
     def add_player(self, pid:int, p:Player):
         self.players[pid] = p
+        p.garbage = GarbageQueue(random.Random(self.seed * 31 + pid))
         # 預先補足 next_queue
-        while len(p.next_queue) < 8:
-            p.next_queue.append(next(self.bag))
+        self.refill_next(p)
+
+    def refill_next(self, p:Player):
+        n = 8 - len(p.next_queue)
+        if n > 0:
+            p.next_queue.extend(self.bag.pieces(p.bag_pos, n))
+            p.bag_pos += n
 
     # ---- 這裡是方塊/碰撞/鎖定/消行的 TODO 位置 ---- #
     def ensure_active(self, p:Player):
         if p.active is None:
             kind = p.next_queue.popleft()
-            while len(p.next_queue) < 8:
-                p.next_queue.append(next(self.bag))
+            self.refill_next(p)
             # 置中出生
             p.active = {"kind": kind, "x": 3, "y": 0, "rot": 0}
             # TODO: 若一出生就碰撞 ⇒ top out
@@ -207,6 +271,47 @@ class Game:
         
 
 
+    def keyframe_for(self, p:Player) -> bytes:
+        """重連用：自己完整 + 所有對手含棋盤的 snapshot"""
+        players = [self.player_view(p, True)] + [self.player_view(o, False) for o in self.players.values() if o is not p]
+        return encode_msg({"type": "snapshot", "server_ms": int(time.time()*1000), "players": players})
+
+    def resume_player(self, token, outbox:Outbox):
+        """用 resume_token 接回斷線的玩家；成功回傳 Player，並先送 resumed + keyframe"""
+        if not isinstance(token, str):
+            return None
+        p = next((p for p in self.players.values()
+                  if p.resume_token and secrets.compare_digest(p.resume_token, token)), None)
+        if p is None or not p.alive or self.finish:
+            return None
+        if p.connected and p.outbox is not outbox:
+            # 舊連線可能是半開的（客戶端已經換網路），直接換掉
+            p.outbox.evict("replaced by resume", slow=False)
+        p.outbox = outbox
+        p.writer = outbox.writer
+        outbox.name = f"P{p.id}"
+        p.connected = True
+        p.disconnected_at = None
+        p.session += 1
+        outbox.push(encode_msg({"type": "resumed", "player_id": p.id, "server_ms": int(time.time()*1000)}))
+        outbox.push(self.keyframe_for(p))
+        metrics.inc("player_resumes")
+        log.info("🔁 玩家重新連線", player=p.id)
+        return p
+
+    def send_attack(self, p:Player, lines:int):
+        """消行攻擊：先抵銷自己待收的垃圾，剩下的送給一位還活著的對手（多人房輪流）"""
+        attack = p.garbage.cancel(ATTACK_TABLE.get(lines, 0))
+        if not attack:
+            return
+        targets = [o for o in self.players.values() if o is not p and o.alive]
+        if not targets:
+            return
+        target = targets[p.attack_seq % len(targets)]
+        p.attack_seq += 1
+        target.garbage.push(attack)
+        metrics.inc("garbage_sent", attack)
+
     def gravity_step(self, p: Player):
         if not p.alive:
             return
@@ -235,6 +340,7 @@ class Game:
         return False
 
     def lock_piece(self, p, shape):
+        p.board_ver += 1
         for (x, y) in shape:
             if y < 0:
                 p.alive = False
@@ -247,8 +353,10 @@ class Game:
 
         if lines > 0:
             for i in full:
-                del p.board[i]
-                p.board.insert(0, [0]*10)
+                # 消掉的 row 清空後放回最上面，不重新配置
+                row = p.board.pop(i)
+                row[:] = EMPTY_ROW
+                p.board.insert(0, row)
 
             # 累積總消行
             p.lines_cleared_total += lines
@@ -258,13 +366,20 @@ class Game:
             new_level = p.lines_cleared_total // 10
             if new_level > p.level:
                 p.level = new_level
-                print(f"⬆️ Player {p.id} level up to {p.level}")
+                log.info("⬆️ level up", player=p.id, level=p.level)
 
             # 分數表 (NES 規則)
             score_table = {1: 40, 2: 100, 3: 300, 4: 1200}
             base = score_table.get(lines, 0)
             p.score += base * (p.level + 1)
 
+            if ATTACK_ENABLED:
+                self.send_attack(p, lines)
+        elif ATTACK_ENABLED and p.garbage.total:
+            # 這次沒消行 → 待收的垃圾升起來
+            if not p.garbage.apply(p.board):
+                p.alive = False
+
         # 如果最上面一行有方塊 → 死亡
         if any(p.board[0]):
             p.alive = False
@@ -272,44 +387,165 @@ class Game:
         p.can_hold = True
 
 
+    def player_view(self, p:Player, full:bool=True, board:bool=True, active:bool=True) -> Dict[str,Any]:
+        """full=True 給玩家本人（含 next/hold）；False 給對手與觀戰者
+
+        board=False：棋盤沒變，省略（接收端沿用上一次的）；"packed"：壓成字串（views.pack_board）
+        active=False：不帶掉落中的方塊
+        """
+        view = {
+            "id": p.id,
+            "garbage": p.garbage.total if p.garbage else 0,   # 待收垃圾行數（meter）
+            "score": p.score,
+            "level": p.level,
+            "lines": p.lines,
+            "alive": p.alive
+        }
+        if board == "packed":
+            view["board"] = pack_board(p.board)
+        elif board:
+            view["board"] = p.board
+        if active:
+            view["active"] = p.active
+        if full:
+            view["next"] = list(p.next_queue)[:5]
+            view["hold"] = p.hold
+            view["can_hold"] = p.can_hold
+        return view
+
     def snapshot(self) -> Dict[str,Any]:
-        players_view=[]
-        for pid in (1,2):
-            p = self.players.get(pid)
-            players_view.append({
-                "id": pid,
-                "board": p.board,
-                "active": p.active,
-                "next": list(p.next_queue)[:5],
-                "hold": p.hold,
-                "can_hold": p.can_hold,
-                "score": p.score,
-                "level": p.level,
-                "lines": p.lines,
-                "alive": p.alive
-            })
+        players_view = [self.player_view(p) for p in self.players.values()]
         now_ms = int(time.time()*1000)
         return {"type": "snapshot", "server_ms": now_ms, "players": players_view}
 
+    def broadcast_snapshots(self, now_ms:int):
+        """依各接收者的 policy 送 snapshot。
+
+        每位玩家的視角每個 tick 最多編碼一次，各接收者的封包只是把這些 JSON 片段接起來。
+        - 自己：完整欄位（kind="snapshot"）
+        - 對手：delta，棋盤沒變就不帶 board，定期補完整的 keyframe（kind="opponents"）；
+          超過兩人的房間連 active 也省略（對手只畫成小棋盤）
+        - 觀戰者：所有玩家的精簡欄位（含棋盤，轉播節點拿來當 keyframe）
+        """
+        due = {k: now_ms - self.last_sent_ms[k] >= iv for k, iv in (
+            ("self", SELF_SNAPSHOT_MS), ("opponent", OPPONENT_SNAPSHOT_MS), ("spectator", SPECTATOR_SNAPSHOT_MS))}
+        if not any(due.values()):
+            return
+        for k, d in due.items():
+            if d:
+                self.last_sent_ms[k] = now_ms
+
+        parts = {}
+        def part(p, full, board=True, active=True):
+            key = (p.id, full, board, active)
+            if key not in parts:
+                parts[key] = json.dumps(self.player_view(p, full, board, active), ensure_ascii=False).encode("utf-8")
+            return parts[key]
+
+        head = b'{"type":"snapshot","server_ms":%d,"players":[' % now_ms
+        def frame(chunks):
+            return pack_frame(head + b",".join(chunks) + b"]}")
+
+        with metrics.timer("snapshot_encode_ms"):
+            self_frames = {}
+            if due["self"]:
+                for p in self.players.values():
+                    self_frames[p.id] = frame([part(p, True)])
+
+            opp_chunks = {}
+            if due["opponent"] and len(self.players) > 1:
+                keyframe = now_ms - self.last_opp_keyframe_ms >= OPPONENT_KEYFRAME_MS
+                if keyframe:
+                    self.last_opp_keyframe_ms = now_ms
+                show_active = self.max_players <= 2
+                for p in self.players.values():
+                    changed = keyframe or self.opp_sent_ver.get(p.id) != p.board_ver
+                    opp_chunks[p.id] = part(p, False, "packed" if changed else False, show_active)
+                    self.opp_sent_ver[p.id] = p.board_ver
+
+            spectator = thumb = None
+            if due["spectator"] and self.watchers:
+                spectator = frame([part(p, False) for p in self.players.values()])
+                # 縮圖觀戰者：更低頻、更少欄位
+                if now_ms - self.last_thumb_ms >= THUMB_INTERVAL_MS and "thumb" in self.watcher_detail.values():
+                    thumb = encode_msg(thumb_snapshot(
+                        {"server_ms": now_ms, "players": [self.player_view(p, False) for p in self.players.values()]}))
+                    self.last_thumb_ms = now_ms
+
+        # 👇 只放進各自的 Outbox，tick 不等 socket；同 kind 的舊封包會被新的取代
+        sent = 0
+        for p in self.players.values():
+            f = self_frames.get(p.id)
+            if f:
+                p.outbox.push(f, kind="snapshot")
+                sent += len(f)
+            if opp_chunks:
+                f = frame([c for pid, c in opp_chunks.items() if pid != p.id])
+                p.outbox.push(f, kind="opponents")
+                sent += len(f)
+        for wid, w in list(self.watchers.items()):
+            f = thumb if self.watcher_detail.get(wid) == "thumb" else spectator
+            if f:
+                w.push(f, kind="snapshot")
+                sent += len(f)
+        metrics.inc("snapshot_bytes", sent)
+
 
 async def handle_player(reader:asyncio.StreamReader, writer:asyncio.StreamWriter, game:Game, pid:int):
-    # welcome
-    await send_msg(writer, {"type":"welcome","player_id": pid})
+    # welcome（附上 resume_token，斷線時用它接回同一個位置）
+    token = secrets.token_urlsafe(16)
+    await send_msg(writer, {"type":"welcome","player_id": pid, "resume_token": token})
 
     # hello
     msg = await recv_msg(reader)
     
+    if msg and msg.get("type") == "hello" and msg.get("role") == "watch":
+        # 玩家還沒到齊前就連進來的觀戰者 / 轉播節點，不佔玩家位置
+        wid = game.add_watcher(writer, msg.get("detail", "full"))
+        negotiate(game.watchers[wid], msg)
+        return await handle_watcher(reader, writer, game, wid)
+
+    if msg and msg.get("type") == "resume":
+        # 斷線重連（遊戲還有空位時會走到這裡）
+        out = Outbox(writer, "resume")
+        negotiate(out, msg)
+        p = game.resume_player(msg.get("token"), out)
+        if p is None:
+            out.push(encode_msg({"type": "resume_failed"}))
+            return await out.close()
+        return await player_session(reader, game, p)
+
     if msg and msg.get("type") == "hello":
         name = msg.get("name", f"P{pid}")
-        user_id = msg.get("user_id")   # ✅ 建議用 user_id 比 player_id 一致
+        claims = session.verify(msg.get("session"))
+        if claims:
+            # ✅ Lobby 簽發的 session token：user_id / 名稱以 token 為準
+            user_id, name = claims["uid"], claims["name"]
+        else:
+            user_id = msg.get("user_id") if ACCEPT_UNSIGNED_USER_ID else None
+        if user_id is None:
+            log.info("🎭 玩家沒有有效 session，這場戰績不會記到帳號", player=pid, name=name)
     else:
         name = f"P{pid}"
         user_id = None
     
     p = Player(pid, writer, name)
     p.user_id = user_id
+    p.resume_token = token
+    p.guard = InputValidator(pid)
+    p.outbox = Outbox(writer, f"P{pid}")
+    if msg:
+        negotiate(p.outbox, msg)        # hello 帶 compress → 之後的 snapshot 都壓縮
     game.add_player(pid, p)
-    print(f"✅ Player{pid} connected: {name}")
+    log.info("✅ Player connected", player=pid, name=name)
+
+    await player_session(reader, game, p)
+
+
+async def player_session(reader:asyncio.StreamReader, game:Game, p:Player):
+    """一條玩家連線的輸入迴圈；斷線時進入 grace window，等待重連"""
+    pid = p.id
+    session = p.session
 
     # 等待開局之後，常駐讀取輸入
     try:
@@ -317,37 +553,100 @@ async def handle_player(reader:asyncio.StreamReader, writer:asyncio.StreamWriter
             m = await recv_msg(reader)
             if not m: break
             t = m.get("type")
-            if t == "input":
-                p.enqueue_input(m.get("ev"), int(m.get("when_ms", 0)))
-            # 其他類型（ping等）可擴充
+            if t == "inputs":
+                # 一個 frame 的輸入合併成一包：seq 為第一個事件的序號，evs = [[ev, 相對 t0_ms], ...]
+                batch = []
+                evs = m.get("evs") or []
+                if not isinstance(evs, list) or len(evs) > MAX_INPUT_BATCH:
+                    # 超過上限：整包拒收、seq 不推進（正常客戶端一個 frame 不會有這麼多輸入）
+                    p.guard.reject("batch_size")
+                else:
+                    try:
+                        seq, evs = parse_inputs(m, p.next_input_seq)
+                    except ValueError:
+                        p.guard.reject("malformed")      # 型別 / 欄位壞掉：當違規處理，不是斷線
+                    else:
+                        batch = evs[max(p.next_input_seq - seq, 0):]
+                        p.next_input_seq = max(p.next_input_seq, seq + len(evs))
+                        metrics.inc("game_inputs", len(evs))
+                        metrics.inc("game_input_batches")
+            elif t == "input":
+                metrics.inc("game_inputs")
+                try:
+                    batch = parse_input(m)
+                except ValueError:
+                    p.guard.reject("malformed")
+                    batch = []
+            elif t == "pong":
+                try:
+                    rtt = p.clock.sample(int(m["t0"]), int(m["t1"]), int(m["t2"]))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                p.guard.clock_offset_ms = p.clock.offset_ms
+                metrics.observe("player_rtt_ms", rtt)
+                # game_host 的 worker 同時跑很多場、每場都有 P1/P2：gauge 要帶這場的 port 才分得開
+                metrics.set("player_srtt_ms", round(p.clock.rtt_ms, 1), match=game.port, player=pid)
+                metrics.set("player_clock_offset_ms", round(p.clock.offset_ms, 1), match=game.port, player=pid)
+                continue
+            else:
+                continue
+
+            # 👇 先過輸入檢查（限速、時間戳），不合格的不會進 apply_input
+            for ev, when_ms in p.guard.filter(batch, int(time.time()*1000)):
+                p.enqueue_input(ev, p.clock.to_local(when_ms))   # 換算成伺服器時間
+            if p.guard.abusive:
+                p.outbox.evict("abusive input", slow=False)
+                break
     except Exception as e:
-        print(f"⚠️ player {pid} error: {e}")
+        log.warning("⚠️ player error", player=pid, error=e)
     finally:
-        p.alive = False
+        if p.session != session or game.finish:
+            pass                        # 已經被新連線接手 / 遊戲已結束
+        elif p.guard.abusive:
+            p.alive = False
+        else:
+            # 先不判死：保留位置 RESUME_GRACE_SEC 秒，棋盤暫停
+            p.connected = False
+            p.disconnected_at = time.monotonic()
+            metrics.inc("player_disconnects")
+            log.info("📴 玩家斷線，等待重連", player=pid, grace=RESUME_GRACE_SEC)
 
 async def handle_watcher(reader, writer, game, wid):
     """觀戰者獨立處理，不干擾主程式"""
-    await send_msg(writer, {"type": "welcome", "id": wid})
-    print(f"👀 Watcher {wid} 已啟動")
+    out = game.watchers[wid]
+    out.push(encode_msg({"type": "welcome", "id": wid}))
+    log.info("👀 Watcher 已啟動", watcher=wid)
 
+    resumed = None
     try:
-        # 觀戰者只接收，不回傳
-        while not game.finish:
-            await asyncio.sleep(1)  # 保持 loop 活著
+        # 觀戰者只會送 hello / subscribe 切換細節（full=完整、thumb=縮圖低頻）
+        # 對戰已滿時斷線重連的玩家也會先進到這裡，送 resume 之後轉成玩家連線
+        while not game.finish and not out.closed:
+            m = await recv_msg(reader)
+            if m.get("type") in ("hello", "subscribe"):
+                negotiate(out, m)
+                if m.get("detail") in ("full", "thumb"):
+                    game.watcher_detail[wid] = m["detail"]
+            elif m.get("type") == "resume":
+                negotiate(out, m)
+                game.remove_watcher(wid)
+                resumed = game.resume_player(m.get("token"), out)
+                if resumed:
+                    break
+                out.push(encode_msg({"type": "resume_failed"}))
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
     except Exception as e:
-        print(f"⚠️ 觀戰者 {wid} 發生錯誤: {e}")
+        log.warning("⚠️ 觀戰者發生錯誤", watcher=wid, error=e)
     finally:
-        if wid in game.watchers:
-            del game.watchers[wid]
-        try:
-            writer.close()
-            await writer.wait_closed()
-        except:
-            pass
-        print(f"👋 Watcher {wid} 離開")
-
-
+        if not resumed:
+            game.remove_watcher(wid)
+            await out.close()
+            log.info("👋 Watcher 離開", watcher=wid)
 
+    if resumed:
+        await player_session(reader, game, resumed)
 
 
 async def game_loop(game:Game):
@@ -359,27 +658,40 @@ async def game_loop(game:Game):
         "bagRule": "7bag",
         "gravity": {"dropIntervalMs": game.gravity_ms},
         "match": game.mode,
+        "players": game.max_players,
         "t0_server_ms": game.t0_server_ms
     }
+    start_frame = encode_msg(start_payload)
     for p in game.players.values():
-        await send_msg(p.writer, start_payload)
+        p.outbox.push(start_frame)
+        # 開局前先量一次 RTT / 時鐘差，第一批輸入就能校正
+        p.outbox.push(encode_msg(p.clock.ping()))
+    last_ping = time.monotonic()
 
     # 等待 t0
     await asyncio.sleep(max(0, (game.t0_server_ms - int(time.time()*1000))/1000.0))
     game.start_monotonic = time.monotonic()
-    print("🎬 Game started!")
+    log.info("🎬 Game started!", room=game.room_id)
 
     tick_dt = 1.0/TPS
     last_gravity_ms = defaultdict(lambda: 0)
 
     while not game.finish:
         now_ms = int(time.time()*1000)
+        tick_start = time.perf_counter()
 
-        # 1) 處理輸入
+        # 1) 處理輸入：各玩家的佇列依校正後的時間交錯套用（同一玩家維持原順序）
+        queues = [[(when, p, ev) for when, ev in p.input_q] for p in game.players.values() if p.input_q]
         for p in game.players.values():
-            while p.input_q:
-                _, ev = p.input_q.popleft()
-                game.apply_input(p, ev)
+            p.input_q.clear()
+        for _, p, ev in heapq.merge(*queues, key=lambda x: x[0]):
+            game.apply_input(p, ev)
+
+        # 定期 ping，更新每位玩家的 RTT / 時鐘差
+        if time.monotonic() - last_ping >= PING_INTERVAL_SEC:
+            last_ping = time.monotonic()
+            for p in game.players.values():
+                p.outbox.push(encode_msg(p.clock.ping()), kind="ping")
 
         # 2) 重力（獨立對每位玩家）
         level_speed_table = {
@@ -389,6 +701,14 @@ async def game_loop(game:Game):
         }
 
         for p in game.players.values():
+            if not p.connected:
+                # 斷線中：棋盤暫停；超過 grace window 就判定棄權
+                if p.alive and time.monotonic() - p.disconnected_at > RESUME_GRACE_SEC:
+                    p.alive = False
+                    metrics.inc("player_forfeits")
+                    log.info("🏳️ 斷線過久，判定棄權", player=p.id)
+                continue
+
             # 找對應等級的掉落間隔（預設最快 17ms）
             lv = min(p.level, 29)
             drop_ms = level_speed_table.get(lv, 17)
@@ -397,29 +717,10 @@ async def game_loop(game:Game):
                 game.gravity_step(p)
                 last_gravity_ms[p.id] = now_ms
 
-        # 3) 廣播 snapshot（每 100ms 一次）
-        if now_ms - game.last_snapshot_ms >= SNAPSHOT_INTERVAL_MS:
-            snap = game.snapshot()
-            
-            
-            for p in game.players.values():
-                await send_msg(p.writer, snap)
-                
-            if hasattr(game, "watchers"):
-                for wid, w in list(game.watchers.items()):
-                    async def send_to_watcher(wid, w):
-                        try:
-                            await send_msg(w, snap)
-                        except Exception as e:
-                            print(f"⚠️ 傳送 snapshot 給觀戰者 {wid} 失敗：{e}")
-                            if wid in game.watchers:
-                                del game.watchers[wid]
-                    # 👇 不 await，直接啟動任務
-                    asyncio.create_task(send_to_watcher(wid, w))
-                        
-                        
-                        
-            game.last_snapshot_ms = now_ms
+        # 3) 依接收者的 policy 廣播 snapshot
+        game.broadcast_snapshots(now_ms)
+        metrics.set("send_queue_depth", max((len(o) for o in game.outboxes()), default=0), match=game.port)
+        metrics.set("watchers", len(game.watchers), match=game.port)
 
         # 4) 檢查結束條件
         alive_players = [p for p in game.players.values() if p.alive]
@@ -430,31 +731,31 @@ async def game_loop(game:Game):
             game.finish = True
             break
 
+        metrics.observe("tick_ms", (time.perf_counter() - tick_start) * 1000)
         await asyncio.sleep(tick_dt)
 
     # ===== 遊戲結算 =====
-    print("🏁 Game over, computing result...")
+    log.info("🏁 Game over, computing result...")
 
-    p1, p2 = game.players.values()
-    reason = "both_dead"
+    players = list(game.players.values())
+    reason = "both_dead" if len(players) == 2 else "all_dead"
 
+    # 🏆 分數最高者獲勝（並列第一 → 平手）
+    ranked = sorted(players, key=lambda p: p.score, reverse=True)
+    winner = None
     winner_user_id = None
-    # 🏆 比較分數
-    if p1.score > p2.score:
-        winner = p1.id
-        winner_user_id = p1.user_id
-    elif p2.score > p1.score:
-        winner = p2.id
-        winner_user_id = p2.user_id
-    else:
-        winner = None  # 平手
+    if len(ranked) == 1 or ranked[0].score > ranked[1].score:
+        winner = ranked[0].id
+        winner_user_id = ranked[0].user_id
 
     result = {
         f"p{pid}": {
             "user_id": getattr(p, "user_id", None),
+            "name": p.name,
             "score": p.score,
             "level": p.level,
             "lines": p.lines,
+            "rank": 1 + sum(1 for o in players if o.score > p.score),
         }
         for pid, p in game.players.items()
     }
@@ -469,79 +770,116 @@ async def game_loop(game:Game):
 
     
 
-    for p in game.players.values():
-        await send_msg(p.writer, msg)
-        
-    if hasattr(game, "watchers") and game.watchers:
-        for wid, w in list(game.watchers.items()):
-            try:
-                await send_msg(w, msg)
-            except Exception as e:
-                print(f"⚠️ 傳送 game_over 給觀戰者 {wid} 失敗：{e}")
-                if wid in game.watchers:
-                    del game.watchers[wid]
-    
+    over_frame = encode_msg(msg)
+    for o in game.outboxes():
+        o.push(over_frame)
+    # 等 game_over 送出（慢的連線最多等 2 秒）
+    await asyncio.gather(*(o.close() for o in game.outboxes()))
 
-    print(f"🏁 Game over ({reason}), winner={winner}")
+
+    log.info("🏁 Game over", room=game.room_id, reason=reason, winner=winner)
     
-    payload = {
+    report = {
         "collection": "Game",
         "action": "report",
         "data": {
-            "room_id": ROOM_ID,
+            "room_id": game.room_id,
             "winner": winner_user_id,
             "result": result
         }
     }
-
-    try:
-        # 用最基礎 TCP 傳送 JSON（Length-prefixed framing）
-        with socket.create_connection((HOST, LOBBY_PORT), timeout=5) as s:
-            data = json.dumps(payload).encode("utf-8")
-            s.sendall(len(data).to_bytes(4, "big") + data)
-            print("📤 已回報比賽結果給 Lobby Server")
-    except Exception as e:
-        print(f"⚠️ 回報 Lobby 失敗：{e}")
-    
-    
-
-async def main():
-    game = Game()
-    # 等兩位玩家
-    print(f"🎮 Game server on {HOST}:{PORT}, waiting players...")
+    # 結果先落地再送，收到 ack 才刪；之後告訴 Lobby 這場結束了（房間回到 space，port 之後回收）
+    if await game.channel.report(report):
+        log.info("📤 已回報比賽結果給 Lobby Server", room=game.room_id)
+    await game.channel.request({"collection": "Game", "action": "ended",
+                                "data": {"room_id": game.room_id, "port": game.port, "reason": reason}})
+
+
+async def run_match(room_id, port: int, max_players: int, lobby_port: int, host: str = HOST,
+                    flush_spool: bool = True):
+    """跑一場對戰：開 port 等玩家到齊 → game_loop → 回報結果 → 關掉 port
+
+    單獨的 game server process 跑完一場就離開；game.game_host 的 worker 則在同一個 event loop 裡同時跑很多場。
+    """
+    channel = ResultChannel(host, lobby_port, {"room_id": room_id, "port": port})
+    game = Game(room_id, port, max_players, channel)
+    # 等所有玩家到齊
+    log.info("🎮 Game server waiting players...", room=room_id, host=host, port=port, players=game.max_players)
+    if flush_spool:
+        # 先連上 Lobby，順便補送之前沒送成功的結果
+        asyncio.create_task(channel.flush_spool())
 
     waiting = []
     
     accept_lock = asyncio.Lock()
+    started = asyncio.Event()
+    loop_task = None
 
     async def accept(reader, writer):
-        nonlocal waiting, game, accept_lock
+        nonlocal waiting, game, accept_lock, loop_task
         
-        if len(game.players) >= 2:
-            watcher_id = f"W{len(game.watchers)+1}"
-            game.watchers[watcher_id] = writer
-            print(f"👀 Watcher connected: {watcher_id}")
+        if len(game.players) >= game.max_players:
+            watcher_id = game.add_watcher(writer)
+            log.info("👀 Watcher connected", watcher=watcher_id)
             # 🔸 啟動獨立 watcher task，不 await！
             asyncio.create_task(handle_watcher(reader, writer, game, watcher_id))
             return
 
         async with accept_lock:  # 🔒 保證同時間只會進入一次
 
-            pid = 1 if 1 not in game.players else 2
+            pid = next((i for i in range(1, game.max_players + 1) if i not in game.players), None)
+            if pid is None:
+                writer.close()
+                return
             task = asyncio.create_task(handle_player(reader, writer, game, pid))
             waiting.append(task)
 
             # 等 handle_player() 加入
             await asyncio.sleep(0.2)
 
-            if len(game.players) == 2 and not getattr(game, "_started", False):
-                game._started = True
-                asyncio.create_task(game_loop(game))
+            if len(game.players) == game.max_players and not started.is_set():
+                started.set()
+                loop_task = asyncio.create_task(game_loop(game))
+
 
+    # 一場對戰一個 port：結算、回報完就關掉 server，port 交回 Lobby / game_host
+    # 玩家 / 觀戰者只會送小封包（inputs、ping、hello），不接受分塊的大訊息
+    server = await runtime.start_server(accept, host, port, framed=True, max_message_len=MAX_LEN)
+    try:
+        async with server:
+            try:
+                await asyncio.wait_for(started.wait(), timeout=JOIN_TIMEOUT_SEC)
+            except asyncio.TimeoutError:
+                log.warning("⌛ 玩家沒有到齊，關閉對戰", room=room_id, players=len(game.players), timeout=JOIN_TIMEOUT_SEC)
+                await channel.request({"collection": "Game", "action": "ended",
+                                       "data": {"room_id": room_id, "port": port, "reason": "abandoned"}})
+                return
+            await loop_task
+    finally:
+        game.clear_metrics()
+        await channel.close()
 
-    server = await asyncio.start_server(accept, HOST, PORT)
-    async with server:
-        await server.serve_forever()
+
+async def main():
+    stats_port = PORT + 1000         # 本機 stats endpoint（python -m common.metrics <port>）
+    if await start_stats_server(stats_port):
+        log.info("📊 stats endpoint", port=stats_port)
+    # 一個 process 只跑一場：跑完就離開
+    await run_match(ROOM_ID, PORT, MAX_PLAYERS, LOBBY_PORT)
+    log.info("👋 Game server 結束", port=PORT)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # python -m game.game_server <port> <room_id> <players> <lobby_port>
+    # （參數在這裡才解析：game.game_host 會 import 這個模組，argv 是它自己的）
+    if len(sys.argv) > 1:
+        try:
+            PORT = int(sys.argv[1])
+        except ValueError:
+            log.warning("⚠️ 無效的 port 參數，使用預設值", port=PORT)
+    if len(sys.argv) > 2:
+        ROOM_ID = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        MAX_PLAYERS = max(2, min(16, int(sys.argv[3])))
+    if len(sys.argv) > 4:
+        LOBBY_PORT = int(sys.argv[4])    # 分片模式：回報給啟動這場的 lobby 分片
+    runtime.run(main())
@@ -2,21 +2,14 @@ import asyncio
 import pygame
 import sys
 from common.network import send_msg, recv_msg
+from common.compress import Inflater, CODEC
+from common import runtime
+from game.render import BoardView, TextView, get_font
+from game.views import expand_snapshot
 
 WIDTH, HEIGHT = 800, 600
 CELL = 24
 
-# 🎨 顏色表（可與玩家端相同）
-COLOR_TABLE = {
-    "I": (0, 200, 200),     # Cyan → 稍灰
-    "O": (230, 230, 90),    # Yellow → 柔和
-    "T": (150, 80, 190),    # Purple → 淡一點
-    "S": (80, 200, 80),     # Green → 不那麼亮
-    "Z": (200, 80, 80),     # Red → 減亮度
-    "J": (80, 100, 200),    # Blue → 柔藍
-    "L": (220, 150, 60)     # Orange → 暖但不刺眼
-}
-
 SHAPES = {
     "I": [
         [(0,0),(1,0),(2,0),(3,0)],
@@ -60,49 +53,26 @@ SHAPES = {
 }
 
 
-def draw_board(screen, board, ox, oy, cell_size=CELL, color=None):
-    """畫出整個棋盤（背景格子 + 方塊 + 外框）"""
-
-    # --- 1️⃣ 背景底格 ---
-    for r in range(20):
-        for c in range(10):
-            base_color = (40, 40, 40) if (r + c) % 2 == 0 else (45, 45, 45)
-            rect = pygame.Rect(
-                ox + c * cell_size,
-                oy + r * cell_size,
-                cell_size - 1,
-                cell_size - 1
-            )
-            pygame.draw.rect(screen, base_color, rect)
-
-    # --- 2️⃣ 方塊 ---
-    for r in range(20):
-        for c in range(10):
-            v = board[r][c]
-            if not v:
-                continue
-            col = color or COLOR_TABLE.get(v, (200, 200, 200))
-            rect = pygame.Rect(
-                ox + c * cell_size,
-                oy + r * cell_size,
-                cell_size - 1,
-                cell_size - 1
-            )
-            pygame.draw.rect(screen, col, rect)
-
-    # --- 3️⃣ 外框 ---
-    pygame.draw.rect(
-        screen,
-        (200, 200, 200),
-        (ox - 2, oy - 2, 10 * cell_size + 4, 20 * cell_size + 4),
-        2
-    )
+async def open_watch(host, port, detail="full"):
+    """以觀戰身分連線（detail: full=完整串流, thumb=低頻縮圖）；回傳 reader, writer, 解壓用的 Inflater"""
+    # 轉播節點可能剛被 Lobby 啟動，稍微重試幾次
+    for attempt in range(10):
+        try:
+            reader, writer = await runtime.open_connection(host, port)
+            break
+        except OSError:
+            if attempt == 9:
+                raise
+            await asyncio.sleep(0.3)
+    await send_msg(writer, {"type": "hello", "name": "Watcher", "role": "watch", "detail": detail,
+                            "compress": CODEC})
+    return reader, writer, Inflater()
+
 
 async def watch_main(host, port):
     print(f"👀 觀戰模式啟動，連線至 {host}:{port}")
 
-    reader, writer = await asyncio.open_connection(host, port)
-    await send_msg(writer, {"type": "hello", "name": "Watcher"})
+    reader, writer, inflater = await open_watch(host, port)
 
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
@@ -117,7 +87,7 @@ async def watch_main(host, port):
         while running:
             try:
                 #print("⏳ 等待接收 snapshot...")
-                msg = await recv_msg(reader)
+                msg = await recv_msg(reader, inflater=inflater)
             except Exception as e:
                 #print(f"⚠️ 讀取 snapshot 錯誤：{e}")
                 break
@@ -133,58 +103,250 @@ async def watch_main(host, port):
 
     asyncio.create_task(recv_loop())
 
+    BG = (10, 10, 15)
+    views = [BoardView(100, 80, CELL, shapes=SHAPES), BoardView(400, 80, CELL, shapes=SHAPES)]
+    font = get_font("Microsoft JhengHei", 24)
+    texts = [TextView((100, 40), font, bg=BG), TextView((400, 40), font, bg=BG)]
+    full_redraw = True
+
     while running:
         await asyncio.sleep(0)
         
         for e in pygame.event.get():
             if e.type == pygame.QUIT:
                 running = False
+            elif e.type == pygame.VIDEOEXPOSE:
+                full_redraw = True
 
-        screen.fill((10, 10, 15))
+        dirty = []
+        if full_redraw:
+            screen.fill(BG)
+            dirty.append(screen.get_rect())
 
         if snapshot:
             players = snapshot.get("players", [])
             if len(players) >= 2:
-                p1, p2 = players[0], players[1]
-                draw_board(screen, p1["board"], 100, 80)
-                draw_board(screen, p2["board"], 400, 80)
-                
-                # 🟩 繪製正在掉落的方塊
-                for idx, (p, ox) in enumerate([(p1, 100), (p2, 400)], start=1):
-                    active = p.get("active")
-                    if not active:
-                        continue
-                    kind = active.get("kind")
-                    x, y, rot = active.get("x", 0), active.get("y", 0), active.get("rot", 0)
-                    shape = SHAPES.get(kind)
-                    if not shape:
-                        continue
-                    for dx, dy in shape[rot % len(shape)]:
-                        rect = pygame.Rect(
-                            ox + (x + dx) * CELL,
-                            80 + (y + dy) * CELL,
-                            CELL - 1,
-                            CELL - 1
-                        )
-                        pygame.draw.rect(screen, COLOR_TABLE.get(kind, (255,255,255)), rect)
-                        
-
-                font = pygame.font.SysFont("Microsoft JhengHei", 24)
-                text1 = font.render(f"{p1['id']} 分數:{p1['score']} LV:{p1['level']}", True, (230,230,230))
-                text2 = font.render(f"{p2['id']} 分數:{p2['score']} LV:{p2['level']}", True, (230,230,230))
-                screen.blit(text1, (100, 40))
-                screen.blit(text2, (400, 40))
-
-        pygame.display.flip()
+                # 🟩 棋盤只重畫變動的列，掉落中的方塊沒動就不重畫
+                for p, view, text in zip(players[:2], views, texts):
+                    view.update(p["board"])
+                    r = view.draw(screen, p.get("active"), force=full_redraw)
+                    if r:
+                        dirty.append(r)
+                    r = text.draw(screen, f"{p['id']} 分數:{p['score']} LV:{p['level']}", force=full_redraw)
+                    if r:
+                        dirty.append(r)
+
+        if dirty:
+            pygame.display.update(dirty)
+        full_redraw = False
         clock.tick(30)
 
     pygame.quit()
     print("👋 離開觀戰模式")
 
+# -------------------------------
+# 多場比賽的觀戰儀表板
+# -------------------------------
+# 左邊是所有比賽的縮圖（低頻、低細節），右邊放大目前選中的那一場（完整串流）。
+# Tab / ← → / 數字鍵 / 滑鼠點縮圖 切換焦點；切換時送 subscribe 改變串流細節。
+
+DASH_W, DASH_H = 1200, 680
+THUMB_CELL = 6
+TILE_W, TILE_H = 150, 150
+TILE_COLS = 4
+FOCUS_CELL = 20
+LOBBY_REFRESH_SEC = 5
+
+
+class MatchFeed:
+    """一場比賽的觀戰連線"""
+
+    def __init__(self, label, host, port):
+        self.label = label
+        self.host, self.port = host, port
+        self.writer = None
+        self.snapshot = None
+        self.over = False
+        self.detail = "thumb"
+
+    async def run(self):
+        try:
+            reader, self.writer, inflater = await open_watch(self.host, self.port, self.detail)
+            while True:
+                msg = await recv_msg(reader, inflater=inflater)
+                if msg["type"] == "snapshot":
+                    self.snapshot = expand_snapshot(msg)
+                elif msg["type"] == "game_over":
+                    break
+        except Exception:
+            pass
+        finally:
+            self.over = True
+
+    async def subscribe(self, detail):
+        if detail == self.detail:
+            return
+        self.detail = detail
+        if self.writer and not self.over:
+            try:
+                await send_msg(self.writer, {"type": "subscribe", "detail": detail})
+            except (ConnectionError, OSError):
+                pass
+
+
+async def poll_lobby(lobby_host, lobby_port, feeds, known_rooms):
+    """定期向 Lobby 拿「遊戲中」的房間，自動加入新的比賽"""
+    from client.client_net import LobbyClient
+    client = LobbyClient(hosts=[lobby_host], port=lobby_port)
+    if not await client.connect():
+        return
+    try:
+        while True:
+            resp = await client.list_rooms(only_available="play")
+            new_rooms = [r for r in resp.get("rooms", []) if r["id"] not in known_rooms]
+            # 新開的比賽一起問（request 同時在線上，不用一個等一個）
+            watches = await asyncio.gather(*(client.watch_room(r["id"]) for r in new_rooms))
+            for r, w in zip(new_rooms, watches):
+                if w.get("game_host") and w.get("game_port"):
+                    known_rooms.add(r["id"])
+                    feed = MatchFeed(r["name"], w["game_host"], w["game_port"])
+                    feeds.append(feed)
+                    asyncio.create_task(feed.run())
+            await asyncio.sleep(LOBBY_REFRESH_SEC)
+    finally:
+        await client.close()
+
+
+async def dashboard_main(targets, lobby=None):
+    feeds = [MatchFeed(f"{h}:{p}", h, p) for h, p in targets]
+    for f in feeds:
+        asyncio.create_task(f.run())
+    if lobby:
+        asyncio.create_task(poll_lobby(lobby[0], lobby[1], feeds, set()))
+
+    pygame.init()
+    screen = pygame.display.set_mode((DASH_W, DASH_H))
+    pygame.display.set_caption("Tetris - Watch Dashboard")
+    clock = pygame.time.Clock()
+
+    BG = (10, 10, 15)
+    font_small = get_font(None, 18)
+    font = get_font("Microsoft JhengHei", 24)
+    tiles = {}             # feed -> (兩塊縮圖棋盤, 標題)
+    focus = None           # 目前放大的 feed
+    focus_views = None
+    full_redraw = True
+    running = True
+
+    def tile_origin(i):
+        return 20 + (i % TILE_COLS) * TILE_W, 20 + (i // TILE_COLS) * TILE_H
+
+    async def set_focus(feed):
+        nonlocal focus, focus_views, full_redraw
+        if feed is focus:
+            return
+        if focus:
+            await focus.subscribe("thumb")
+        focus = feed
+        await feed.subscribe("full")
+        fx = 20 + TILE_COLS * TILE_W + 40
+        focus_views = (
+            BoardView(fx, 80, FOCUS_CELL, shapes=SHAPES),
+            BoardView(fx + 10 * FOCUS_CELL + 40, 80, FOCUS_CELL, shapes=SHAPES),
+            TextView((fx, 30), font, bg=BG),
+        )
+        full_redraw = True
+
+    while running:
+        await asyncio.sleep(0)
+
+        for e in pygame.event.get():
+            if e.type == pygame.QUIT:
+                running = False
+            elif e.type == pygame.VIDEOEXPOSE:
+                full_redraw = True
+            elif e.type == pygame.KEYDOWN and feeds:
+                idx = feeds.index(focus) if focus in feeds else -1
+                if e.key in (pygame.K_TAB, pygame.K_RIGHT):
+                    await set_focus(feeds[(idx + 1) % len(feeds)])
+                elif e.key == pygame.K_LEFT:
+                    await set_focus(feeds[(idx - 1) % len(feeds)])
+                elif pygame.K_1 <= e.key <= pygame.K_9 and e.key - pygame.K_1 < len(feeds):
+                    await set_focus(feeds[e.key - pygame.K_1])
+            elif e.type == pygame.MOUSEBUTTONDOWN:
+                for i, f in enumerate(feeds):
+                    if pygame.Rect(*tile_origin(i), TILE_W, TILE_H).collidepoint(e.pos):
+                        await set_focus(f)
+
+        if focus is None and feeds:
+            await set_focus(feeds[0])
+
+        dirty = []
+        if full_redraw:
+            screen.fill(BG)
+            dirty.append(screen.get_rect())
+
+        # --- 縮圖 ---
+        for i, f in enumerate(feeds):
+            ox, oy = tile_origin(i)
+            if f not in tiles:
+                tiles[f] = (
+                    BoardView(ox + 2, oy + 22, THUMB_CELL, border=(120, 120, 120)),
+                    BoardView(ox + 12 * THUMB_CELL, oy + 22, THUMB_CELL, border=(120, 120, 120)),
+                    TextView((ox, oy), font_small, bg=BG),
+                )
+            v1, v2, label = tiles[f]
+            title = f"{i+1}. {f.label}" + (" (結束)" if f.over else "") + (" ◀" if f is focus else "")
+            r = label.draw(screen, title, force=full_redraw)
+            if r:
+                dirty.append(r)
+            players = f.snapshot.get("players", []) if f.snapshot else []
+            for p, view in zip(players[:2], (v1, v2)):
+                view.update(p["board"])
+                r = view.draw(screen, force=full_redraw)
+                if r:
+                    dirty.append(r)
+
+        # --- 焦點比賽 ---
+        if focus and focus.snapshot and focus.snapshot.get("detail") != "thumb":
+            players = focus.snapshot.get("players", [])
+            b1, b2, text = focus_views
+            for p, view in zip(players[:2], (b1, b2)):
+                view.update(p["board"])
+                r = view.draw(screen, p.get("active"), force=full_redraw)
+                if r:
+                    dirty.append(r)
+            if len(players) >= 2:
+                p1, p2 = players[0], players[1]
+                r = text.draw(screen, f"{focus.label}  {p1['score']} : {p2['score']}", force=full_redraw)
+                if r:
+                    dirty.append(r)
+
+        if dirty:
+            pygame.display.update(dirty)
+        full_redraw = False
+        clock.tick(30)
+
+    pygame.quit()
+    print("👋 離開觀戰儀表板")
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
+    if len(sys.argv) >= 2 and sys.argv[1] == "--lobby":
+        # python -m game.game_watch --lobby <lobby_host> [lobby_port]
+        lobby_host = sys.argv[2] if len(sys.argv) > 2 else "127.0.0.1"
+        lobby_port = int(sys.argv[3]) if len(sys.argv) > 3 else 14110
+        runtime.run(dashboard_main([], lobby=(lobby_host, lobby_port)), report=False)
+    elif len(sys.argv) >= 2 and ":" in sys.argv[1]:
+        # python -m game.game_watch host:port host:port ...
+        targets = [(a.rsplit(":", 1)[0], int(a.rsplit(":", 1)[1])) for a in sys.argv[1:]]
+        runtime.run(dashboard_main(targets), report=False)
+    elif len(sys.argv) < 3:
         print("用法: python -m game.game_watch <host> <port>")
+        print("      python -m game.game_watch <host:port> [host:port ...]")
+        print("      python -m game.game_watch --lobby <lobby_host> [lobby_port]")
         sys.exit(1)
-    host = sys.argv[1]
-    port = int(sys.argv[2])
-    asyncio.run(watch_main(host, port))
+    else:
+        host = sys.argv[1]
+        port = int(sys.argv[2])
+        runtime.run(watch_main(host, port), report=False)
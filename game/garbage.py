@@ -0,0 +1,65 @@
+# game/garbage.py
+# 對戰模式的攻擊（垃圾行）：消行 → 先抵銷自己身上待收的 → 剩下的送給對手
+from collections import deque
+
+ATTACK_TABLE = {1: 0, 2: 1, 3: 2, 4: 4}     # 一次消幾行 → 送出幾行垃圾
+MAX_GARBAGE_PER_LOCK = 8                    # 每次鎖定最多升起幾行，其餘留在佇列
+HOLE_CHANGE_CHANCE = 0.3                    # 同一批垃圾中，下一行換洞的機率（0 = 整批同一個洞）
+GARBAGE_CELL = "G"
+
+# 每個洞的位置預先做好一列的內容，升起時直接複製進既有的 row list
+GARBAGE_ROWS = [tuple(0 if c == hole else GARBAGE_CELL for c in range(10)) for hole in range(10)]
+
+
+class GarbageQueue:
+    """一位玩家待收的垃圾行（pending meter）"""
+
+    def __init__(self, rng):
+        self.rng = rng               # 用 game seed 衍生的 RNG，洞的位置可重現
+        self.batches = deque()       # [行數, ...]，先進先出
+        self.total = 0
+        self.hole = rng.randrange(10)
+
+    def push(self, n: int):
+        if n > 0:
+            self.batches.append(n)
+            self.total += n
+
+    def cancel(self, attack: int) -> int:
+        """用自己的攻擊抵銷待收的垃圾，回傳抵銷後還剩多少攻擊"""
+        while attack and self.batches:
+            n = min(attack, self.batches[0])
+            attack -= n
+            self.total -= n
+            if n == self.batches[0]:
+                self.batches.popleft()
+            else:
+                self.batches[0] -= n
+        return attack
+
+    def apply(self, board) -> bool:
+        """把待收的垃圾從底部升起（最多 MAX_GARBAGE_PER_LOCK 行）；頂端有方塊被擠出去就回傳 False
+
+        不配置新的 row：最上面被擠掉的 row 物件改寫成垃圾行，再接到棋盤底部。
+        """
+        alive = True
+        budget = MAX_GARBAGE_PER_LOCK
+        while budget and self.batches:
+            n = min(budget, self.batches[0])
+            # 每一批換一個洞，批內依機率換洞
+            self.hole = self.rng.randrange(10)
+            for _ in range(n):
+                row = board.pop(0)
+                if any(row):
+                    alive = False
+                row[:] = GARBAGE_ROWS[self.hole]
+                board.append(row)
+                if self.rng.random() < HOLE_CHANGE_CHANCE:
+                    self.hole = self.rng.randrange(10)
+            budget -= n
+            self.total -= n
+            if n == self.batches[0]:
+                self.batches.popleft()
+            else:
+                self.batches[0] -= n
+        return alive
@@ -0,0 +1,139 @@
+import time
+
+from common.log import get_logger
+from common.metrics import metrics
+
+# -------------------------------
+# 玩家輸入檢查（防作弊 / 防洗封包）
+# -------------------------------
+# 每位玩家一個 InputValidator，handle_player 收到輸入時先過這一關才放進 input_q：
+#
+# - 事件種類不在白名單 → 丟掉
+# - token bucket 限速：額度由 MAX_PPS × MAX_EVENTS_PER_PIECE 算出，
+#   平常按鍵（含 key repeat）和 bot 整包送出的輸入都用不完，洗 SD / 平移的會被擋下
+# - HD / HOLD 各自另有一個 MAX_PPS 的 bucket：一顆方塊各只用得到一次，
+#   總額度再大也不能每秒硬降 100 次（放置速度被卡在 MAX_PPS）
+# - when_ms 必須大致遞增、且換算成伺服器時間後不能在未來 / 太久以前
+# - 被擋下的次數也有自己的 bucket，持續違規就判定為惡意，直接斷線
+#
+# 擋下的路徑只做幾次比較，不會進 apply_input；整批都沒 token 時連逐筆檢查都省掉。
+# 封包格式本身不對（型別錯、欄位缺）在 parse_inputs / parse_input 就擋下，呼叫端當 "malformed" 違規處理。
+
+log = get_logger("guard")
+
+VALID_EVENTS = frozenset({"L", "R", "SD", "HD", "CW", "CCW", "HOLD"})
+
+MAX_PPS = 10                 # 支援的最高放置速度（每秒方塊數；game.bot 的 --pps 上限，頂尖玩家約 4~5）
+MAX_EVENTS_PER_PIECE = 10    # 一顆方塊最多要幾個輸入：SD + 2 次旋轉 + 6 格平移 + HD（game.bot 一次整包送出）
+INPUT_RATE = MAX_PPS * MAX_EVENTS_PER_PIECE   # 每秒可補充的輸入數（最快的合法玩法剛好用完）
+INPUT_BURST = INPUT_RATE     # 一次最多可累積的輸入數
+PIECE_EVENTS = ("HD", "HOLD")     # 一顆方塊最多一次的事件：各自限速在 MAX_PPS
+PIECE_BURST = MAX_PPS        # 一次最多可累積幾顆（網路抖動讓好幾顆的輸入擠在同一包）
+REJECT_RATE = 5          # 每秒容忍的違規數
+REJECT_BURST = 50        # 違規累積超過這個就斷線
+TIME_SLACK_MS = 50       # when_ms 允許的倒退量（同一 frame 的事件、時鐘抖動）
+MAX_FUTURE_MS = 1000     # 換算後比伺服器時間超前多少就不合理
+MAX_PAST_MS = 10000      # 太舊的輸入（斷線很久才補送）直接丟掉
+
+
+def parse_inputs(m: dict, next_seq: int):
+    """inputs 封包 → (seq, [(ev, when_ms), ...])；格式不對丟 ValueError
+
+    seq 為第一個事件的序號，evs = [[ev, 相對 t0_ms 的 ms], ...]
+    """
+    try:
+        seq = int(m.get("seq", next_seq))
+        t0 = int(m.get("t0_ms", 0))
+        events = []
+        for ev, dt in m.get("evs") or []:
+            if not isinstance(ev, str) or not isinstance(dt, int):
+                raise ValueError("輸入事件格式錯誤")
+            events.append((ev, t0 + dt))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"inputs 格式錯誤: {e}")
+    return seq, events
+
+
+def parse_input(m: dict):
+    """單一 input 封包 → [(ev, when_ms)]；格式不對丟 ValueError"""
+    ev = m.get("ev")
+    if not isinstance(ev, str):
+        raise ValueError("輸入事件格式錯誤")
+    try:
+        return [(ev, int(m.get("when_ms", 0)))]
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"input 格式錯誤: {e}")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def take(self, n: float = 1) -> bool:
+        self.refill()
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+
+class InputValidator:
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.inputs = TokenBucket(INPUT_RATE, INPUT_BURST)
+        self.pieces = {ev: TokenBucket(MAX_PPS, PIECE_BURST) for ev in PIECE_EVENTS}
+        self.rejects = TokenBucket(REJECT_RATE, REJECT_BURST)
+        self.last_when_ms = None
+        self.clock_offset_ms = 0      # 客戶端時鐘 - 伺服器時鐘（有做時間同步時由外部更新）
+        self.abusive = False
+
+    def reject(self, reason: str, n: int = 1):
+        metrics.inc("inputs_rejected", n, reason=reason)
+        if not self.abusive and not self.rejects.take(n):
+            self.abusive = True
+            metrics.inc("players_kicked")
+            log.warning("🚫 輸入異常，踢除玩家", player=self.pid, reason=reason)
+
+    def filter(self, events, now_ms: int):
+        """events = [(ev, when_ms)]，回傳通過檢查的那些"""
+        if self.abusive:
+            return []
+        self.inputs.refill()
+        if self.inputs.tokens < 1:
+            # 整批都沒額度：一次記帳，不逐筆檢查
+            self.reject("rate", len(events))
+            return []
+
+        ok = []
+        for ev, when_ms in events:
+            if not isinstance(ev, str) or ev not in VALID_EVENTS:
+                self.reject("event")
+                continue
+            piece = self.pieces.get(ev)
+            if piece is not None and not piece.take():
+                self.reject("piece_rate")
+                continue
+            if not self.inputs.take():
+                self.reject("rate")
+                continue
+            if self.last_when_ms is not None and when_ms < self.last_when_ms - TIME_SLACK_MS:
+                self.reject("time_reversed")
+                continue
+            server_ms = when_ms - self.clock_offset_ms
+            if server_ms > now_ms + MAX_FUTURE_MS:
+                self.reject("time_future")
+                continue
+            if server_ms < now_ms - MAX_PAST_MS:
+                self.reject("time_stale")
+                continue
+            self.last_when_ms = max(when_ms, self.last_when_ms or when_ms)
+            ok.append((ev, when_ms))
+        return ok
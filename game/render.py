@@ -0,0 +1,142 @@
+import pygame
+
+# -------------------------------
+# 玩家端 / 觀戰端共用的繪圖快取
+# -------------------------------
+# - 字型：pygame.font.SysFont 很貴，同一組 (name, size) 只建立一次
+# - 方塊：每種顏色 × 格子大小只畫一次成 sprite，之後都用 blit
+# - 棋盤：背景格子預先畫成一張 Surface；每塊棋盤自己保留一張畫好的 Surface，
+#         新 snapshot 進來只重畫「有變動的列」
+# - draw() 回傳這一幀需要更新的 Rect，呼叫端用 pygame.display.update(rects)
+
+COLOR_TABLE = {
+    "I": (0, 200, 200),     # Cyan → 稍灰
+    "O": (230, 230, 90),    # Yellow → 柔和
+    "T": (150, 80, 190),    # Purple → 淡一點
+    "S": (80, 200, 80),     # Green → 不那麼亮
+    "Z": (200, 80, 80),     # Red → 減亮度
+    "J": (80, 100, 200),    # Blue → 柔藍
+    "L": (220, 150, 60),    # Orange → 暖但不刺眼
+    "G": (110, 110, 110)    # 垃圾行（對戰攻擊）
+}
+
+CHECKER = ((40, 40, 40), (45, 45, 45))   # 背景棋盤格（深灰 + 淺灰交錯）
+
+_fonts = {}
+_sprites = {}
+_grids = {}
+
+
+def get_font(name, size):
+    key = (name, size)
+    f = _fonts.get(key)
+    if f is None:
+        f = _fonts[key] = pygame.font.SysFont(name, size)
+    return f
+
+
+def cell_sprite(color, cell_size):
+    key = (color, cell_size)
+    s = _sprites.get(key)
+    if s is None:
+        s = _sprites[key] = pygame.Surface((cell_size - 1, cell_size - 1))
+        s.fill(color)
+    return s
+
+
+def grid_surface(cell_size, palette=CHECKER, rows=20, cols=10):
+    """空棋盤（只有背景格子），同樣大小共用一張"""
+    key = (cell_size, palette, rows, cols)
+    g = _grids.get(key)
+    if g is None:
+        g = _grids[key] = pygame.Surface((cols * cell_size, rows * cell_size))
+        g.fill((0, 0, 0))
+        for r in range(rows):
+            for c in range(cols):
+                g.blit(cell_sprite(palette[(r + c) % len(palette)], cell_size), (c * cell_size, r * cell_size))
+    return g
+
+
+class BoardView:
+    """一塊棋盤的繪圖狀態（位置、快取的 Surface、上一次畫的內容）"""
+
+    def __init__(self, ox, oy, cell_size, palette=CHECKER, border=(200, 200, 200), shapes=None):
+        self.ox, self.oy = ox, oy
+        self.cell = cell_size
+        self.palette = palette
+        self.border = border
+        self.shapes = shapes or {}
+        self.grid = grid_surface(cell_size, palette)
+        self.surface = self.grid.copy()
+        self.rows = [None] * 20       # 上一次畫到 surface 上的每一列
+        self.override = None          # 死亡時整塊用灰色
+        self.last_active = None
+        self.dirty = True
+
+    @property
+    def rect(self):
+        return pygame.Rect(self.ox - 2, self.oy - 2, 10 * self.cell + 4, 20 * self.cell + 4)
+
+    def update(self, board, color=None):
+        """套用新的棋盤內容，只重畫有變動的列"""
+        if color != self.override:
+            self.override = color
+            self.rows = [None] * 20
+        cs = self.cell
+        for r in range(20):
+            row = tuple(board[r])
+            if row == self.rows[r]:
+                continue
+            self.rows[r] = row
+            y = r * cs
+            self.surface.blit(self.grid, (0, y), pygame.Rect(0, y, 10 * cs, cs))
+            for c, v in enumerate(row):
+                if v:
+                    col = color or COLOR_TABLE.get(v, (200, 200, 200))
+                    self.surface.blit(cell_sprite(col, cs), (c * cs, y))
+            self.dirty = True
+
+    def draw(self, screen, active=None, force=False):
+        """需要時把棋盤 + 掉落中的方塊畫到畫面上，回傳更新範圍（沒變就回傳 None）"""
+        key = (active["kind"], active["x"], active["y"], active["rot"]) if active else None
+        if not (self.dirty or force or key != self.last_active):
+            return None
+        self.last_active = key
+        self.dirty = False
+
+        screen.blit(self.surface, (self.ox, self.oy))
+        if key:
+            kind, x, y, rot = key
+            shape = self.shapes.get(kind)
+            if shape:
+                cs = self.cell
+                sprite = cell_sprite(COLOR_TABLE.get(kind, (200, 200, 200)), cs)
+                for a, b in shape[rot % len(shape)]:
+                    if 0 <= y + b < 20:
+                        screen.blit(sprite, (self.ox + (x + a) * cs, self.oy + (y + b) * cs))
+        pygame.draw.rect(screen, self.border, self.rect, 2)
+        return self.rect
+
+
+class TextView:
+    """一行文字：內容沒變就不重畫"""
+
+    def __init__(self, pos, font, color=(230, 230, 230), bg=(22, 22, 24)):
+        self.pos = pos
+        self.font = font
+        self.color = color
+        self.bg = bg
+        self.text = None
+        self.rect = None
+
+    def draw(self, screen, text, force=False):
+        if text == self.text and not force:
+            return None
+        self.text = text
+        img = self.font.render(text, True, self.color)
+        new_rect = img.get_rect(topleft=self.pos)
+        dirty = new_rect.union(self.rect) if self.rect else new_rect
+        screen.fill(self.bg, dirty)
+        screen.blit(img, self.pos)
+        self.rect = new_rect
+        return dirty
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from common.network import send_msg, recv_msg
+from common.log import get_logger
+from common.metrics import metrics
+from common import runtime, session
+
+# -------------------------------
+# game server → Lobby 的控制連線
+# -------------------------------
+# - 開局時就連上（Game/hello，帶 session.control_auth 簽章），之後一直沿用；斷了下一次 request 再重連
+# - 同一條連線一問一答，Lobby 的回覆就是 ack
+# - 比賽結果先寫進 spool 目錄才送；收到 ack 才刪檔
+#   送不出去（Lobby 重啟中、DB 暫時連不上）就照指數退避重試，
+#   超過期限還是失敗就留在 spool，下一個啟動的 game server 會補送
+# - 每份結果帶 report_id，重送時 DB 端靠它去重
+
+log = get_logger("game")
+
+SPOOL_DIR = os.environ.get("NT_RESULT_SPOOL", "result_spool")
+ACK_TIMEOUT_SEC = 5
+RETRY_BASE_SEC = 0.5
+RETRY_MAX_SEC = 10
+DELIVER_DEADLINE_SEC = 30        # 結束前最多等多久；之後交給 spool
+
+
+class ResultChannel:
+    def __init__(self, host: str, port: int, hello: dict = None, secret: str = None):
+        self.host = host
+        self.port = port
+        self.hello = dict(hello or {})
+        self.hello["auth"] = session.control_auth(self.hello.get("room_id"), self.hello.get("port"), secret)
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()     # 一問一答，同一時間只能有一個 request 在線上
+
+    async def _connect(self) -> bool:
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                runtime.open_connection(self.host, self.port), timeout=ACK_TIMEOUT_SEC)
+            await send_msg(self.writer, {"collection": "Game", "action": "hello", "data": self.hello})
+            resp = await asyncio.wait_for(recv_msg(self.reader), timeout=ACK_TIMEOUT_SEC)
+            if not resp.get("ok"):
+                # 驗章失敗（secret 不一致）：當作連不上，結果留在 spool
+                log.warning("⚠️ Lobby 拒絕控制連線", error=resp.get("error"))
+                self._drop()
+                return False
+            metrics.inc("result_channel_connects")
+            return True
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            log.debug("🔌 Lobby 控制連線失敗", error=e)
+            self._drop()
+            return False
+
+    def _drop(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, payload: dict):
+        """送一個 request 並等回覆；連線有問題回傳 None"""
+        async with self.lock:
+            if self.writer is None and not await self._connect():
+                return None
+            try:
+                await send_msg(self.writer, payload)
+                return await asyncio.wait_for(recv_msg(self.reader), timeout=ACK_TIMEOUT_SEC)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                log.warning("⚠️ Lobby 控制連線中斷", error=e)
+                self._drop()
+                return None
+
+    async def report(self, payload: dict, deadline_sec: float = DELIVER_DEADLINE_SEC) -> bool:
+        """送比賽結果：先落地再送，收到 ack 才算完成"""
+        payload.setdefault("data", {})["report_id"] = uuid.uuid4().hex
+        # fsync 可能要幾十 ms：丟到 thread 做，同一個 worker 上的其他場次不會跟著卡住
+        path = await asyncio.to_thread(spool, payload)
+        return await self.deliver(path, deadline_sec)
+
+    async def deliver(self, path: str, deadline_sec: float) -> bool:
+        try:
+            payload = await asyncio.to_thread(_load, path)
+        except FileNotFoundError:
+            return True              # 別的 game server 已經送掉了
+        except ValueError as e:
+            # 壞掉的檔案改名成 .bad 留著查，不然每次補送都卡在它前面，後面的結果永遠送不出去
+            log.warning("⚠️ spool 檔損毀，改名略過", path=path, error=e)
+            metrics.inc("results_corrupt")
+            try:
+                os.replace(path, path + ".bad")
+            except OSError:
+                pass
+            return True
+
+        deadline = time.monotonic() + deadline_sec
+        delay = RETRY_BASE_SEC
+        while True:
+            resp = await self.request(payload)
+            if resp is not None and (resp.get("ok") or not resp.get("retry")):
+                if not resp.get("ok"):
+                    # Lobby / DB 明確拒絕，重送也沒用：改名成 .rejected 留著（查原因 / 手動補寫），不刪掉
+                    log.error("❌ 比賽結果被拒絕，留在 spool", path=path, report=payload["data"].get("report_id"),
+                              error=resp.get("error"))
+                    metrics.inc("results_rejected")
+                    try:
+                        os.replace(path, path + ".rejected")
+                    except OSError:
+                        pass
+                    return True
+                metrics.inc("results_delivered")
+                _unlink(path)
+                return True
+            metrics.inc("result_retries")
+            if time.monotonic() + delay > deadline:
+                log.warning("📦 比賽結果暫存在 spool，稍後補送", path=path)
+                metrics.inc("results_spooled")
+                return False
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+            delay = min(delay * 2, RETRY_MAX_SEC)
+
+    async def flush_spool(self, deadline_sec: float = DELIVER_DEADLINE_SEC):
+        """補送之前沒送成功的結果（其他 game server 留下的也一起）"""
+        if not os.path.isdir(SPOOL_DIR):
+            return
+        for name in sorted(os.listdir(SPOOL_DIR)):
+            if name.endswith(".json"):
+                log.info("📦 補送 spool 中的比賽結果", file=name)
+                if not await self.deliver(os.path.join(SPOOL_DIR, name), deadline_sec):
+                    break
+
+    async def close(self):
+        async with self.lock:
+            self._drop()
+
+
+def spool(payload: dict) -> str:
+    """寫進 spool 目錄（先寫暫存檔再 rename，不會留下寫到一半的檔案）"""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    name = f"{int(time.time() * 1000)}-{payload['data']['report_id']}.json"
+    path = os.path.join(SPOOL_DIR, name)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+def _load(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _unlink(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,181 @@
+import asyncio
+import socket
+import sys
+import time
+from collections import deque
+
+from common.network import send_msg, recv_msg, recv_frame, decode_frame, frame_type, encode_msg, MAX_LEN
+from common.log import get_logger
+from common.metrics import metrics, start_stats_server
+from common.outbox import Outbox
+from common.compress import negotiate
+from common import runtime
+from game.views import thumb_snapshot, THUMB_INTERVAL_MS
+
+# -------------------------------
+# 觀戰轉播節點
+# -------------------------------
+# 只用「一條」觀戰連線訂閱 game_server 的 snapshot，再轉發給大量 game_watch。
+# 觀戰人數再多也只在這個行程吃 CPU / 頻寬，不影響對戰那台的 tick。
+#
+#   python -m game.spectator_relay <game_host> <game_port> <listen_port> [delay_sec]
+#
+# - 中途加入：先送最新一張 snapshot（keyframe），之後接續即時串流
+# - delay_sec：轉播延遲（防止觀戰者幫玩家看牌），預設 0
+# - 收到的封包不重新編碼也不解析（只看開頭的 type），原始 bytes 直接分送
+# - 觀戰者可用 hello/subscribe 的 detail="thumb" 改收低頻縮圖（由轉播節點自己產生）
+
+log = get_logger("relay")
+
+MAX_CLIENTS = 5000
+
+
+def get_host_ip():
+    """自動偵測這台機器對外可連線的 IP"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(("8.8.8.8", 80))
+        ip = s.getsockname()[0]
+    except Exception:
+        ip = "127.0.0.1"
+    finally:
+        s.close()
+    return ip
+
+
+class Relay:
+    def __init__(self, delay_sec: float = 0.0):
+        self.delay_sec = delay_sec
+        self.clients = {}            # cid -> Outbox
+        self.detail = {}             # cid -> "full" | "thumb"
+        self.client_seq = 0
+        self.keyframe = None         # 最新已放行的 snapshot 封包
+        self.last_thumb = 0.0
+        self.pending = deque()       # (放行時間, type, frame)
+        self.has_pending = asyncio.Event()
+        self.finished = False
+
+    # ---- 上游：game_server ----
+    async def subscribe(self, host: str, port: int):
+        reader, writer = await runtime.open_connection(host, port)
+        await send_msg(writer, {"type": "hello", "name": "Relay", "role": "watch"})
+        log.info("📡 已訂閱 game server", host=host, port=port)
+        try:
+            while True:
+                frame = await recv_frame(reader)
+                t = frame_type(frame)     # 只解析開頭；snapshot 要做縮圖時才整包 decode
+                metrics.inc("relay_frames_in", type=t)
+                if t == "welcome":
+                    continue
+                self.pending.append((time.monotonic() + self.delay_sec, t, frame))
+                self.has_pending.set()
+                if t == "game_over":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            log.warning("⚠️ 上游中斷", error=e)
+        finally:
+            self.finished = True
+            self.has_pending.set()
+            writer.close()
+
+    async def release_loop(self):
+        """依延遲放行封包並分送給所有觀戰者"""
+        while True:
+            if not self.pending:
+                if self.finished:
+                    break
+                self.has_pending.clear()
+                await self.has_pending.wait()
+                continue
+            due, t, frame = self.pending[0]
+            wait = due - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            self.pending.popleft()
+            if t == "snapshot":
+                self.keyframe = frame
+                self.broadcast(frame, kind="snapshot", detail="full")
+                now = time.monotonic()
+                if now - self.last_thumb >= THUMB_INTERVAL_MS / 1000 and "thumb" in self.detail.values():
+                    self.last_thumb = now
+                    thumb = encode_msg(thumb_snapshot(decode_frame(frame)))
+                    self.broadcast(thumb, kind="snapshot", detail="thumb")
+            else:
+                self.broadcast(frame)
+            if t == "game_over":
+                break
+
+        await asyncio.gather(*(o.close() for o in list(self.clients.values())))
+
+    def broadcast(self, frame: bytes, kind=None, detail=None):
+        for cid, out in list(self.clients.items()):
+            if detail is None or self.detail.get(cid) == detail:
+                out.push(frame, kind=kind)
+        metrics.inc("relay_frames_out", len(self.clients))
+        metrics.set("relay_clients", len(self.clients))
+        metrics.set("send_queue_depth", max((len(o) for o in self.clients.values()), default=0))
+
+    def drop(self, cid):
+        self.clients.pop(cid, None)
+        self.detail.pop(cid, None)
+
+    # ---- 下游：game_watch ----
+    async def accept(self, reader, writer):
+        if len(self.clients) >= MAX_CLIENTS or (self.finished and not self.pending):
+            writer.close()
+            return
+
+        self.client_seq += 1
+        cid = f"R{self.client_seq}"
+        out = Outbox(writer, cid, on_evict=lambda o: self.drop(cid))
+        self.clients[cid] = out
+        self.detail[cid] = "full"
+        out.push(encode_msg({"type": "welcome", "id": cid}))
+        log.debug("👀 觀戰者加入", id=cid, total=len(self.clients))
+
+        try:
+            # 觀戰者只會送 hello / subscribe（切換 full / thumb）；讀到 EOF 就代表離開
+            first = True
+            while True:
+                m = await recv_msg(reader, MAX_LEN)
+                if m.get("type") in ("hello", "subscribe"):
+                    negotiate(out, m)
+                    detail = "thumb" if m.get("detail") == "thumb" else "full"
+                    self.detail[cid] = detail
+                    if first:
+                        # 中途加入：先補一張 keyframe
+                        key = self.keyframe
+                        if key and detail == "thumb":
+                            key = encode_msg(thumb_snapshot(decode_frame(key)))
+                        if key:
+                            out.push(key, kind="snapshot")
+                        first = False
+        except (asyncio.IncompleteReadError, ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            self.drop(cid)
+            if not out.closed:
+                await out.close()
+
+
+async def main(game_host, game_port, listen_port, delay_sec):
+    relay = Relay(delay_sec)
+    host = get_host_ip()
+    server = await runtime.start_server(relay.accept, host, listen_port)
+    log.info("🛰️ Spectator relay 啟動", host=host, port=listen_port, delay=delay_sec)
+    await start_stats_server(listen_port + 1000)
+
+    upstream = asyncio.create_task(relay.subscribe(game_host, game_port))
+    async with server:
+        await relay.release_loop()
+    await upstream
+    log.info("👋 轉播結束")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("用法: python -m game.spectator_relay <game_host> <game_port> <listen_port> [delay_sec]")
+        sys.exit(1)
+    delay = float(sys.argv[4]) if len(sys.argv) > 4 else 0.0
+    runtime.run(main(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), delay))
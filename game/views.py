@@ -0,0 +1,45 @@
+# game/views.py
+# snapshot 的各種「視角」：同一份遊戲狀態，依接收者需要的細節程度裁切
+# game_server、spectator_relay、game_watch 共用，不依賴 pygame
+
+THUMB_INTERVAL_MS = 500          # 縮圖串流的更新間隔
+
+
+def pack_board(board):
+    """20x10 的棋盤壓成 20 個長度 10 的字串，空格用 '.'"""
+    return ["".join(v or "." for v in row) for row in board]
+
+
+def unpack_board(rows):
+    return [[0 if ch == "." else ch for ch in row] for row in rows]
+
+
+def thumb_snapshot(snap: dict) -> dict:
+    """縮圖用的低細節 snapshot：只有棋盤、分數、存活，不含 active/next/hold"""
+    return {
+        "type": "snapshot",
+        "detail": "thumb",
+        "server_ms": snap.get("server_ms"),
+        "players": [
+            {
+                "id": p["id"],
+                "board": pack_board(p["board"]),
+                "score": p["score"],
+                "level": p["level"],
+                "alive": p["alive"],
+            }
+            for p in snap.get("players", [])
+        ],
+    }
+
+
+def expand_snapshot(snap: dict) -> dict:
+    """收到的 snapshot 還原成繪圖用的格式（縮圖、對手 delta 的棋盤是壓縮過的字串）"""
+    thumb = snap.get("detail") == "thumb"
+    for p in snap.get("players", []):
+        board = p.get("board")
+        if board and isinstance(board[0], str):
+            p["board"] = unpack_board(board)
+        if thumb:
+            p.setdefault("active", None)
+    return snap
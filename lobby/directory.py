@@ -0,0 +1,266 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import sys
+import time
+
+from common.network import send_msg, recv_msg
+from common.log import get_logger
+from common.metrics import metrics, start_stats_server
+from common import runtime
+
+if sys.platform.startswith("win"):
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+logging.getLogger("asyncio").setLevel(logging.CRITICAL)
+
+# -------------------------------
+# Lobby 分片用的目錄服務
+# -------------------------------
+# 同一台機器上開多個 lobby_server（每個一個核心），共用這個小 process 裡的狀態：
+#
+#   shards     各分片的位址與最後心跳時間（超過 SHARD_TTL_SEC 沒心跳就移除）
+#   rooms      所有房間的摘要（房間列表用；房間本體只在擁有它的分片上）
+#   presence   誰在線上、連在哪個分片
+#   invites    邀請（邀請者與被邀請者可能在不同分片）
+#
+# 房間歸屬用 consistent hashing（HashRing）決定：分片增減時只有少數房間換主人。
+# 協定跟其他 server 一樣是 Length-prefixed JSON：{"collection": "Dir", "action": ..., "data": {...}}
+
+log = get_logger("directory")
+
+DIRECTORY_HOST = "127.0.0.1"
+DIRECTORY_PORT = 14130
+STATS_PORT = 14131
+SHARD_TTL_SEC = 15
+VNODES = 64                  # 每個分片在 ring 上的虛擬節點數
+MAX_PORT_BLOCKS = 10         # 分片的 port 區段數（區段 k 的範圍見 lobby_server 的 SHARD_PORT_BASE）
+CLAIM_GRACE_SEC = 8          # 剛啟動時先等各分片心跳報回已經在用的區段（> lobby 的 SHARD_HEARTBEAT_SEC），再發新的
+
+
+class HashRing:
+    """consistent hashing：key → 分片 id"""
+
+    def __init__(self, shard_ids=(), vnodes: int = VNODES):
+        self.shard_ids = tuple(sorted(shard_ids))
+        ring = sorted((self._hash(f"{sid}#{v}"), sid) for sid in self.shard_ids for v in range(vnodes))
+        self.points = [h for h, _ in ring]       # 排序好的 hash 值
+        self.owners = [sid for _, sid in ring]   # 與 points 對應的分片 id
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        i = bisect.bisect(self.points, self._hash(str(key))) % len(self.points)
+        return self.owners[i]
+
+
+# -------------------------------
+# 目錄狀態
+# -------------------------------
+shards = {}          # shard_id -> {"host", "port", "seen"}
+rooms = {}           # room_id -> 房間摘要（含 "shard"）
+presence = {}        # user_id -> {"name", "shard"}
+invites = {}         # invitee_id -> [invite, ...]
+orphaned = []        # 失聯分片上原本在線的玩家：交給下一個來心跳的分片，到 DB 把他們登出
+room_seq = 0        # 目錄服務重啟後由分片心跳帶的 max_room_id / put_room 接續，不會跟還在的房間撞號
+invite_seq = int(time.time() * 1000)   # 邀請只存在這裡：用啟動時間起算，重啟後也不會重複用到舊的 id
+started = time.monotonic()
+# 各分片共用的 session secret：A 分片發的 token，被 redirect 到 B 分片時也要驗得過
+cluster_secret = os.environ.get("NT_SESSION_SECRET") or os.urandom(32).hex()
+
+
+def live_shards() -> dict:
+    now = time.monotonic()
+    for sid in [sid for sid, s in shards.items() if now - s["seen"] > SHARD_TTL_SEC]:
+        log.warning("💀 分片失聯，移除", shard=sid)
+        shards.pop(sid)
+        # 失聯分片上的房間與線上玩家都已經不存在
+        for rid in [rid for rid, r in rooms.items() if r["shard"] == sid]:
+            rooms.pop(rid)
+        for uid in [uid for uid, p in presence.items() if p["shard"] == sid]:
+            presence.pop(uid)
+            orphaned.append(uid)
+    return {sid: {"host": s["host"], "port": s["port"]} for sid, s in shards.items()}
+
+
+def alloc_port_block():
+    """新分片的 port 區段：存活分片沒在用的最小編號（目錄服務剛重啟的前幾秒先不發，免得發出別人正在用的）"""
+    if time.monotonic() - started < CLAIM_GRACE_SEC:
+        return None
+    used = {s["port_block"] for s in shards.values()}
+    block = next((b for b in range(MAX_PORT_BLOCKS) if b not in used), None)
+    if block is None:
+        log.warning("⚠️ port 區段已經發完", shards=len(shards), max_blocks=MAX_PORT_BLOCKS)
+    return block
+
+
+def handle_request(req: dict) -> dict:
+    global room_seq, invite_seq
+    action = req.get("action")
+    data = req.get("data", {})
+
+    # ---------- 分片 ----------
+    if action == "heartbeat":
+        sid = data["shard"]
+        known = sid in shards
+        room_seq = max(room_seq, data.get("max_room_id", -1) + 1)
+        # 每個分片一段自己的 port（開 game server / relay 用），同一台機器上的分片不會撞 port；
+        # 分片拿到之後每次心跳都帶著，目錄服務重啟也能還原
+        block = data.get("port_block")
+        if block is None:
+            block = shards.get(sid, {}).get("port_block")
+        elif any(s["port_block"] == block for other, s in shards.items() if other != sid):
+            log.warning("⚠️ port 區段重複", shard=sid, port_block=block)
+        shards[sid] = {"host": data["host"], "port": data["port"], "seen": time.monotonic(), "port_block": block}
+        live = live_shards()
+        if block is None:
+            block = shards[sid]["port_block"] = alloc_port_block()
+        # 之後又在別的分片重連（session resume）的玩家不用登出
+        logout = [uid for uid in orphaned if uid not in presence]
+        orphaned.clear()
+        return {"ok": True, "shards": live, "session_secret": cluster_secret, "logout": logout, "port_block": block,
+                "known": known}
+
+    elif action == "shards":
+        return {"ok": True, "shards": live_shards()}
+
+    # ---------- 房間 ----------
+    elif action == "alloc_room":
+        # 房號全域唯一，各分片不會撞號；剛重啟時先等分片心跳報回目前最大的房號
+        if time.monotonic() - started < CLAIM_GRACE_SEC:
+            return {"ok": False, "error": "目錄服務剛啟動，請稍後再試"}
+        rid = room_seq
+        room_seq += 1
+        return {"ok": True, "room_id": rid}
+
+    elif action == "put_room":
+        rooms[data["room"]["id"]] = data["room"]
+        room_seq = max(room_seq, data["room"]["id"] + 1)
+        return {"ok": True}
+
+    elif action == "del_room":
+        rooms.pop(data["room_id"], None)
+        return {"ok": True}
+
+    elif action == "get_room":
+        room = rooms.get(data["room_id"])
+        return {"ok": room is not None, "room": room}
+
+    elif action == "list_rooms":
+        status = data.get("status", "space")
+        return {"ok": True, "rooms": [r for r in rooms.values() if r["status"] == status]}
+
+    # ---------- 線上玩家 ----------
+    elif action == "presence_put":
+        presence[data["user_id"]] = {"name": data["name"], "shard": data["shard"]}
+        return {"ok": True}
+
+    elif action == "presence_del":
+        # 只有玩家目前所在的分片能移除（玩家可能已經換到別的分片）
+        p = presence.get(data["user_id"])
+        if p and p["shard"] == data["shard"]:
+            presence.pop(data["user_id"])
+        return {"ok": True}
+
+    elif action == "presence_list":
+        # 某個分片上的線上玩家（分片重啟時用：這些人的連線已經不在了）
+        return {"ok": True, "user_ids": [uid for uid, p in presence.items() if p["shard"] == data["shard"]]}
+
+    elif action == "presence_get":
+        p = presence.get(data["user_id"])
+        return {"ok": True, "online": p is not None, **(p or {})}
+
+    # ---------- 邀請 ----------
+    elif action == "invite_put":
+        inv = {**data["invite"], "invite_id": invite_seq}
+        invite_seq += 1
+        invites.setdefault(inv["invitee_id"], []).append(inv)
+        return {"ok": True, "invite_id": inv["invite_id"]}
+
+    elif action == "invite_list":
+        return {"ok": True, "invites": invites.get(data["user_id"], [])}
+
+    elif action == "invite_get":
+        inv = next((i for i in invites.get(data["user_id"], []) if i["invite_id"] == data["invite_id"]), None)
+        return {"ok": inv is not None, "invite": inv}
+
+    elif action == "invite_del":
+        user_invites = invites.get(data["user_id"], [])
+        user_invites[:] = [i for i in user_invites if i["invite_id"] != data["invite_id"]]
+        if not user_invites:
+            invites.pop(data["user_id"], None)
+        return {"ok": True}
+
+    return {"ok": False, "error": f"未知 action: {action}"}
+
+
+async def handle_client(reader, writer):
+    addr = writer.get_extra_info("peername")
+    log.info("📡 分片連線", addr=addr)
+    try:
+        while True:
+            req = await recv_msg(reader)
+            if req is None:
+                break
+            try:
+                resp = handle_request(req)
+            except KeyError as e:
+                resp = {"ok": False, "error": f"Missing field: {e}"}
+            metrics.inc("directory_requests", action=req.get("action"))
+            await send_msg(writer, resp)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        log.info("❌ 分片中斷連線", addr=addr)
+    finally:
+        writer.close()
+
+
+# -------------------------------
+# 給 lobby_server 用的連線
+# -------------------------------
+class DirectoryClient:
+    """一條常駐連線、一問一答（目錄的操作都是記憶體內的 dict，很快）"""
+
+    def __init__(self, host: str = DIRECTORY_HOST, port: int = DIRECTORY_PORT):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+
+    async def request(self, action: str, **data) -> dict:
+        async with self.lock:
+            # 舊連線可能已經斷了（目錄服務重啟過）：request 還沒被處理，換一條新連線再送一次
+            for attempt in range(2):
+                reused = self.writer is not None
+                try:
+                    if self.writer is None:
+                        self.reader, self.writer = await runtime.open_connection(self.host, self.port)
+                    await send_msg(self.writer, {"collection": "Dir", "action": action, "data": data})
+                    return await recv_msg(self.reader)
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    if self.writer is not None:
+                        self.writer.close()
+                    self.reader = self.writer = None
+                    if reused and attempt == 0:
+                        continue
+                    metrics.inc("directory_errors")
+                    log.warning("⚠️ 目錄服務通訊錯誤", action=action, error=e)
+                    return {"ok": False, "error": str(e)}
+
+
+async def main(port: int):
+    server = await runtime.start_server(handle_client, DIRECTORY_HOST, port)
+    log.info("✅ Lobby 目錄服務啟動", host=DIRECTORY_HOST, port=port)
+    if await start_stats_server(STATS_PORT):
+        log.info("📊 stats endpoint", port=STATS_PORT)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    runtime.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else DIRECTORY_PORT))
@@ -1,6 +1,15 @@
 import asyncio
 import logging
-from common.network import send_msg, recv_msg
+from collections import deque
+from common.network import send_msg, recv_msg, MAX_LEN
+from common.log import get_logger
+from common.metrics import metrics, request_labels, start_stats_server
+from common.clock import now_ms
+from common import session
+from common import runtime
+from lobby.directory import DirectoryClient, HashRing
+from common.host_client import HostClient
+import os
 import socket
 import subprocess
 import time
@@ -33,8 +42,31 @@ def get_host_ip():
 
 LOBBY_HOST = get_host_ip()     # Lobby Server 對外開放 IP
 LOBBY_PORT = 14110           # Lobby Server 監聽埠
+SHARD_ID = None              # 分片模式：python -m lobby.lobby_server <port> <shard_id>（需先啟動 lobby.directory）
+if len(sys.argv) > 1:
+    LOBBY_PORT = int(sys.argv[1])
+if len(sys.argv) > 2:
+    SHARD_ID = sys.argv[2]
+SHARD_HEARTBEAT_SEC = 5      # 分片向目錄服務回報存活、更新 hash ring 的間隔
+HANDOFF_GRACE_SEC = 2        # 分片模式下玩家斷線後，等多久確認不是換到別的分片才登出
+USE_SPECTATOR_RELAY = True   # 觀戰者改連 spectator_relay，不直接連對戰中的 game server
+RELAY_DELAY_SEC = 0          # 轉播延遲（秒）
+STATS_PORT = LOBBY_PORT + 1  # 本機 stats endpoint（python -m common.metrics 14111）
+GAME_PORTS = (16800, 16900)  # game server 可用的 port 範圍
+RELAY_PORTS = (16900, 17000) # spectator relay 可用的 port 範圍
+SHARD_PORT_BASE = 20000      # 分片模式改用目錄服務分配的區段 k：game 用 20000+100k 起的 50 個 port、relay 用接著的 50 個
+SHARD_PORT_SPAN = 100        # （game server 的 stats 開在 port+1000，10 個區段都不會撞到）
+GAME_HOST = os.environ.get("NT_GAME_HOST")   # "127.0.0.1:14120"：對戰交給 game.game_host 的 worker 跑（沒設定就一場一個 process）
+REAP_INTERVAL_SEC = 2        # 多久檢查一次子程序是否已結束
+DB_TIMEOUT_SEC = 10          # 等 DB 回覆的上限
+MAX_INFLIGHT_REQUESTS = 32   # 非同步客戶端（request 帶 rid）每條連線最多同時處理幾個 request
 db_reader = None
 db_writer = None
+db_pending = {}              # rid -> Future：已送出、還在等 DB 回覆的 request
+db_rid = 0
+db_connect_lock = asyncio.Lock()
+
+log = get_logger("lobby")
 
 # -------------------------------
 # 記憶體內資料結構
@@ -52,15 +84,24 @@ online_users = {}
 #     room_id: {
 #         "name": str,              # 房間名稱
 #         "host_id": int,           # 房主使用者 ID
-#         "guest_id": int | None,   # 客人 ID（無人時為 None）
+#         "guest_ids": [int],       # 已加入的其他玩家（依加入順序）
+#         "max_players": int,       # 含房主的人數上限（2 = 1v1，最多 16）
 #         "visibility": "public" | "private",  # 房間類型
 #         "password": str | None,         # 若為 private，存雜湊密碼
 #         "status": "space" | "full" | "play", # 房間狀態
-#         "port": int | None                   # 遊戲伺服器埠號
+#         "port": int | None,                  # 遊戲伺服器埠號
+#         "relay_port": int | None             # 觀戰轉播節點埠號（第一次有人觀戰時才啟動）
 #     }
 # }
 rooms = {}
 room_counter = 0  
+MAX_ROOM_PLAYERS = 16
+
+
+def refresh_room_status(room):
+    """依人數更新 space / full（遊戲中的房間不動）"""
+    if room["status"] != "play":
+        room["status"] = "full" if 1 + len(room["guest_ids"]) >= room["max_players"] else "space"
 
 # invites = {
 #     invitee_id: [
@@ -74,34 +115,349 @@ room_counter = 0
 # }
 invites = {}
 invite_counter = 0
+
+# 非同步客戶端的連線（request 帶 rid，見 client.client_net.LobbyClient）：
+# 同一條連線上的 request 並行處理，回覆帶回同一個 rid（順序不一定跟送出順序相同），
+# Lobby 也會主動推送事件 {"event": "Room/status" | "Invite/received", "data": {...}}（不帶 rid）。
+# 舊客戶端（不帶 rid）照舊一問一答、依序處理，也不會收到推送。
+# mux_conns = { writer: asyncio.Lock }   # 回覆和事件輪流寫，大訊息的分塊不會交錯
+mux_conns = {}
+# game_conns = { writer: (room_id, port) }   # Game/hello 驗章過的 game server 控制連線
+game_conns = {}
+GAME_CONTROL = {"report", "ended"}          # 只接受從 game_conns 送來的 Game/*
     
-def find_free_port(start=16800, end=16900):
-    import socket
-    for port in range(start, end):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            try:
-                s.bind((LOBBY_HOST, port))
-                s.listen(1)  # 確保真的能 listen
+def port_bindable(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        try:
+            s.bind((LOBBY_HOST, port))
+            s.listen(1)  # 確保真的能 listen
+            return True
+        except OSError:
+            return False
+
+
+class PortPool:
+    """固定範圍的 port：借出給子程序，子程序結束後歸還
+
+    歸還的 port 排到最後，下一次先用最久沒用過的（剛關掉的 port 可能還在 TIME_WAIT）。
+    """
+
+    def __init__(self, start: int, end: int):
+        self.free = deque(range(start, end))
+        self.used = set()
+
+    def acquire(self) -> int:
+        for _ in range(len(self.free)):
+            port = self.free.popleft()
+            if port_bindable(port):
+                self.used.add(port)
                 return port
-            except OSError:
-                continue
-    raise RuntimeError("❌ 沒有可用的 port")
+            self.free.append(port)     # 被別的程式佔用，排回最後
+        raise RuntimeError("❌ 沒有可用的 port")
+
+    def release(self, port: int):
+        if port in self.used:
+            self.used.remove(port)
+            self.free.append(port)
+
+
+game_ports = PortPool(*GAME_PORTS)
+relay_ports = PortPool(*RELAY_PORTS)
+game_host = HostClient(*GAME_HOST.rsplit(":", 1)) if GAME_HOST else None
+
+# children = {
+#     pid: {
+#         "proc": subprocess.Popen,
+#         "kind": "game" | "relay",
+#         "room_id": int,
+#         "port": int,
+#         "pool": PortPool          # 結束後 port 還給誰
+#     }
+# }
+children = {}
+
+
+def spawn_child(kind: str, args: list, room_id, port: int, pool: PortPool):
+    proc = subprocess.Popen(["python", "-m", *args])
+    children[proc.pid] = {"proc": proc, "kind": kind, "room_id": room_id, "port": port, "pool": pool}
+    metrics.set("lobby_children", len(children))
+    return proc
+
+
+def end_room_game(rid):
+    """對戰結束（或 game server 掛掉）：房間回到可以再開一局的狀態"""
+    room = rooms[rid]
+    room["status"] = "space"
+    room["port"] = None
+    room["relay_port"] = None
+    refresh_room_status(room)
+    room_changed(rid)
+
+
+def reap_children():
+    """收掉已結束的子程序（不留 zombie）、歸還 port；沒通知就結束的 game server 也把房間重設"""
+    for pid, child in list(children.items()):
+        code = child["proc"].poll()
+        if code is None:
+            continue
+        children.pop(pid)
+        child["pool"].release(child["port"])
+        metrics.inc("lobby_children_reaped", kind=child["kind"], code=code)
+        log.info("🧹 子程序已結束", kind=child["kind"], room=child["room_id"], port=child["port"], code=code)
+
+        room = rooms.get(child["room_id"])
+        if child["kind"] == "game" and room and room["status"] == "play" and room.get("port") == child["port"]:
+            log.warning("⚠️ Game Server 沒有回報就結束，重設房間", room=child["room_id"], code=code)
+            end_room_game(child["room_id"])
+    metrics.set("lobby_children", len(children))
+
+
+async def reap_loop():
+    while True:
+        await asyncio.sleep(REAP_INTERVAL_SEC)
+        reap_children()
+
+
+# -------------------------------
+# 分片模式（多個 lobby process 共用 lobby.directory）
+# -------------------------------
+# 房間只存在擁有它的分片上；別的分片收到這個房間的 request 就回 redirect，
+# LobbyClient 用 session 重連到該分片再送一次。線上名單、邀請、房間列表放在目錄服務。
+directory = DirectoryClient() if SHARD_ID else None
+ring = HashRing()
+shard_addrs = {}             # shard_id -> {"host", "port"}
+port_block = None            # 目錄服務分配給這個分片的 port 區段
+
+# 帶 room_id、要在房間所在分片處理的 request
+ROOM_ROUTED = {("Room", "close"), ("Room", "join"), ("Room", "status"), ("Room", "kick"),
+               ("Room", "leave"), ("Room", "watch"), ("Invite", "create"), ("Game", "start")}
+
+# handle_request 認得的 request + 自己送給 DB 的（metrics 只用這些當 label，其他記成 unknown）
+KNOWN_REQUESTS = frozenset(ROOM_ROUTED | {("Lobby", "init"),
+    ("User", "resume"), ("User", "create"), ("User", "login"), ("User", "logout"),
+    ("User", "mark_online"), ("User", "list_online"), ("Room", "create"), ("Room", "list"),
+    ("Invite", "list"), ("Invite", "respond"), ("Game", "report"), ("Game", "hello"), ("Game", "ended"),
+    ("Sys", "ping")})
+
+
+def use_port_block(block: int):
+    """分片模式：game server / relay 改從這個分片自己的區段拿 port（同一台機器的分片不會撞 port）"""
+    global port_block, game_ports, relay_ports
+    port_block = block
+    base = SHARD_PORT_BASE + block * SHARD_PORT_SPAN
+    game_ports = PortPool(base, base + SHARD_PORT_SPAN // 2)
+    relay_ports = PortPool(base + SHARD_PORT_SPAN // 2, base + SHARD_PORT_SPAN)
+    log.info("🔌 分片 port 區段", shard=SHARD_ID, port_block=block, ports=f"{base}-{base + SHARD_PORT_SPAN - 1}")
+
+
+async def shard_heartbeat():
+    global ring, shard_addrs
+    resp = await directory.request("heartbeat", shard=SHARD_ID, host=LOBBY_HOST, port=LOBBY_PORT, port_block=port_block,
+                                   max_room_id=max(rooms, default=-1))
+    if resp.get("ok"):
+        if not resp.get("known", True) and (rooms or online_users):
+            await resync_directory()
+        if port_block is None and resp.get("port_block") is not None:
+            use_port_block(resp["port_block"])
+        if session.EPHEMERAL_SECRET and resp.get("session_secret"):
+            session.set_secret(resp["session_secret"])
+        shard_addrs = resp["shards"]
+        # 失聯分片上的玩家（目錄服務交給第一個來心跳的分片）：DB 也登出，不然再也登入不了
+        for uid in resp.get("logout", []):
+            log.info("🧹 登出失聯分片上的玩家", id=uid)
+            asyncio.create_task(db_request({"collection": "User", "action": "logout", "data": {"id": uid}}))
+        if set(shard_addrs) != set(ring.shard_ids):
+            ring = HashRing(shard_addrs)
+            log.info("🔄 分片 ring 更新", shards=sorted(shard_addrs))
+        metrics.set("lobby_shards", len(shard_addrs))
+
+
+async def resync_directory():
+    """目錄服務不認得這個分片（目錄剛重啟、或這個分片被判定失聯過）：房間和線上玩家重新登記一次"""
+    log.info("🔄 重新登記到目錄服務", shard=SHARD_ID, rooms=len(rooms), users=len(online_users))
+    for rid, room in list(rooms.items()):
+        await directory.request("put_room", room={**room_summary(rid, room), "shard": SHARD_ID})
+    for uid, info in list(online_users.items()):
+        await directory.request("presence_put", user_id=uid, name=info["name"], shard=SHARD_ID)
+
+
+async def shard_loop():
+    while True:
+        await asyncio.sleep(SHARD_HEARTBEAT_SEC)
+        await shard_heartbeat()
+
+
+def redirect_to(shard_id, **data):
+    metrics.inc("lobby_redirects")
+    return {"ok": False, "error": "redirect", "redirect": {"shard": shard_id, **shard_addrs[shard_id], "data": data}}
+
+
+async def route_room(rid):
+    """房間在別的分片 → 回傳 redirect；在這裡（或沒開分片）回傳 None"""
+    if directory is None or rid in rooms:
+        return None
+    resp = await directory.request("get_room", room_id=rid)
+    owner = (resp.get("room") or {}).get("shard") or ring.owner(rid)
+    if owner is None or owner == SHARD_ID or owner not in shard_addrs:
+        return None
+    return redirect_to(owner)
+
+
+def room_summary(rid, room):
+    """房間列表用的摘要（分片模式下也是放進目錄服務的內容）"""
+    return {
+        "id": rid,
+        "name": room["name"],
+        "host": online_users.get(room["host_id"], {}).get("name", "未知玩家"),
+        "visibility": room["visibility"],
+        "status": room["status"],
+        "players": 1 + len(room["guest_ids"]),
+        "max_players": room["max_players"],
+    }
+
+
+def room_status(rid, room, uid=None):
+    """Room/status 的內容（推送的 Room/status 事件也是這份）；uid = 要看的人，決定 in_room"""
+    guest_ids = room["guest_ids"]
+    guest_names = [online_users.get(g, {}).get("name", "未知玩家") for g in guest_ids]
+    return {
+        "ok": True,
+        "room_id": rid,
+        "status": room["status"],
+        "guest_joined": bool(guest_ids),
+        "guest_id": guest_ids[0] if guest_ids else None,        # 舊版客戶端（1v1）用
+        "guest_name": ", ".join(guest_names) if guest_names else None,
+        "guest_ids": guest_ids,
+        "guest_names": guest_names,
+        "players": 1 + len(guest_ids),
+        "max_players": room["max_players"],
+        "in_room": uid is None or uid == room["host_id"] or uid in guest_ids,
+        "game_host": get_host_ip(),
+        "game_port": room.get("port")
+    }
+
+
+async def send_locked(writer, lock, msg: dict):
+    """非同步客戶端的連線：拿到 lock 才寫；連線斷了就算了（handle_client 會清理）"""
+    try:
+        async with lock:
+            await send_msg(writer, msg)
+    except (ConnectionError, OSError):
+        pass
+
+
+def push(uid, event: str, data: dict):
+    """推送事件給線上玩家（只送給非同步客戶端，不等送完）"""
+    writer = online_users.get(uid, {}).get("writer")
+    lock = mux_conns.get(writer)
+    if lock is None:
+        return
+    metrics.inc("lobby_events", event=event)
+    asyncio.create_task(send_locked(writer, lock, {"event": event, "data": data}))
+
+
+def room_changed(rid, removed=()):
+    """房間有變動：推 Room/status 給房裡的人（removed = 剛被移出房間的人），分片模式下同步到目錄服務（不等回覆）"""
+    room = rooms.get(rid)
+    members = [room["host_id"], *room["guest_ids"]] if room else []
+    for uid in (*members, *removed):
+        push(uid, "Room/status", room_status(rid, room, uid) if room else
+             {"ok": False, "room_id": rid, "error": "Room not found."})
+    if directory is None:
+        return
+    if room is None:
+        asyncio.create_task(directory.request("del_room", room_id=rid))
+    else:
+        asyncio.create_task(directory.request("put_room", room={**room_summary(rid, room), "shard": SHARD_ID}))
+
+
+def presence_changed(uid, name=None):
+    if directory is None:
+        return
+    if name is None:
+        asyncio.create_task(directory.request("presence_del", user_id=uid, shard=SHARD_ID))
+    else:
+        asyncio.create_task(directory.request("presence_put", user_id=uid, name=name, shard=SHARD_ID))
 
 
+async def release_user(uid):
+    """分片模式下玩家斷線：等 HANDOFF_GRACE_SEC，沒有在這裡或別的分片重連才真的登出"""
+    await asyncio.sleep(HANDOFF_GRACE_SEC)
+    if uid in online_users:
+        return
+    p = await directory.request("presence_get", user_id=uid)
+    if p.get("online") and p.get("shard") != SHARD_ID:
+        log.debug("➡️ 玩家已換到其他分片", id=uid, shard=p.get("shard"))
+        return
+    await directory.request("presence_del", user_id=uid, shard=SHARD_ID)
+    await db_request({"collection": "User", "action": "logout", "data": {"id": uid}})
+
+
+async def is_online(uid) -> bool:
+    if uid in online_users:
+        return True
+    if directory is None:
+        return False
+    return (await directory.request("presence_get", user_id=uid)).get("online", False)
+
 
 # -------------------------------
 # 與 DB Server 溝通
 # -------------------------------
-async def db_request(req: dict):
-    """透過既有的持續 TCP 連線與 DB Server 溝通"""
+async def db_connect():
+    global db_reader, db_writer
+    db_reader, db_writer = await runtime.open_connection(DB_HOST, DB_PORT)
+    asyncio.create_task(db_reader_loop(db_reader, db_writer))
+
+
+async def db_reader_loop(reader, writer):
+    """DB 的回覆依 rid 交給等待中的 request（登入要跑 KDF，回覆順序不一定跟送出順序相同）"""
     global db_reader, db_writer
     try:
-        await send_msg(db_writer, req)
-        resp = await recv_msg(db_reader)
+        while True:
+            resp = await recv_msg(reader)
+            fut = db_pending.pop(resp.pop("rid", None), None)
+            if fut is not None and not fut.done():
+                fut.set_result(resp)
+    except Exception as e:
+        log.warning("⚠️ DB Server 連線中斷", error=e)
+    finally:
+        if db_writer is writer:
+            db_reader = db_writer = None
+        writer.close()
+        for fut in db_pending.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError("DB Server 連線中斷"))
+        db_pending.clear()
+
+
+async def db_request(req: dict):
+    """透過既有的持續 TCP 連線與 DB Server 溝通
+
+    多個 request 可以同時在線上（帶 rid），連線斷了會在下一次 request 重連。
+    """
+    global db_rid
+    t = time.perf_counter()
+    db_rid += 1
+    rid = db_rid
+    try:
+        async with db_connect_lock:
+            if db_writer is None:
+                await db_connect()
+                log.info("✅ 已重新連線至 DB Server", host=DB_HOST, port=DB_PORT)
+        fut = asyncio.get_running_loop().create_future()
+        db_pending[rid] = fut
+        await send_msg(db_writer, {**req, "rid": rid})
+        resp = await asyncio.wait_for(fut, timeout=DB_TIMEOUT_SEC)
+        metrics.observe("lobby_db_ms", (time.perf_counter() - t) * 1000,
+                        **request_labels(req.get("collection"), req.get("action"), KNOWN_REQUESTS))
         return resp
     except Exception as e:
-        print(f"⚠️ DB Server 通訊錯誤: {e}")
-        return {"ok": False, "error": str(e)}
+        db_pending.pop(rid, None)
+        metrics.inc("lobby_db_errors")
+        log.warning("⚠️ DB Server 通訊錯誤", error=e)
+        # retry：不確定 DB 有沒有處理，呼叫端可以之後再送一次（結果回報靠 report_id 去重）
+        return {"ok": False, "error": str(e), "retry": True}
 
 
 # -------------------------------
@@ -116,11 +472,20 @@ async def handle_request(req, writer):
     action = req.get("action")
     data = req.get("data", {})
 
+    # 分片模式：房間不在這個分片 → 叫客戶端到對的分片
+    if (collection, action) in ROOM_ROUTED:
+        redirect = await route_room(data.get("room_id"))
+        if redirect:
+            return redirect
+
     # === 1️⃣ User 相關：註冊、登入、登出 ===
+    if collection == "User" and action == "resume":
+        return resume_session(data.get("session"), writer)
+
     if collection == "User":
         resp = await db_request(req)
         
-        # 登入成功 → 紀錄使用者資訊
+        # 登入成功 → 紀錄使用者資訊，發 session token（之後重連 / 進遊戲都用它）
         if action in ("create", "login") and resp.get("ok"):
             uid = resp["id"]
             online_users[uid] = {
@@ -128,14 +493,17 @@ async def handle_request(req, writer):
                 "writer": writer,
                 "room_id": None
             }
-            print(f"👤 使用者登入：{data['name']} (id={uid})")
+            resp["session"] = session.issue(uid, data["name"])
+            presence_changed(uid, data["name"])
+            log.info("👤 使用者登入", name=data['name'], id=uid)
 
         # 登出 → 移除線上清單
         elif action == "logout" and resp.get("ok"):
             uid = data["id"]
             if uid in online_users:
                 online_users.pop(uid)
-                print(f"👋 使用者登出 id={uid}")
+                presence_changed(uid)
+                log.info("👋 使用者登出", id=uid)
 
         return resp
 
@@ -145,45 +513,57 @@ async def handle_request(req, writer):
         # 建立房間（交給 DB Server 寫入）
         if action == "create":
             global room_counter
-            rid = room_counter
-            room_counter += 1
+            if directory is None:
+                rid = room_counter
+                room_counter += 1
+            elif data.get("room_id") is not None:
+                # 別的分片配好房號、redirect 過來的
+                rid = data["room_id"]
+                if rid in rooms or ring.owner(rid) != SHARD_ID:
+                    return {"ok": False, "error": "房號無效"}
+            else:
+                rid = (await directory.request("alloc_room")).get("room_id")
+                if rid is None:
+                    return {"ok": False, "error": "目錄服務無法使用"}
+                owner = ring.owner(rid)
+                if owner != SHARD_ID and owner in shard_addrs:
+                    return redirect_to(owner, room_id=rid)
             
             host_id = data["host_user_id"]
             name = data.get("name", f"Room_{rid}")
             visibility = data.get("visibility", "public")
             password = data.get("password") if visibility == "private" else None
+            try:
+                max_players = max(2, min(MAX_ROOM_PLAYERS, int(data.get("max_players", 2))))
+            except (TypeError, ValueError):
+                max_players = 2
 
             rooms[rid] = {
                 "name": name,
                 "host_id": host_id,
-                "guest_id": None,
+                "guest_ids": [],
+                "max_players": max_players,
                 "visibility": visibility,
                 "password": password,   
                 "status": "space",
-                "port": None
+                "port": None,
+                "relay_port": None
             }
 
             online_users[host_id]["room_id"] = rid
-            print(f"🏠 房主 {host_id} 建立房間 {rid}（{visibility}）")
+            room_changed(rid)
+            log.info("🏠 建立房間", host=host_id, room=rid, visibility=visibility, max_players=max_players)
             return {"ok": True, "room_id": rid}
 
         # 列出公開房間（只轉發）
         elif action == "list":
             try:
                 only_available = data.get("only_available", "space")
-                result = []
-                
-                for rid, r in rooms.items():
-                    if only_available == r["status"]:
-                        result.append({
-                            "id": rid,
-                            "name": r["name"],
-                            "host": online_users[r["host_id"]]["name"],
-                            "visibility": r["visibility"],
-                            "status": r["status"]
-                        })
-                    
+                if directory is not None:
+                    # 分片模式：所有分片的房間都在目錄服務
+                    return await directory.request("list_rooms", status=only_available)
 
+                result = [room_summary(rid, r) for rid, r in rooms.items() if only_available == r["status"]]
                 return {"ok": True, "rooms": result}
             except Exception as e:
                 return {"ok": False, "error": str(e)}
@@ -201,10 +581,11 @@ async def handle_request(req, writer):
             if room["host_id"] != host_id:
                 return {"ok": False, "error": "Only the host can close the room."}
             
-            # 🟩 若房間裡有 guest，通知他房間被關閉
-            guest_id = room.get("guest_id")
-            if guest_id and guest_id in online_users:
-                online_users[guest_id]["room_id"] = None
+            # 🟩 若房間裡有 guest，通知他們房間被關閉
+            guest_ids = room["guest_ids"]
+            for guest_id in guest_ids:
+                if guest_id in online_users:
+                    online_users[guest_id]["room_id"] = None
 
             # 🟩 更新房主狀態
             if host_id in online_users:
@@ -212,7 +593,8 @@ async def handle_request(req, writer):
 
             # 🟩 最後刪除房間
             rooms.pop(rid, None)
-            print(f"🗑️ 房間 {rid} 已由房主 {host_id} 關閉。")
+            room_changed(rid, removed=guest_ids)
+            log.info("🗑️ 房間已關閉", room=rid, host=host_id)
             return {"ok": True, "msg": f"房間 {rid} 已關閉。"}
 
         elif action == "join":
@@ -241,25 +623,7 @@ async def handle_request(req, writer):
             if not room:
                 return {"ok": False, "error": "Room not found."}
 
-            # 從 online_users 查出 guest 名字
-            guest_id = room.get("guest_id")
-            guest_name = None
-            if guest_id and guest_id in online_users:
-                guest_name = online_users[guest_id]["name"]
-                
-            
-            host = get_host_ip()
-            game_port = room.get("port")
-
-            return {
-                "ok": True,
-                "status": room["status"],
-                "guest_joined": bool(guest_id),
-                "guest_id": guest_id,
-                "guest_name": guest_name,
-                "game_host": host,
-                "game_port": game_port
-            }
+            return room_status(rid, room, data.get("user_id"))
         
         elif action == "kick":
             rid = data.get("room_id")
@@ -268,22 +632,24 @@ async def handle_request(req, writer):
             if not room:
                 return {"ok": False, "error": "Room not found."}
 
-            guest_id = room.get("guest_id")
-            if not guest_id:
+            # 指定 user_id 就踢那位，否則踢最後加入的
+            guest_id = data.get("user_id") or (room["guest_ids"][-1] if room["guest_ids"] else None)
+            if guest_id not in room["guest_ids"]:
                 return {"ok": False, "error": "No guest to kick."}
 
             # 從 online_users 查出 guest 名字
             guest_name = online_users.get(guest_id, {}).get("name", "未知玩家")
 
-            # 清空 guest 資料並重設狀態
-            room["guest_id"] = None
-            room["status"] = "space"
+            # 移除 guest 並重設狀態
+            room["guest_ids"].remove(guest_id)
+            refresh_room_status(room)
+            room_changed(rid, removed=[guest_id])
 
             # 更新 guest 狀態
             if guest_id in online_users:
                 online_users[guest_id]["room_id"] = None
 
-            print(f"👢 房主踢出了玩家 {guest_name} (id={guest_id}) from room {rid}")
+            log.info("👢 房主踢出玩家", name=guest_name, id=guest_id, room=rid)
             return {"ok": True, "msg": f"玩家 {guest_name} 已被踢出。"}
 
         elif action == "leave":
@@ -298,10 +664,11 @@ async def handle_request(req, writer):
             if not user_info:
                 return {"ok": False, "error": "使用者未登入。"}
 
-            if uid == room["guest_id"]:
-                print(f"👋 玩家 {user_info['name']} 離開房間 {rid}")
-                room["guest_id"] = None
-                room["status"] = "space"
+            if uid in room["guest_ids"]:
+                log.info("👋 玩家離開房間", name=user_info['name'], room=rid)
+                room["guest_ids"].remove(uid)
+                refresh_room_status(room)
+                room_changed(rid)
                 user_info["room_id"] = None
                 return {"ok": True, "msg": "你已離開房間。"}
 
@@ -317,6 +684,16 @@ async def handle_request(req, writer):
             host = get_host_ip()
             game_port = room.get("port")
 
+            # 🛰️ 第一次有人觀戰時才啟動轉播節點，之後所有觀戰者共用
+            if USE_SPECTATOR_RELAY and room["status"] == "play" and game_port:
+                if not room.get("relay_port"):
+                    relay_port = relay_ports.acquire()
+                    spawn_child("relay", ["game.spectator_relay", host, str(game_port), str(relay_port), str(RELAY_DELAY_SEC)],
+                                rid, relay_port, relay_ports)
+                    room["relay_port"] = relay_port
+                    log.info("🛰️ 啟動觀戰轉播", room=rid, port=relay_port)
+                game_port = room["relay_port"]
+
             return {
                 "ok": True,
                 "game_host": host,
@@ -336,14 +713,27 @@ async def handle_request(req, writer):
             if inviter_id not in online_users:
                 return {"ok": False, "error": "Inviter not online."}
 
-            # 🟩 防呆：檢查 invitee 是否在線上
-            if invitee_id not in online_users:
+            # 🟩 防呆：檢查 invitee 是否在線上（分片模式下可能在別的分片）
+            if not await is_online(invitee_id):
                 return {"ok": False, "error": "該玩家目前不在線上。"}
 
             # 🟩 檢查房間是否存在
             if room_id not in rooms:
                 return {"ok": False, "error": "房間不存在。"}
 
+            if directory is not None:
+                # 分片模式：邀請放在目錄服務，被邀請者從自己的分片查得到（剛好在這個分片就順便推送）
+                resp = await directory.request("invite_put", invite={
+                    "room_id": room_id, "room_name": rooms[room_id]["name"],
+                    "inviter_id": inviter_id, "from_name": online_users[inviter_id]["name"],
+                    "invitee_id": invitee_id})
+                if resp.get("ok"):
+                    push(invitee_id, "Invite/received", {
+                        "invite_id": resp["invite_id"], "from_id": inviter_id,
+                        "from_name": online_users[inviter_id]["name"],
+                        "room_id": room_id, "room_name": rooms[room_id]["name"]})
+                return resp
+
             # 🟩 建立邀請紀錄
             invite = {
                 "invite_id": invite_counter,
@@ -359,7 +749,10 @@ async def handle_request(req, writer):
             invitee_name = online_users[invitee_id]["name"]
             room_name = rooms[room_id]["name"]
 
-            print(f"📨 {inviter_name} (id={inviter_id}) 邀請 {invitee_name} (id={invitee_id}) 加入房間 {room_name} (id={room_id})")
+            log.info("📨 邀請", inviter=inviter_id, invitee=invitee_id, room=room_id, room_name=room_name)
+            push(invitee_id, "Invite/received", {
+                "invite_id": invite["invite_id"], "from_id": inviter_id, "from_name": inviter_name,
+                "room_id": room_id, "room_name": room_name})
 
             return {"ok": True, "invite_id": invite["invite_id"]}
 
@@ -370,6 +763,13 @@ async def handle_request(req, writer):
             if uid not in online_users:
                 return {"ok": False, "error": "User not online."}
 
+            if directory is not None:
+                resp = await directory.request("invite_list", user_id=uid)
+                return {"ok": resp.get("ok", False), "invites": [
+                    {"invite_id": inv["invite_id"], "from_id": inv["inviter_id"], "from_name": inv["from_name"],
+                     "room_id": inv["room_id"], "room_name": inv["room_name"]}
+                    for inv in resp.get("invites", [])]}
+
             # 🟩 取出該使用者收到的所有邀請
             user_invites = invites.get(uid, [])
 
@@ -396,6 +796,9 @@ async def handle_request(req, writer):
             invite_id = data.get("invite_id")    # 要處理的邀請 ID
             accept = data.get("accept", False)   # True=同意, False=拒絕
 
+            if directory is not None:
+                return await respond_invite_sharded(invitee_id, invite_id, accept)
+
             # 🟩 1️⃣ 檢查該玩家有無邀請
             if invitee_id not in invites:
                 return {"ok": False, "error": "沒有邀請資料。"}
@@ -417,12 +820,12 @@ async def handle_request(req, writer):
                 if not user_invites:
                     invites.pop(invitee_id, None)
 
-                print(f"❌ {invitee_name} 拒絕了 {inviter_name} 的邀請 (invite_id={invite_id})")
+                log.info("❌ 拒絕邀請", invitee=invitee_name, inviter=inviter_name, invite_id=invite_id)
             
                 return {"ok": True, "msg": "已拒絕邀請。"}
             
             else:
-                print(f"✅ {invitee_name} 同意 {inviter_name} 的邀請，加入房間 {room_id}")
+                log.info("✅ 同意邀請", invitee=invitee_name, inviter=inviter_name, room=room_id)
                 
                 join_resp = await join_room(invitee_id, room_id)
                 
@@ -435,25 +838,58 @@ async def handle_request(req, writer):
 
     # === 4️⃣ Game 相關（之後開對戰伺服器用）===
     elif collection == "Game":
+        if action in GAME_CONTROL and writer not in game_conns:
+            # 一般玩家連線不能冒充 game server（Room/status 看得到 port，不擋的話誰都能重置對戰中的房間）
+            metrics.inc("lobby_control_rejected", action=action)
+            log.warning("🚫 非 game server 連線送控制請求", action=action, addr=writer.get_extra_info("peername"))
+            return {"ok": False, "error": "只接受 game server 控制連線"}
+
         if action == "start":
             rid = data.get("room_id")
             room = rooms.get(rid)
             
             if not room:
                 return {"ok": False, "error": "房間不存在"}
+            if not room["guest_ids"]:
+                return {"ok": False, "error": "至少需要兩位玩家"}
             
-            game_port = find_free_port(16800, 16900)
+            if room["status"] == "play":
+                return {"ok": False, "error": "遊戲已在進行中"}
             
-            print(f"🎮 房間 {rid} 要開始遊戲 → 啟動 Game Server on port {game_port}")
-            
-            subprocess.Popen(
-                ["python", "-m", "game.game_server", str(game_port),str(rid)]
-            )
+            n_players = 1 + len(room["guest_ids"])
+            room["status"] = "play"          # 先佔住：等 game host 回覆期間不會被重複開局
+            host = get_host_ip()
+            placed = None
+            try:
+                if game_host is not None:
+                    # 多核心模式：game host 把這場放到負載最低的 worker，回覆該場的 port
+                    placed = await game_host.request("start", room_id=rid, players=n_players, lobby_port=LOBBY_PORT,
+                                                     session_secret=os.environ.get(session.SECRET_ENV))
+                    if placed.get("ok"):
+                        host, game_port = placed["game_host"], placed["game_port"]
+                        log.info("🎮 對戰交給 Game Host", room=rid, worker=placed.get("worker"), port=game_port, players=n_players)
+                    else:
+                        log.warning("⚠️ Game Host 無法開局，改用獨立 process", room=rid, error=placed.get("error"))
+
+                if not (placed and placed.get("ok")):
+                    game_port = game_ports.acquire()
+                    log.info("🎮 啟動 Game Server", room=rid, port=game_port, players=n_players)
+                    try:
+                        spawn_child("game", ["game.game_server", str(game_port), str(rid), str(n_players), str(LOBBY_PORT)],
+                                    rid, game_port, game_ports)
+                    except Exception:
+                        game_ports.release(game_port)
+                        raise
+            except Exception as e:
+                # 沒開成：房間放回 space / full，不然會一直卡在 play（沒有子程序，reap_loop 也不會重設）
+                room["status"] = "space"
+                refresh_room_status(room)
+                metrics.inc("lobby_game_start_errors")
+                log.error("❌ 無法開始對戰", room=rid, error=e)
+                return {"ok": False, "error": f"無法開始遊戲：{e}"}
             
-            room["status"] = "play"
             room["port"] = game_port
-            
-            host= get_host_ip()
+            room_changed(rid)
             
             return {
                 "ok": True,
@@ -466,30 +902,95 @@ async def handle_request(req, writer):
             result = data.get("result", {})
             winner = data.get("winner")
 
-            print(f"🏁 房間 {data.get('room_id')} 結束，勝方是 {winner}")
+            log.info("🏁 遊戲結束", room=data.get('room_id'), winner=winner)
             for key, info in result.items():
-                uid = info.get("user_id")
-                sc = info.get("score")
-                lv = info.get("level")
-                print(f"  玩家 {uid}: 分數={sc}, 等級={lv}")
+                log.debug("  玩家結果", user=info.get("user_id"), score=info.get("score"), level=info.get("level"))
             
             resp = await db_request(req)
             
             if resp.get("ok"):
-                print(f"✅ DB Server 已成功寫入 {resp.get('count', '?')} 筆結果")
+                log.info("✅ DB Server 已寫入結果", count=resp.get('count', '?'), duplicate=resp.get("duplicate", False))
             else:
-                print(f"⚠️ DB Server 寫入失敗: {resp.get('error')}")
+                log.warning("⚠️ DB Server 寫入失敗", error=resp.get('error'))
+
+            # 🔸 回覆 Game Server（這就是 ack）：DB 沒收到的話帶 retry，game server 會留著 spool 重送
+            return {"ok": resp.get("ok", False), "report_id": data.get("report_id"),
+                    "error": resp.get("error"), "retry": resp.get("retry", False)}
+
+        elif action == "hello":
+            # game server 的常駐控制連線（結果回報 / 結束通知都走這條）：簽章要對得上這一場的房號 + port
+            if not session.check_control_auth(data.get("auth"), data.get("room_id"), data.get("port")):
+                metrics.inc("lobby_control_rejected", action=action)
+                log.warning("🚫 控制連線驗章失敗", room=data.get("room_id"), port=data.get("port"))
+                return {"ok": False, "error": "控制連線驗章失敗"}
+            game_conns[writer] = (data.get("room_id"), data.get("port"))
+            log.info("🎛️ Game Server 控制連線", room=data.get("room_id"), port=data.get("port"))
+            return {"ok": True}
 
-            # 🔸 最後回覆 Game Server 一個成功訊息
+        elif action == "ended":
+            # game server 結算完、準備離開：房間回到 space，port 等 process 結束後由 reap_children 回收
+            rid = data.get("room_id")
+            room = rooms.get(rid)
+            if (rid, data.get("port")) != game_conns[writer]:
+                return {"ok": False, "error": "只能結束自己那一場"}
+            if room and room["status"] == "play" and room.get("port") == data.get("port"):
+                end_room_game(rid)
+                log.info("🏁 對戰結束，房間重新開放", room=rid, reason=data.get("reason"))
             return {"ok": True}
             
             
 
 
-    # === 5️⃣ 其他未知請求 ===
+    # === 5️⃣ 連線狀態：ping（客戶端量 RTT / 時鐘差）===
+    elif collection == "Sys" and action == "ping":
+        t = now_ms()
+        return {"ok": True, "t0": data.get("t0"), "t1": t, "t2": t}
+
+    # === 6️⃣ 其他未知請求 ===
     else:
         return {"ok": False, "error": f"未知 collection/action: {collection}/{action}"}
 
+async def respond_invite_sharded(invitee_id, invite_id, accept):
+    """分片模式的 Invite/respond：邀請在目錄服務，同意的話要到房間所在的分片處理"""
+    inv = (await directory.request("invite_get", user_id=invitee_id, invite_id=invite_id)).get("invite")
+    if not inv:
+        return {"ok": False, "error": "找不到指定的邀請。"}
+    if accept:
+        redirect = await route_room(inv["room_id"])
+        if redirect:
+            return redirect           # 邀請先留著，到房間的分片再處理一次
+    await directory.request("invite_del", user_id=invitee_id, invite_id=invite_id)
+    if not accept:
+        log.info("❌ 拒絕邀請", invitee=invitee_id, inviter=inv["inviter_id"], invite_id=invite_id)
+        return {"ok": True, "msg": "已拒絕邀請。"}
+    log.info("✅ 同意邀請", invitee=invitee_id, inviter=inv["inviter_id"], room=inv["room_id"])
+    return await join_room(invitee_id, inv["room_id"])
+
+
+def resume_session(token, writer):
+    """User/resume：只在記憶體驗 token，不問 DB、不跑 KDF"""
+    claims = session.verify(token)
+    if claims is None:
+        metrics.inc("lobby_resumes", result="invalid")
+        return {"ok": False, "error": "Invalid or expired session."}
+
+    uid, name = claims["uid"], claims["name"]
+    info = online_users.get(uid)
+    if info is None:
+        # 斷線時已經從線上名單移除：重新加入，所在的房間如果還在就接回去
+        room_id = next((rid for rid, r in rooms.items() if r["host_id"] == uid or uid in r["guest_ids"]), None)
+        online_users[uid] = {"name": name, "writer": writer, "room_id": room_id}
+        presence_changed(uid, name)
+        # DB 的登入狀態在背景補上，不擋住這次 resume
+        asyncio.create_task(db_request({"collection": "User", "action": "mark_online", "data": {"id": uid}}))
+    else:
+        # 舊連線可能是半開的，換成這一條
+        info["writer"] = writer
+    metrics.inc("lobby_resumes", result="ok")
+    log.info("🔁 使用者以 session 重連", name=name, id=uid)
+    return {"ok": True, "id": uid, "name": name, "room_id": online_users[uid]["room_id"],
+            "session": session.issue(uid, name)}
+
 #重複function
 
 async def join_room(uid: int, rid: int):
@@ -513,40 +1014,90 @@ async def join_room(uid: int, rid: int):
 
 
     # 🟩 更新房間與玩家狀態
-    room["guest_id"] = uid
-    room["status"] = "full"
+    room["guest_ids"].append(uid)
+    refresh_room_status(room)
+    room_changed(rid)
     online_users[uid]["room_id"] = rid
 
     guest_name = user_info["name"]
 
-    print(f"🎮 玩家 {guest_name} (id={uid}) 加入房間 {rid}")
+    log.info("🎮 玩家加入房間", name=guest_name, id=uid, room=rid)
 
     return {"ok": True, "room_id": rid}
 
 # -------------------------------
 # 玩家連線處理
 # -------------------------------
+async def serve_request(req, writer):
+    t = time.perf_counter()
+    resp = await handle_request(req, writer)
+    labels = request_labels(req.get("collection"), req.get("action"), KNOWN_REQUESTS)
+    metrics.inc("lobby_requests", **labels)
+    metrics.observe("lobby_request_ms", (time.perf_counter() - t) * 1000, **labels)
+    return resp
+
+
+async def serve_async(req, writer, lock, slots):
+    """非同步客戶端的 request：在自己的 task 裡處理，回覆帶回 rid"""
+    try:
+        resp = await serve_request(req, writer)
+    except Exception as e:
+        log.warning("⚠️ request 處理失敗", collection=req.get("collection"), action=req.get("action"), error=e)
+        resp = {"ok": False, "error": str(e)}
+    finally:
+        slots.release()
+    await send_locked(writer, lock, {**resp, "rid": req["rid"]})
+
+
 async def handle_client(reader, writer):
     addr = writer.get_extra_info("peername")
-    print(f"📡 玩家連線: {addr}")
+    log.info("📡 玩家連線", addr=addr)
+    metrics.inc("lobby_connections")
+    slots = asyncio.Semaphore(MAX_INFLIGHT_REQUESTS)
+    inflight = set()
 
     try:
         while True:
-            req = await recv_msg(reader)
+            req = await recv_msg(reader, MAX_LEN)      # 客戶端的 request 都很小；大訊息只會是回覆
             if not req:
                 break
-            #print(f"📥 收到來自 {addr}: {req}")
+            log.debug("📥 收到", addr=addr, collection=req.get("collection"), action=req.get("action"), rid=req.get("rid"))
+
+            if "rid" in req:
+                # 非同步客戶端：開 task 處理，馬上讀下一個（同時處理的數量到上限就先不讀）
+                lock = mux_conns.setdefault(writer, asyncio.Lock())
+                await slots.acquire()
+                task = asyncio.create_task(serve_async(req, writer, lock, slots))
+                inflight.add(task)
+                task.add_done_callback(inflight.discard)
+                continue
 
-            resp = await handle_request(req, writer)
-            await send_msg(writer, resp)
+            resp = await serve_request(req, writer)
+            lock = mux_conns.get(writer)
+            if lock is None:
+                await send_msg(writer, resp)
+            else:
+                async with lock:                      # 同一條連線上也有推送中的事件
+                    await send_msg(writer, resp)
 
     except asyncio.IncompleteReadError:
-        print(f"❌ 玩家斷線: {addr}")
+        log.info("❌ 玩家斷線", addr=addr)
     finally:
+        # 還在處理的 request 先跑完（登入到一半的玩家也要一起清掉）
+        if inflight:
+            await asyncio.gather(*inflight, return_exceptions=True)
+        mux_conns.pop(writer, None)
+        game_conns.pop(writer, None)
         # 清理掉線的玩家
         for uid, info in list(online_users.items()):
             if info["writer"] is writer:
-                print(f"👋 玩家離線 id={uid}")
+                log.info("👋 玩家離線", id=uid)
+
+                if directory is not None:
+                    # 分片模式：可能是被 redirect 到別的分片，晚一點確認沒有換分片再登出
+                    online_users.pop(uid)
+                    asyncio.create_task(release_user(uid))
+                    break
                 
                 # 通知 DB Server 登出
                 try:
@@ -555,9 +1106,9 @@ async def handle_client(reader, writer):
                         "action": "logout",
                         "data": {"id": uid}
                     })
-                    print(f"🗂 已通知 DB Server 登出使用者 id={uid}")
+                    log.debug("🗂 已通知 DB Server 登出", id=uid)
                 except Exception as e:
-                    print(f"⚠️ 登出通知 DB Server 失敗：{e}")
+                    log.warning("⚠️ 登出通知 DB Server 失敗", error=e)
                 
                 online_users.pop(uid)
                 break
@@ -576,29 +1127,57 @@ async def main():
     global db_reader, db_writer
 
     # 啟動時就連上 DB Server
-    db_reader, db_writer = await asyncio.open_connection(DB_HOST, DB_PORT)
-    print(f"✅ 已連線至 DB Server {DB_HOST}:{DB_PORT}")
+    await db_connect()
+    log.info("✅ 已連線至 DB Server", host=DB_HOST, port=DB_PORT)
+    if session.EPHEMERAL_SECRET and directory is None:
+        log.warning("⚠️ 未設定 NT_SESSION_SECRET，使用隨機 secret（Lobby 重啟後 session 全部失效）")
     
     # Lobby 初始化
-    resp = await db_request({"collection": "Lobby", "action": "init"})
-    if resp.get("ok"):
-        print("🧹 Lobby 初始化：所有使用者狀態已重設。")
+    if directory is None:
+        resp = await db_request({"collection": "Lobby", "action": "init"})
+        if resp.get("ok"):
+            log.info("🧹 Lobby 初始化：所有使用者狀態已重設。")
+        else:
+            log.warning("⚠️ Lobby 初始化失敗", error=resp.get('error'))
     else:
-        print(f"⚠️ Lobby 初始化失敗：{resp.get('error')}")
+        # 分片模式：別的分片上的玩家還在線上，不能全部重設，只登出上次連在這個分片上的玩家
+        resp = await directory.request("presence_list", shard=SHARD_ID)
+        for uid in resp.get("user_ids", []):
+            await directory.request("presence_del", user_id=uid, shard=SHARD_ID)
+            await db_request({"collection": "User", "action": "logout", "data": {"id": uid}})
+        log.info("🧹 分片初始化：登出上次留在這個分片的玩家", shard=SHARD_ID, count=len(resp.get("user_ids", [])))
+
+    if directory is not None:
+        # 分片模式：先跟目錄服務拿到這個分片的 port 區段，才開始收玩家
+        await shard_heartbeat()
+        while port_block is None:
+            log.info("⏳ 等待目錄服務分配 port 區段", shard=SHARD_ID)
+            await asyncio.sleep(1)
+            await shard_heartbeat()
+        asyncio.create_task(shard_loop())
+        log.info("🧩 分片模式", shard=SHARD_ID, shards=sorted(shard_addrs))
 
     # 啟動 Lobby Server
-    server = await asyncio.start_server(handle_client, LOBBY_HOST, LOBBY_PORT)
+    server = await runtime.start_server(handle_client, LOBBY_HOST, LOBBY_PORT)
     addr = server.sockets[0].getsockname()
-    print(f"✅ Lobby Server 啟動於 {addr}")
+    log.info("✅ Lobby Server 啟動", addr=addr)
+    if await start_stats_server(STATS_PORT):
+        log.info("📊 stats endpoint", port=STATS_PORT)
+
+    reaper = asyncio.create_task(reap_loop())
 
     try:
         async with server:
             await server.serve_forever()
     finally:
+        reaper.cancel()
+        # Lobby 關掉時順便收掉還在跑的 game server / relay
+        for child in children.values():
+            child["proc"].terminate()
         if db_writer:
             db_writer.close()
             await db_writer.wait_closed()
-            print("🛑 已關閉 DB 連線。")
+            log.info("🛑 已關閉 DB 連線。")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    runtime.run(main())
@@ -0,0 +1,10 @@
+@echo off
+chcp 65001 >nul
+title Tetris Bot
+cd /d "%~dp0"
+
+echo ===============================
+echo  🤖 啟動 Tetris Bot 中...
+echo ===============================
+python -m game.bot 140.113.66.30 10000 2 --pps 2
+pause
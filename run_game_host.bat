@@ -0,0 +1,19 @@
+@echo off
+chcp 65001 >nul
+title Game Host
+cd /d "%~dp0"
+
+echo ===========================================
+echo   🧵 多核心 Game Host 啟動中...
+echo   啟動時間：%date% %time%
+echo ===========================================
+echo.
+
+REM 預設 worker 數 = CPU 核心數；Lobby 要先設定 NT_GAME_HOST 才會把對戰交給這裡：
+REM   set NT_GAME_HOST=127.0.0.1:14120
+REM   python -m lobby.lobby_server
+python -m game.game_host
+
+echo.
+echo 🛑 Game Host 已關閉。
+pause
@@ -0,0 +1,19 @@
+@echo off
+chcp 65001 >nul
+title Lobby Directory
+cd /d "%~dp0"
+
+echo ===========================================
+echo   🧩 Lobby 目錄服務（分片模式）啟動中...
+echo   啟動時間：%date% %time%
+echo ===========================================
+echo.
+
+REM 先啟動目錄服務，再啟動多個 lobby 分片（每個一個 port、一個 shard id）：
+REM   python -m lobby.lobby_server 14110 s1
+REM   python -m lobby.lobby_server 14140 s2
+python -m lobby.directory
+
+echo.
+echo 🛑 目錄服務已關閉。
+pause
@@ -0,0 +1,10 @@
+@echo off
+chcp 65001 >nul
+title Spectator Relay
+cd /d "%~dp0"
+
+echo ===============================
+echo  🛰️ 啟動 Spectator Relay 中...
+echo ===============================
+python -m game.spectator_relay 140.113.66.30 10000 10100 0
+pause
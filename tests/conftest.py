@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 讓測試可以直接 import common / game / lobby（跟 python -m xxx 從專案根目錄跑一樣）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
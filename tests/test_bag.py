@@ -0,0 +1,30 @@
+from game.bag import BAG_SIZE, BLOCK_BAGS, TETROMINOES, SevenBag, seven_bag_stream
+
+BLOCK = BAG_SIZE * BLOCK_BAGS
+
+
+def test_piece_is_deterministic_across_block_boundaries():
+    a, b = SevenBag(42), SevenBag(42)
+    # b 從後面往前跳著取，不先產生前面的 block，結果要一樣
+    idx = [0, 1, BLOCK - 1, BLOCK, BLOCK + 1, 2 * BLOCK - 1, 2 * BLOCK, 5 * BLOCK + 3]
+    expect = [a.piece(i) for i in idx]
+    assert [b.piece(i) for i in reversed(idx)] == list(reversed(expect))
+    assert [SevenBag(42).piece(i) for i in idx] == expect
+
+
+def test_stream_matches_random_access():
+    stream = seven_bag_stream(7)
+    seq = [next(stream) for _ in range(2 * BLOCK + 14)]
+    assert seq == SevenBag(7).pieces(0, len(seq))
+    assert SevenBag(7).pieces(BLOCK - 3, 6) == seq[BLOCK - 3:BLOCK + 3]
+
+
+def test_every_bag_is_a_permutation():
+    bag = SevenBag(123)
+    seq = bag.pieces(0, 3 * BLOCK)
+    for i in range(0, len(seq), BAG_SIZE):
+        assert sorted(seq[i:i + BAG_SIZE]) == sorted(TETROMINOES)
+
+
+def test_seeds_differ():
+    assert SevenBag(1).pieces(0, 70) != SevenBag(2).pieces(0, 70)
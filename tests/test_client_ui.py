@@ -0,0 +1,32 @@
+import asyncio
+
+from client import client_ui
+
+
+class FakeClient:
+    def __init__(self):
+        self.events = asyncio.Queue()
+
+
+def test_prompt_after_event_gets_the_next_line(monkeypatch):
+    async def run():
+        monkeypatch.setattr(client_ui, "stdin_lines", asyncio.Queue())
+        monkeypatch.setattr(client_ui, "STATUS_REFRESH_SEC", 1)
+        client = FakeClient()
+        pending = {}
+        # 等待畫面：房主開始遊戲的事件先到，stdin task 還在等
+        client.events.put_nowait({"event": "Room/status", "data": {"room_id": 1}})
+        ready = await client_ui.next_input(client, pending)
+        assert [kind for kind, _ in ready] == ["event"]
+        assert "key" in pending
+
+        client_ui.drop_key_wait(pending)
+        prompt = asyncio.ensure_future(client_ui.ainput())
+        await asyncio.sleep(0)
+        client_ui.stdin_lines.put_nowait("")       # 玩家按下的第一個 Enter
+        assert await asyncio.wait_for(prompt, 1) == ""
+        assert "key" not in pending
+        for task in pending.values():
+            task.cancel()
+
+    asyncio.run(run())
@@ -0,0 +1,48 @@
+import random
+
+from common.clock import ClockSync
+
+SKEW_MS = 250                        # 對方時鐘比本機快 250ms
+
+
+def exchange(sync, local, up_ms, down_ms, hold_ms=1):
+    """模擬一次 ping/pong：local 是本機送出 ping 的時間"""
+    t0 = local
+    t1 = t0 + up_ms + SKEW_MS
+    t2 = t1 + hold_ms
+    t3 = t2 - SKEW_MS + down_ms
+    return sync.sample(t0, t1, t2, t3)
+
+
+def test_symmetric_path_is_exact():
+    sync = ClockSync()
+    assert exchange(sync, 1_000_000, 20, 20) == 40
+    assert sync.offset_ms == SKEW_MS
+    assert sync.to_local(1_000_000 + SKEW_MS) == 1_000_000
+    assert sync.to_remote(1_000_000) == 1_000_000 + SKEW_MS
+
+
+def test_offset_converges_with_jitter():
+    rng = random.Random(5)
+    sync = ClockSync()
+    local = 1_000_000
+    # 第一次剛好碰到很不對稱的路徑：誤差很大
+    exchange(sync, local, 200, 10)
+    assert abs(sync.offset_ms - SKEW_MS) > 50
+    for _ in range(200):
+        local += 1000
+        exchange(sync, local, rng.uniform(10, 40), rng.uniform(10, 40))
+    assert abs(sync.offset_ms - SKEW_MS) < 5
+    assert 20 < sync.rtt_ms < 80
+    assert sync.samples == 201
+
+
+def test_high_rtt_samples_weigh_less():
+    slow, fast = ClockSync(), ClockSync()
+    for sync in (slow, fast):
+        for i in range(50):
+            exchange(sync, 1_000_000 + i * 1000, 20, 20)
+    # 兩次的 offset 都偏了 100ms；RTT 大（排隊）的那次對 offset 的影響要比較小
+    assert exchange(slow, 2_000_000, 220, 20) == 240
+    assert exchange(fast, 2_000_000, 120, -80) == 40
+    assert 0 < slow.offset_ms - SKEW_MS < fast.offset_ms - SKEW_MS
@@ -0,0 +1,138 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from database import db_fun as db
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "test.db"))
+    db.init_db()
+    return db.DB_PATH
+
+
+def results(path):
+    with sqlite3.connect(path) as conn:
+        return sorted(conn.execute("SELECT user_id, opponent_id, score, level, win FROM gameresults").fetchall())
+
+
+def test_report_two_players(fresh_db):
+    resp = db.report_game_result({"report_id": "r1", "room_id": 1, "winner": 101, "result": {
+        "p1": {"user_id": 101, "score": 1200, "level": 3},
+        "p2": {"user_id": 205, "score": 900, "level": 2}}})
+    assert resp == {"ok": True, "count": 2}
+    assert results(fresh_db) == [(101, 205, 1200, 3, 1), (205, 101, 900, 2, 0)]
+    # 同一個 report_id 重送只寫一次
+    assert db.report_game_result({"report_id": "r1", "room_id": 1, "winner": 101, "result": {
+        "p1": {"user_id": 101, "score": 1200, "level": 3},
+        "p2": {"user_id": 205, "score": 900, "level": 2}}})["duplicate"]
+    assert len(results(fresh_db)) == 2
+
+
+def test_report_keeps_players_with_accounts(fresh_db):
+    # 對手是沒有帳號的 bot：有帳號的那位照樣記錄
+    resp = db.report_game_result({"report_id": "r2", "room_id": 2, "winner": None, "result": {
+        "p1": {"user_id": 101, "score": 500, "level": 1},
+        "p2": {"user_id": None, "score": 800, "level": 2}}})
+    assert resp == {"ok": True, "count": 1}
+    assert results(fresh_db) == [(101, db.NO_ACCOUNT_ID, 500, 1, 0)]
+
+
+def test_report_multiplayer_opponent_is_best_other(fresh_db):
+    resp = db.report_game_result({"room_id": 3, "winner": 3, "result": {
+        "p1": {"user_id": 1, "score": 10}, "p2": {"user_id": 2, "score": 30},
+        "p3": {"user_id": 3, "score": 20}, "p4": {"user_id": None, "score": 5}}})
+    assert resp["count"] == 3
+    assert [r[:2] for r in results(fresh_db)] == [(1, 2), (2, 3), (3, 2)]
+
+
+def test_report_without_accounts_is_not_an_error(fresh_db):
+    resp = db.report_game_result({"room_id": 4, "result": {"p1": {"user_id": None}, "p2": {"user_id": None}}})
+    assert resp == {"ok": True, "count": 0}
+    assert not db.report_game_result({"room_id": 4, "result": {}})["ok"]
+
+
+# -------------------------------
+# 密碼雜湊（scrypt + 升級 + 驗證快取）
+# -------------------------------
+
+@pytest.fixture
+def fast_kdf(monkeypatch):
+    monkeypatch.setattr(db, "SCRYPT_N", 2 ** 10)        # 測試不需要真的那麼慢
+    monkeypatch.setattr(db, "_verify_cache", {})
+
+
+def stored_hash(path, name):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT password_hash FROM users WHERE name=?", (name,)).fetchone()[0]
+
+
+def cache_hits(result):
+    from common.metrics import metrics
+    return metrics.counters.get(metrics.key("db_verify_cache", {"result": result}), 0)
+
+
+def test_hash_is_salted_and_verifies(fast_kdf):
+    a, b = db.hash_password("pw"), db.hash_password("pw")
+    assert a != b and a.startswith("scrypt$")
+    assert db.verify_password("pw", a) == (True, False)
+    assert db.verify_password("nope", a) == (False, False)
+    assert db.verify_password("pw", "scrypt$garbage") == (False, False)
+
+
+def test_outdated_hashes_need_rehash(fast_kdf, monkeypatch):
+    old = db.hash_password("pw")
+    monkeypatch.setattr(db, "SCRYPT_N", 2 ** 11)
+    assert db.verify_password("pw", old) == (True, True)
+    assert db.verify_password("pw", db.legacy_hash_password("pw")) == (True, True)
+    assert db.verify_password("nope", db.legacy_hash_password("pw")) == (False, False)
+
+
+def test_login_upgrades_legacy_hash(fresh_db, fast_kdf):
+    from database import db_server
+    db.insert_user("old", db.legacy_hash_password("pw"))
+    db.logout_user(db.get_credentials("old")[0])
+    assert asyncio.run(db_server.login_user("old", "pw"))["ok"]
+    upgraded = stored_hash(fresh_db, "old")
+    assert upgraded.startswith("scrypt$")
+    assert db.verify_password("pw", upgraded) == (True, False)
+
+
+def test_login_uses_verify_cache(fresh_db, fast_kdf):
+    from database import db_server
+    assert asyncio.run(db_server.create_user("u", "pw"))["ok"]
+    uid = db.get_credentials("u")[0]
+    db.logout_user(uid)
+
+    hits = cache_hits("hit")
+    assert asyncio.run(db_server.login_user("u", "pw"))["ok"]          # 註冊時已經記住：不用跑 KDF
+    assert cache_hits("hit") == hits + 1
+    db.logout_user(uid)
+
+    misses = cache_hits("miss")
+    assert asyncio.run(db_server.login_user("u", "bad")) == {"ok": False, "error": "Invalid password."}
+    assert cache_hits("miss") == misses + 1                              # 密碼不同：快取不能放行
+
+    # 雜湊換掉（改密碼 / 升級）之後舊的快取自動失效
+    with sqlite3.connect(fresh_db) as conn:
+        conn.execute("UPDATE users SET password_hash=? WHERE id=?", (db.hash_password("new"), uid))
+    assert not db.verify_cached("u", stored_hash(fresh_db, "u"), "pw")
+    assert not asyncio.run(db_server.login_user("u", "pw"))["ok"]
+    assert asyncio.run(db_server.login_user("u", "new"))["ok"]
+
+
+def test_verify_cache_expires(fast_kdf, monkeypatch):
+    db.remember_verified("u", "h", "pw")
+    assert db.verify_cached("u", "h", "pw")
+    now = db.time.monotonic()
+    monkeypatch.setattr(db.time, "monotonic", lambda: now + db.VERIFY_CACHE_SEC + 1)
+    assert not db.verify_cached("u", "h", "pw")
+
+
+def test_double_login_is_refused(fresh_db, fast_kdf):
+    from database import db_server
+    assert asyncio.run(db_server.create_user("u", "pw"))["ok"]
+    resp = asyncio.run(db_server.login_user("u", "pw"))
+    assert resp == {"ok": False, "error": "User already logged in elsewhere."}
@@ -0,0 +1,166 @@
+import asyncio
+import importlib
+import sys
+import time
+
+import pytest
+
+from lobby import directory
+from lobby.directory import HashRing
+
+
+# -------------------------------
+# HashRing
+# -------------------------------
+
+def owners(ring, keys):
+    return {k: ring.owner(k) for k in keys}
+
+
+def test_ring_is_deterministic_and_spread():
+    keys = range(3000)
+    ring = HashRing(["s1", "s2", "s3"])
+    assert owners(ring, keys) == owners(HashRing(["s3", "s1", "s2"]), keys)
+    counts = {sid: 0 for sid in ("s1", "s2", "s3")}
+    for sid in owners(ring, keys).values():
+        counts[sid] += 1
+    assert all(500 < n < 1500 for n in counts.values()), counts
+    assert HashRing().owner(1) is None
+
+
+def test_adding_a_shard_only_moves_keys_to_it():
+    keys = range(3000)
+    before = owners(HashRing(["s1", "s2", "s3"]), keys)
+    after = owners(HashRing(["s1", "s2", "s3", "s4"]), keys)
+    moved = [k for k in keys if before[k] != after[k]]
+    assert all(after[k] == "s4" for k in moved)
+    assert 300 < len(moved) < 1200
+
+
+def test_removing_a_shard_only_moves_its_keys():
+    keys = range(3000)
+    before = owners(HashRing(["s1", "s2", "s3"]), keys)
+    after = owners(HashRing(["s1", "s3"]), keys)
+    assert all(before[k] == "s2" for k in keys if before[k] != after[k])
+
+
+# -------------------------------
+# 目錄服務
+# -------------------------------
+
+@pytest.fixture
+def fresh_directory(monkeypatch):
+    for name in ("shards", "rooms", "presence", "invites"):
+        monkeypatch.setattr(directory, name, {})
+    monkeypatch.setattr(directory, "orphaned", [])
+    monkeypatch.setattr(directory, "room_seq", 0)
+    monkeypatch.setattr(directory, "started", time.monotonic() - directory.CLAIM_GRACE_SEC - 1)
+    return directory
+
+
+def req(action, **data):
+    return directory.handle_request({"collection": "Dir", "action": action, "data": data})
+
+
+def heartbeat(sid, port, **data):
+    return req("heartbeat", shard=sid, host="127.0.0.1", port=port, **data)
+
+
+def test_heartbeat_assigns_distinct_port_blocks(fresh_directory):
+    a, b = heartbeat("s1", 14110), heartbeat("s2", 14111)
+    assert not a["known"] and a["port_block"] == 0 and b["port_block"] == 1
+    assert set(b["shards"]) == {"s1", "s2"}
+    again = heartbeat("s1", 14110, port_block=a["port_block"])
+    assert again["known"] and again["port_block"] == 0
+    assert a["session_secret"] == b["session_secret"]
+
+
+def test_restart_grace_keeps_room_ids_and_blocks(fresh_directory, monkeypatch):
+    monkeypatch.setattr(directory, "started", time.monotonic())
+    # 剛重啟：先不發房號 / 區段，等分片報回目前的狀態
+    assert not req("alloc_room")["ok"]
+    assert heartbeat("s1", 14110)["port_block"] is None
+    assert heartbeat("s2", 14111, port_block=3, max_room_id=41)["port_block"] == 3
+    monkeypatch.setattr(directory, "started", time.monotonic() - directory.CLAIM_GRACE_SEC - 1)
+    assert req("alloc_room")["room_id"] == 42
+    assert heartbeat("s1", 14110)["port_block"] == 0
+
+
+def test_room_ids_are_unique(fresh_directory):
+    ids = [req("alloc_room")["room_id"] for _ in range(5)]
+    assert ids == list(range(5))
+    req("put_room", room={"id": 10, "shard": "s1", "status": "space"})
+    assert req("alloc_room")["room_id"] == 11
+
+
+def test_dead_shard_rooms_and_users_are_dropped(fresh_directory, monkeypatch):
+    heartbeat("s1", 14110)
+    heartbeat("s2", 14111)
+    req("put_room", room={"id": 1, "shard": "s2", "status": "space"})
+    req("presence_put", user_id=7, name="u7", shard="s2")
+    req("presence_put", user_id=8, name="u8", shard="s2")
+    directory.shards["s2"]["seen"] -= directory.SHARD_TTL_SEC + 1
+    resp = heartbeat("s1", 14110)
+    assert set(resp["shards"]) == {"s1"}
+    assert sorted(resp["logout"]) == [7, 8]              # 交給活著的分片去 DB 登出
+    assert not req("get_room", room_id=1)["ok"]
+    assert heartbeat("s1", 14110)["logout"] == []
+
+
+def test_presence_only_removed_by_current_shard(fresh_directory):
+    req("presence_put", user_id=7, name="u7", shard="s1")
+    req("presence_put", user_id=7, name="u7", shard="s2")       # 換到 s2（session resume）
+    req("presence_del", user_id=7, shard="s1")                  # s1 晚到的離線通知
+    assert req("presence_get", user_id=7) == {"ok": True, "online": True, "name": "u7", "shard": "s2"}
+    assert req("presence_list", shard="s2")["user_ids"] == [7]
+    req("presence_del", user_id=7, shard="s2")
+    assert not req("presence_get", user_id=7)["online"]
+
+
+# -------------------------------
+# Lobby 分片的 redirect
+# -------------------------------
+
+class FakeDirectory:
+    def __init__(self):
+        self.rooms = {}
+
+    async def request(self, action, **data):
+        assert action == "get_room"
+        room = self.rooms.get(data["room_id"])
+        return {"ok": room is not None, "room": room}
+
+
+@pytest.fixture
+def shard_lobby(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["lobby_server"])
+    lobby = importlib.import_module("lobby.lobby_server")
+    fake = FakeDirectory()
+    monkeypatch.setattr(lobby, "directory", fake)
+    monkeypatch.setattr(lobby, "SHARD_ID", "s1")
+    monkeypatch.setattr(lobby, "ring", HashRing(["s1", "s2"]))
+    monkeypatch.setattr(lobby, "shard_addrs", {"s1": {"host": "h", "port": 1}, "s2": {"host": "h", "port": 2}})
+    monkeypatch.setattr(lobby, "rooms", {})
+    return lobby, fake
+
+
+def test_route_room(shard_lobby):
+    lobby, fake = shard_lobby
+    ring = lobby.ring
+    mine = next(r for r in range(100) if ring.owner(r) == "s1")
+    theirs = next(r for r in range(100) if ring.owner(r) == "s2")
+
+    async def run():
+        # 目錄裡有記錄：照記錄的分片
+        fake.rooms[mine] = {"id": mine, "shard": "s2"}
+        resp = await lobby.route_room(mine)
+        assert resp["error"] == "redirect" and resp["redirect"]["shard"] == "s2" and resp["redirect"]["port"] == 2
+        # 目錄裡沒有：照 hash ring
+        assert (await lobby.route_room(theirs))["redirect"]["shard"] == "s2"
+        fake.rooms.clear()
+        assert await lobby.route_room(mine) is None
+        # 房間就在這個分片
+        lobby.rooms[theirs] = {}
+        assert await lobby.route_room(theirs) is None
+
+    asyncio.run(run())
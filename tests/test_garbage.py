@@ -0,0 +1,71 @@
+import random
+
+from game.garbage import GARBAGE_CELL, MAX_GARBAGE_PER_LOCK, GarbageQueue
+
+
+def empty_board():
+    return [[0] * 10 for _ in range(20)]
+
+
+def garbage_rows(board):
+    return sum(1 for row in board if row.count(GARBAGE_CELL) == 9 and row.count(0) == 1)
+
+
+def test_cancel_consumes_oldest_batches_first():
+    q = GarbageQueue(random.Random(1))
+    q.push(2)
+    q.push(3)
+    q.push(0)                        # 0 行不進佇列
+    assert list(q.batches) == [2, 3] and q.total == 5
+    assert q.cancel(1) == 0
+    assert list(q.batches) == [1, 3] and q.total == 4
+    assert q.cancel(2) == 0
+    assert list(q.batches) == [2] and q.total == 2
+    # 攻擊比待收的多：抵銷完，剩下的回傳給呼叫端送出去
+    assert q.cancel(5) == 3
+    assert not q.batches and q.total == 0
+
+
+def test_rise_is_limited_per_lock():
+    q = GarbageQueue(random.Random(2))
+    q.push(5)
+    q.push(6)
+    board = empty_board()
+    assert q.apply(board)
+    assert len(board) == 20
+    assert garbage_rows(board) == MAX_GARBAGE_PER_LOCK
+    assert list(q.batches) == [11 - MAX_GARBAGE_PER_LOCK] and q.total == 11 - MAX_GARBAGE_PER_LOCK
+    assert q.apply(board)
+    assert garbage_rows(board) == 11
+    assert not q.batches and q.total == 0
+
+
+def test_rows_are_not_shared_between_lines():
+    q = GarbageQueue(random.Random(3))
+    q.push(4)
+    board = empty_board()
+    q.apply(board)
+    board[-1][0] = "X"
+    assert all(row[0] != "X" for row in board[:-1])
+
+
+def test_top_out_detection():
+    q = GarbageQueue(random.Random(4))
+    board = empty_board()
+    board[1][4] = "T"                # 第二列有方塊：升 1 行沒事，升 2 行就被擠出去
+    q.push(1)
+    assert q.apply(board)
+    q.push(1)
+    assert not q.apply(board)
+
+
+def test_holes_are_reproducible():
+    boards = []
+    for _ in range(2):
+        q = GarbageQueue(random.Random(99))
+        q.push(3)
+        q.push(4)
+        board = empty_board()
+        q.apply(board)
+        boards.append(board)
+    assert boards[0] == boards[1]
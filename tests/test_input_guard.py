@@ -0,0 +1,151 @@
+import time
+
+import pytest
+
+from common.metrics import metrics
+from game import input_guard
+from game.input_guard import (INPUT_BURST, INPUT_RATE, MAX_EVENTS_PER_PIECE, MAX_FUTURE_MS, MAX_PAST_MS, MAX_PPS,
+                              PIECE_BURST, REJECT_BURST, TIME_SLACK_MS, InputValidator, parse_input, parse_inputs)
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def rejected(reason):
+    return metrics.counters.get(metrics.key("inputs_rejected", {"reason": reason}), 0)
+
+
+# -------------------------------
+# 封包格式
+# -------------------------------
+
+def test_parse_inputs():
+    assert parse_inputs({"seq": 5, "t0_ms": 1000, "evs": [["L", 0], ["HD", 16]]}, 0) == (5, [("L", 1000), ("HD", 1016)])
+    assert parse_inputs({"evs": []}, 7) == (7, [])
+
+
+@pytest.mark.parametrize("m", [
+    {"type": "inputs", "evs": [[["L"], 0]]},         # ev 不可 hash
+    {"type": "inputs", "evs": [[{}, 0]]},
+    {"type": "inputs", "evs": [["L", "16"]]},        # dt 不是整數
+    {"type": "inputs", "evs": [["L", 1.5]]},
+    {"type": "inputs", "evs": [["L"]]},
+    {"type": "inputs", "evs": [7]},
+    {"type": "inputs", "seq": "x", "evs": [["L", 0]]},
+    {"type": "inputs", "t0_ms": None, "evs": [["L", 0]]},
+])
+def test_parse_inputs_malformed(m):
+    with pytest.raises(ValueError):
+        parse_inputs(m, 0)
+
+
+@pytest.mark.parametrize("m", [
+    {"type": "input", "ev": {}},
+    {"type": "input", "ev": ["L"]},
+    {"type": "input", "ev": None},
+    {"type": "input", "ev": "L", "when_ms": "soon"},
+])
+def test_parse_input_malformed(m):
+    with pytest.raises(ValueError):
+        parse_input(m)
+
+
+def test_filter_rejects_unhashable_events():
+    g = InputValidator(1)
+    before = rejected("event")
+    t = now_ms()
+    assert g.filter([(["L"], t), ({}, t), ("L", t)], t) == [("L", t)]
+    assert rejected("event") == before + 2
+    assert not g.abusive
+
+
+# -------------------------------
+# 限速
+# -------------------------------
+
+class FakeClock:
+    def __init__(self):
+        self.t = 1000.0
+
+    def monotonic(self):
+        return self.t
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = FakeClock()
+    monkeypatch.setattr(input_guard, "time", c)
+    return c
+
+
+def test_hard_drops_capped_at_max_pps(clock):
+    g = InputValidator(1)
+    t = now_ms()
+    before = rejected("piece_rate")
+    # 一次送 3 倍的 HD：只有 PIECE_BURST 個過得去
+    assert len(g.filter([("HD", t)] * (3 * PIECE_BURST), t)) == PIECE_BURST
+    assert rejected("piece_rate") == before + 2 * PIECE_BURST
+    # 之後每秒補 MAX_PPS 個
+    for _ in range(5):
+        clock.t += 1
+        assert len(g.filter([("HD", t)] * (2 * MAX_PPS), t)) == MAX_PPS
+    # HOLD 另外計算，不吃 HD 的額度
+    assert len(g.filter([("HOLD", t)] * 2, t)) == 2
+
+
+def test_full_speed_bot_plan_is_not_rejected(clock):
+    # 最快的合法玩法：每秒 MAX_PPS 顆，每顆 MAX_EVENTS_PER_PIECE 個輸入（HD 收尾），整包送出
+    g = InputValidator(1)
+    t = now_ms()
+    plan = [("SD", t), ("CW", t), ("CW", t)] + [("L", t)] * (MAX_EVENTS_PER_PIECE - 4) + [("HD", t)]
+    assert len(plan) == MAX_EVENTS_PER_PIECE
+    for _ in range(10 * MAX_PPS):
+        clock.t += 1 / MAX_PPS
+        assert g.filter(plan, t) == plan
+    assert not g.abusive
+
+
+def test_input_flood_is_rate_limited(clock):
+    g = InputValidator(1)
+    t = now_ms()
+    assert len(g.filter([("L", t)] * 60, t)) == 60
+    assert len(g.filter([("L", t)] * 60, t)) == INPUT_BURST - 60
+    assert g.filter([("L", t)], t) == []                 # 額度用完：整批擋下
+    clock.t += 0.1
+    assert len(g.filter([("L", t)] * 60, t)) == INPUT_RATE // 10
+
+
+def test_sustained_abuse_is_kicked(clock):
+    g = InputValidator(1)
+    t = now_ms()
+    g.filter([("L", t)] * INPUT_BURST, t)
+    assert not g.abusive
+    g.filter([("L", t)] * (REJECT_BURST + 1), t)
+    assert g.abusive
+    assert g.filter([("L", t)], t) == []
+
+
+# -------------------------------
+# 時間戳
+# -------------------------------
+
+def test_time_checks(clock):
+    g = InputValidator(1)
+    now = now_ms()
+    assert g.filter([("L", now)], now) == [("L", now)]
+    # 小幅倒退（同一個 frame、時鐘抖動）可以，太多就擋
+    assert g.filter([("R", now - TIME_SLACK_MS)], now) == [("R", now - TIME_SLACK_MS)]
+    assert g.filter([("R", now - TIME_SLACK_MS - 1)], now) == []
+    assert g.filter([("L", now + MAX_FUTURE_MS + 1)], now) == []
+    g2 = InputValidator(2)
+    assert g2.filter([("L", now - MAX_PAST_MS - 1)], now) == []
+    assert rejected("time_future") >= 1 and rejected("time_stale") >= 1 and rejected("time_reversed") >= 1
+
+
+def test_clock_offset_is_applied(clock):
+    g = InputValidator(1)
+    g.clock_offset_ms = 5000                             # 客戶端時鐘快 5 秒
+    now = now_ms()
+    assert g.filter([("L", now + 5000)], now) == [("L", now + 5000)]
+    assert g.filter([("L", now + 5000 + MAX_FUTURE_MS + 1)], now) == []
@@ -0,0 +1,18 @@
+from common.metrics import Registry, request_labels
+
+KNOWN = frozenset({("User", "login"), ("Room", "list")})
+
+
+def test_known_requests_keep_their_labels():
+    assert request_labels("User", "login", KNOWN) == {"collection": "User", "action": "login"}
+
+
+def test_unknown_requests_share_one_label():
+    reg = Registry()
+    for i in range(1000):
+        reg.inc("requests", **request_labels("User", f"x{i}", KNOWN))
+        reg.observe("request_ms", 1, **request_labels(f"C{i}", "login", KNOWN))
+    for collection, action in ((None, None), ({}, []), (["User"], "login"), ("User", {"a": 1})):
+        reg.inc("requests", **request_labels(collection, action, KNOWN))
+    assert reg.counters == {"requests{collection=unknown,action=unknown}": 1004}
+    assert list(reg.histograms) == ["request_ms{collection=unknown,action=unknown}"]
@@ -0,0 +1,322 @@
+import asyncio
+import random
+import struct
+
+import pytest
+
+from common import runtime
+from common.compress import Deflater, Inflater
+from common.network import (CHUNK_FLAG, COMPRESS_FLAG, LEN_MASK, MAX_LEN, FrameProtocol, compress_frame,
+                            decode_frame, encode_msg, frame_body, frame_type, pack_frame, recv_frame, recv_msg, send_msg)
+
+# 分塊 / 壓縮封包的來回測試：
+# - send_msg → 真的 TCP 連線 → recv_msg（StreamReader 版、FrameProtocol 版）
+# - FrameProtocol 被餵任意切開的 bytes（TCP 不保證一次收到一整個 frame）
+
+
+def msg_of_len(n: int) -> dict:
+    """JSON 編碼後剛好 n bytes 的訊息"""
+    msg = {"p": "x" * (n - len('{"p": ""}'))}
+    assert len(frame_body(encode_msg(msg))) == n
+    return msg
+
+
+def frame_headers(data: bytes) -> list:
+    """把一串封包的 header 依序拆出來"""
+    headers = []
+    pos = 0
+    while pos < len(data):
+        (n,) = struct.unpack_from("!I", data, pos)
+        headers.append(n)
+        pos += 4 + (n & LEN_MASK)
+    assert pos == len(data)
+    return headers
+
+
+async def loopback(handler, framed=False, max_message_len=None):
+    """開一個本機 server，回傳 (server, client reader, client writer)；handler(reader, writer) 處理 server 端"""
+    kwargs = {} if max_message_len is None else {"max_message_len": max_message_len}
+    server = await runtime.start_server(handler, "127.0.0.1", 0, framed=framed, **kwargs)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    return server, reader, writer
+
+
+async def echo_round_trip(msgs, framed=False):
+    """msgs 一則一則送給 echo server、收回來"""
+    async def echo(reader, writer):
+        try:
+            while True:
+                await send_msg(writer, await recv_msg(reader))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server, reader, writer = await loopback(echo, framed=framed)
+    try:
+        out = []
+        for msg in msgs:
+            await send_msg(writer, msg)
+            out.append(await recv_msg(reader))
+        return out
+    finally:
+        writer.close()
+        server.close()
+
+
+# -------------------------------
+# 分塊
+# -------------------------------
+
+@pytest.mark.parametrize("n, frames", [(MAX_LEN, 1), (MAX_LEN + 1, 2), (3 * MAX_LEN + 5, 4)])
+def test_chunk_boundaries(n, frames):
+    msg = msg_of_len(n)
+    data = encode_msg(msg)
+    headers = frame_headers(data)
+    assert len(headers) == frames
+    assert all(h & CHUNK_FLAG for h in headers[:-1])
+    assert not headers[-1] & CHUNK_FLAG
+    assert sum(h & LEN_MASK for h in headers) == n
+    assert all(0 < h & LEN_MASK <= MAX_LEN for h in headers)
+    assert decode_frame(data) == msg
+
+
+@pytest.mark.parametrize("framed", [False, True])
+def test_round_trip_over_tcp(framed):
+    msgs = [{"type": "ping"}, msg_of_len(MAX_LEN), msg_of_len(MAX_LEN + 1), msg_of_len(3 * MAX_LEN + 5),
+            {"type": "中文", "n": 1}]
+    assert asyncio.run(echo_round_trip(msgs, framed=framed)) == msgs
+
+
+def test_recv_frame_keeps_chunks_for_relay():
+    async def run():
+        reader = asyncio.StreamReader()
+        data = encode_msg(msg_of_len(2 * MAX_LEN + 1))
+        reader.feed_data(data)
+        frame = await recv_frame(reader)
+        assert frame == data
+        return decode_frame(frame)
+
+    assert asyncio.run(run()) == msg_of_len(2 * MAX_LEN + 1)
+
+
+def test_frame_type_without_full_decode():
+    assert frame_type(encode_msg({"type": "game_over", "winner": 1})) == "game_over"
+    assert frame_type(pack_frame(b'{"type":"snapshot","server_ms":1,"players":[]}')) == "snapshot"
+    assert frame_type(encode_msg(msg_of_len(2 * MAX_LEN))) is None
+    assert frame_type(encode_msg({"n": 1, "type": "late"})) == "late"
+    assert frame_type(encode_msg({"type": "跳脫\"引號"})) == "跳脫\"引號"
+
+
+# -------------------------------
+# 上限
+# -------------------------------
+
+def test_iter_frames_rejects_oversized_message():
+    with pytest.raises(ValueError):
+        pack_frame(b"x" * (4 * 1024 * 1024 + 1))
+
+
+def test_recv_msg_cap_overflow():
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(encode_msg(msg_of_len(3 * MAX_LEN)))
+        await recv_msg(reader, max_message_len=2 * MAX_LEN)
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+
+def test_recv_msg_rejects_bad_length():
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(struct.pack("!I", MAX_LEN + 1) + b"x" * (MAX_LEN + 1))
+        await recv_msg(reader)
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+
+def test_framed_server_cap_overflow_drops_connection():
+    async def run():
+        result = asyncio.get_running_loop().create_future()
+
+        async def handler(reader, writer):
+            try:
+                result.set_result(await recv_msg(reader))
+            except Exception as e:
+                result.set_result(e)
+
+        server, reader, writer = await loopback(handler, framed=True, max_message_len=2 * MAX_LEN)
+        try:
+            writer.write(encode_msg(msg_of_len(3 * MAX_LEN)))
+            await writer.drain()
+            return await asyncio.wait_for(result, 5)
+        finally:
+            writer.close()
+            server.close()
+
+    assert isinstance(asyncio.run(run()), ValueError)
+
+
+# -------------------------------
+# 壓縮
+# -------------------------------
+
+def noisy_msg(n: int) -> dict:
+    """壓不太小的訊息（壓縮後還是會超過 MAX_LEN 要分塊）"""
+    rng = random.Random(n)
+    return {"type": "keyframe", "blob": "".join(rng.choice("0123456789abcdef") for _ in range(n))}
+
+
+def test_compressed_small_and_chunked_frames():
+    async def run():
+        deflater, inflater = Deflater(), Inflater()
+        reader = asyncio.StreamReader()
+        msgs = [{"type": "ping"}, noisy_msg(1000), noisy_msg(4 * MAX_LEN), noisy_msg(1000)]
+        frames = [compress_frame(encode_msg(m), deflater) for m in msgs]
+        # 太小的不壓縮；小的壓縮封包是單塊、大的是多塊，每塊都帶 COMPRESS_FLAG
+        assert frame_headers(frames[0]) == [len(frames[0]) - 4]
+        assert [h & ~LEN_MASK for h in frame_headers(frames[1])] == [COMPRESS_FLAG]
+        big = frame_headers(frames[2])
+        assert len(big) > 1
+        assert all(h & COMPRESS_FLAG for h in big)
+        assert all(h & CHUNK_FLAG for h in big[:-1]) and not big[-1] & CHUNK_FLAG
+        for frame in frames:
+            reader.feed_data(frame)
+        return msgs, [await recv_msg(reader, inflater=inflater) for _ in msgs]
+
+    sent, got = asyncio.run(run())
+    assert got == sent
+
+
+def test_compressed_frame_without_negotiation():
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(compress_frame(encode_msg(noisy_msg(1000)), Deflater()))
+        await recv_msg(reader)
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+
+def test_decompressed_size_is_capped():
+    async def run():
+        reader = asyncio.StreamReader()
+        # 壓縮後很小、解開超過上限（壓縮炸彈）
+        frame = compress_frame(encode_msg({"p": "0" * (8 * MAX_LEN)}), Deflater())
+        assert len(frame) < MAX_LEN
+        reader.feed_data(frame)
+        await recv_msg(reader, max_message_len=4 * MAX_LEN, inflater=Inflater())
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+
+# -------------------------------
+# FrameProtocol 任意切開
+# -------------------------------
+
+class FakeTransport:
+    def __init__(self):
+        self.closed = False
+        self.paused = False
+
+    def close(self):
+        self.closed = True
+
+    def is_closing(self):
+        return self.closed
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+    def get_extra_info(self, name, default=None):
+        return default
+
+
+def feed(proto: FrameProtocol, data: bytes, cuts):
+    """照 cuts 的位置把 data 切開，模擬 kernel 一次交給 protocol 一段"""
+    pos = 0
+    for end in list(cuts) + [len(data)]:
+        while pos < end:
+            buf = proto.get_buffer(-1)
+            n = min(len(buf), end - pos)
+            buf[:n] = data[pos:pos + n]
+            proto.buffer_updated(n)
+            pos += n
+
+
+def drain_messages(proto: FrameProtocol) -> list:
+    out = list(proto.messages)
+    proto.messages.clear()
+    return out
+
+
+def split_stream():
+    msgs = [{"type": "input", "ev": "L"}, msg_of_len(MAX_LEN), {"type": "中文"}, msg_of_len(2 * MAX_LEN + 7),
+            {"type": "input", "ev": "HD"}]
+    return msgs, b"".join(encode_msg(m) for m in msgs)
+
+
+def test_frame_protocol_byte_by_byte():
+    async def run():
+        proto = FrameProtocol()
+        proto.connection_made(FakeTransport())
+        msgs, data = split_stream()
+        small = b"".join(encode_msg(m) for m in msgs if len(encode_msg(m)) < 100)
+        feed(proto, small, range(1, len(small)))
+        assert drain_messages(proto) == [m for m in msgs if len(encode_msg(m)) < 100]
+        # 大的也切在 header 中間、body 中間、chunk 交界
+        feed(proto, data, [1, 2, 3, 5, MAX_LEN + 3, MAX_LEN + 4, MAX_LEN + 5, MAX_LEN + 8, 2 * MAX_LEN + 20])
+        assert drain_messages(proto) == msgs
+        assert proto.error is None
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_frame_protocol_random_splits(seed):
+    async def run():
+        rng = random.Random(seed)
+        proto = FrameProtocol()
+        proto.connection_made(FakeTransport())
+        msgs, data = split_stream()
+        cuts = sorted(rng.sample(range(1, len(data)), 200))
+        feed(proto, data, cuts)
+        assert drain_messages(proto) == msgs
+        assert proto.error is None
+        assert proto.start == proto.end == 0
+
+    asyncio.run(run())
+
+
+def test_frame_protocol_rejects_compressed():
+    async def run():
+        proto = FrameProtocol()
+        transport = FakeTransport()
+        proto.connection_made(transport)
+        feed(proto, compress_frame(encode_msg(noisy_msg(1000)), Deflater()), [])
+        assert transport.closed
+        with pytest.raises(ValueError):
+            await proto.recv()
+
+    asyncio.run(run())
+
+
+def test_frame_protocol_cap_overflow():
+    async def run():
+        proto = FrameProtocol(max_message_len=2 * MAX_LEN)
+        transport = FakeTransport()
+        proto.connection_made(transport)
+        feed(proto, encode_msg({"type": "ok"}) + encode_msg(msg_of_len(3 * MAX_LEN)), [3, 10])
+        assert transport.closed
+        assert await proto.recv() == {"type": "ok"}
+        with pytest.raises(ValueError):
+            await proto.recv()
+
+    asyncio.run(run())
@@ -0,0 +1,135 @@
+import asyncio
+
+from common.compress import Deflater, Inflater
+from common.network import MAX_MESSAGE_LEN, COMPRESS_FLAG, decode_frame, encode_msg, frame_body
+from common.outbox import Outbox
+
+
+class FakeTransport:
+    def __init__(self):
+        self.aborted = False
+
+    def abort(self):
+        self.aborted = True
+
+
+class FakeWriter:
+    """drain() 要等 gate 打開才回來，用來模擬很慢的接收端"""
+
+    def __init__(self, blocked=False):
+        self.frames = []
+        self.transport = FakeTransport()
+        self.gate = asyncio.Event()
+        if not blocked:
+            self.gate.set()
+        self.closed = False
+
+    def write(self, data):
+        self.frames.append(bytes(data))
+
+    async def drain(self):
+        await self.gate.wait()
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+def msgs(writer):
+    return [decode_frame(f) for f in writer.frames]
+
+
+def test_sends_in_order_and_closes():
+    async def run():
+        w = FakeWriter()
+        out = Outbox(w, "t")
+        for i in range(5):
+            assert out.push(encode_msg({"n": i}))
+        await out.close()
+        assert msgs(w) == [{"n": i} for i in range(5)]
+        assert w.closed and not out.evicted
+        assert not out.push(encode_msg({"n": 5}))        # 關閉後不再收
+
+    asyncio.run(run())
+
+
+def test_same_kind_is_coalesced():
+    async def run():
+        w = FakeWriter(blocked=True)
+        out = Outbox(w, "t")
+        out.push(encode_msg({"type": "first"}))
+        await asyncio.sleep(0)                           # 第一包已寫出、卡在 drain
+        for i in range(10):
+            out.push(encode_msg({"type": "snapshot", "n": i}), kind="snapshot")
+            out.push(encode_msg({"type": "opponents", "n": i}), kind="opponents")
+        out.push(encode_msg({"type": "event"}))
+        assert len(out) == 3                             # snapshot / opponents 各只留最新的一筆
+        w.gate.set()
+        await out.close()
+        assert msgs(w) == [{"type": "first"}, {"type": "snapshot", "n": 9}, {"type": "opponents", "n": 9},
+                           {"type": "event"}]
+
+    asyncio.run(run())
+
+
+def test_queue_full_evicts():
+    async def run():
+        evicted = []
+        w = FakeWriter(blocked=True)
+        out = Outbox(w, "t", max_depth=4, on_evict=evicted.append)
+        out.push(encode_msg({"n": 0}))
+        await asyncio.sleep(0)
+        results = [out.push(encode_msg({"n": i})) for i in range(1, 7)]
+        assert results == [True] * 4 + [False] * 2
+        assert out.evicted and evicted == [out] and w.transport.aborted
+        assert len(out) == 0
+
+    asyncio.run(run())
+
+
+def test_slow_reader_evicted_after_lag():
+    async def run():
+        w = FakeWriter(blocked=True)
+        out = Outbox(w, "t", max_lag_sec=0.05)
+        out.push(encode_msg({"n": 0}))
+        await asyncio.sleep(0.1)
+        # 佇列沒滿，但已經超過 max_lag_sec 送不完：下一次 push 就踢掉（同 kind 合併也算）
+        assert not out.push(encode_msg({"n": 1}), kind="snapshot")
+        assert out.evicted and w.transport.aborted
+
+    asyncio.run(run())
+
+
+def test_close_timeout_evicts():
+    async def run():
+        w = FakeWriter(blocked=True)
+        out = Outbox(w, "t")
+        out.push(encode_msg({"n": 0}))
+        await out.close(timeout=0.05)
+        assert out.evicted and w.transport.aborted
+
+    asyncio.run(run())
+
+
+def test_compression_skips_coalesced_frames():
+    async def run():
+        w = FakeWriter(blocked=True)
+        out = Outbox(w, "t")
+        out.deflater = Deflater()
+        big = [encode_msg({"type": "snapshot", "n": i, "board": [[0] * 10] * 20}) for i in range(3)]
+        out.push(big[0], kind="snapshot")
+        await asyncio.sleep(0)
+        out.push(big[1], kind="snapshot")
+        out.push(big[2], kind="snapshot")               # 取代 big[1]，big[1] 不會進壓縮串流
+        w.gate.set()
+        await out.close()
+        inflater = Inflater()
+        assert len(w.frames) == 2
+        for frame in w.frames:
+            assert int.from_bytes(frame[:4], "big") & COMPRESS_FLAG
+        got = [inflater.decompress(frame_body(f), MAX_MESSAGE_LEN) for f in w.frames]
+        assert got == [frame_body(big[0]), frame_body(big[2])]
+
+    asyncio.run(run())
@@ -0,0 +1,48 @@
+import asyncio
+import os
+
+from game import result_channel
+from game.result_channel import ResultChannel
+
+
+class FakeChannel(ResultChannel):
+    """不連 Lobby，直接回覆預先排好的 response"""
+
+    def __init__(self, responses):
+        super().__init__("127.0.0.1", 0, {"room_id": 1, "port": 16800})
+        self.responses = list(responses)
+        self.sent = []
+
+    async def request(self, payload):
+        self.sent.append(payload)
+        return self.responses.pop(0)
+
+
+def report(channel):
+    return asyncio.run(channel.report({"collection": "Game", "action": "report", "data": {"room_id": 1}},
+                                      deadline_sec=5))
+
+
+def test_delivered_report_is_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_channel, "SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(result_channel, "RETRY_BASE_SEC", 0.01)
+    channel = FakeChannel([{"ok": False, "retry": True}, {"ok": True}])
+    assert report(channel)
+    assert len(channel.sent) == 2
+    assert os.listdir(tmp_path) == []
+
+
+def test_rejected_report_is_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_channel, "SPOOL_DIR", str(tmp_path))
+    channel = FakeChannel([{"ok": False, "error": "DB 寫入失敗"}])
+    assert report(channel)
+    files = os.listdir(tmp_path)
+    assert len(files) == 1 and files[0].endswith(".json.rejected")
+    # 不會再被 flush_spool 當成待補送的結果
+    asyncio.run(FakeChannel([]).flush_spool())
+
+
+def test_hello_is_signed():
+    from common import session
+    channel = ResultChannel("127.0.0.1", 0, {"room_id": 1, "port": 16800})
+    assert session.check_control_auth(channel.hello["auth"], 1, 16800)
@@ -0,0 +1,58 @@
+import time
+
+from common import session
+
+
+def test_issue_and_verify():
+    claims = session.verify(session.issue(7, "小明"))
+    assert claims["uid"] == 7 and claims["name"] == "小明"
+    assert claims["exp"] > time.time()
+
+
+def test_expired_token(monkeypatch):
+    token = session.issue(7, "a", ttl=60)
+    assert session.verify(token) is not None
+    now = time.time()
+    monkeypatch.setattr(session.time, "time", lambda: now + 61)
+    assert session.verify(token) is None
+    assert session.verify(session.issue(7, "a", ttl=-1)) is None
+
+
+def test_tampered_token():
+    token = session.issue(7, "a")
+    payload, sig = token.split(".")
+    forged = session._b64(b'{"uid":1,"name":"admin","exp":9999999999}')
+    assert session.verify(f"{forged}.{sig}") is None
+    assert session.verify(f"{payload}.{sig[:-1]}{'A' if sig[-1] != 'A' else 'B'}") is None
+    assert session.verify(f"{payload}.") is None
+    assert session.verify(payload) is None
+    assert session.verify(token + ".x") is None
+    assert session.verify(None) is None
+    assert session.verify(12345) is None
+
+
+def test_other_secret_is_rejected(monkeypatch):
+    token = session.issue(7, "a")
+    monkeypatch.setattr(session, "_KEY", b"another-secret")
+    assert session.verify(token) is None
+    assert session.verify(session.issue(7, "a")) is not None
+
+
+def test_garbage_payload_with_valid_signature():
+    # 簽章對、但內容不是 dict / 不是 JSON：不能丟例外
+    for raw in (b"[1, 2]", b"not json", b"\xff\xfe"):
+        payload = session._b64(raw)
+        assert session.verify(f"{payload}.{session._sign(payload)}") is None
+
+
+def test_control_auth_binds_room_and_port(monkeypatch):
+    auth = session.control_auth(3, 16800)
+    assert session.check_control_auth(auth, 3, 16800)
+    assert not session.check_control_auth(auth, 3, 16801)
+    assert not session.check_control_auth(auth, 4, 16800)
+    assert not session.check_control_auth(None, 3, 16800)
+    assert not session.check_control_auth("假的", 3, 16800)
+    # 帶別的 secret 簽的（例如 game_host 代替某個 Lobby 通知）要跟那個 Lobby 的 secret 一致才過
+    assert not session.check_control_auth(session.control_auth(3, 16800, secret="other"), 3, 16800)
+    monkeypatch.setattr(session, "_KEY", b"other")
+    assert session.check_control_auth(session.control_auth(3, 16800, secret="other"), 3, 16800)
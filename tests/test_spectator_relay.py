@@ -0,0 +1,117 @@
+import asyncio
+
+from common import runtime
+from common.network import encode_msg, recv_msg, send_msg
+from game import spectator_relay
+from game.spectator_relay import Relay
+from game.views import pack_board
+
+
+def snapshot(n):
+    board = [[0] * 10 for _ in range(20)]
+    board[-1][0] = "I"
+    return {"type": "snapshot", "server_ms": 1000 + n, "players": [
+        {"id": 1, "board": board, "score": n, "level": 1, "alive": True, "active": {"kind": "T"}}]}
+
+
+async def relay_fixture():
+    """假的 game server（upstream 佇列裡的封包依序送出）+ 轉播節點；回傳 (upstream, relay, 連 relay 的函式, 清理)"""
+    upstream = asyncio.Queue()
+
+    async def game_server(reader, writer):
+        assert (await recv_msg(reader))["role"] == "watch"
+        writer.write(encode_msg({"type": "welcome", "id": "W1"}))
+        while True:
+            frame = await upstream.get()
+            writer.write(frame)
+            await writer.drain()
+
+    game = await asyncio.start_server(game_server, "127.0.0.1", 0)
+    relay = Relay()
+    relay_server = await runtime.start_server(relay.accept, "127.0.0.1", 0)
+    tasks = [asyncio.create_task(relay.subscribe("127.0.0.1", game.sockets[0].getsockname()[1])),
+             asyncio.create_task(relay.release_loop())]
+
+    async def watch(detail="full"):
+        reader, writer = await asyncio.open_connection("127.0.0.1", relay_server.sockets[0].getsockname()[1])
+        assert (await recv_msg(reader))["type"] == "welcome"
+        await send_msg(writer, {"type": "hello", "name": "w", "detail": detail})
+        return reader, writer
+
+    async def cleanup():
+        for t in tasks:
+            t.cancel()
+        game.close()
+        relay_server.close()
+
+    return upstream, relay, watch, cleanup
+
+
+async def wait_for(cond, timeout=2):
+    t = asyncio.get_running_loop().time()
+    while not cond():
+        assert asyncio.get_running_loop().time() - t < timeout
+        await asyncio.sleep(0.01)
+
+
+def test_keyframe_and_thumbnail_fan_out(monkeypatch):
+    monkeypatch.setattr(spectator_relay, "THUMB_INTERVAL_MS", 0)
+
+    async def run():
+        upstream, relay, watch, cleanup = await relay_fixture()
+        try:
+            first = encode_msg(snapshot(1))
+            upstream.put_nowait(first)
+            await wait_for(lambda: relay.keyframe == first)
+
+            # 中途加入：先收到最新的 keyframe（thumb 觀戰者收到縮圖版）
+            full_r, full_w = await watch("full")
+            thumb_r, thumb_w = await watch("thumb")
+            assert await recv_msg(full_r) == snapshot(1)
+            thumb = await recv_msg(thumb_r)
+            assert thumb["detail"] == "thumb"
+            assert thumb["players"][0]["board"] == pack_board(snapshot(1)["players"][0]["board"])
+            assert "active" not in thumb["players"][0]
+
+            # 之後的串流：full 原封不動轉送、thumb 由轉播節點自己產生
+            upstream.put_nowait(encode_msg(snapshot(2)))
+            assert await recv_msg(full_r) == snapshot(2)
+            thumb = await recv_msg(thumb_r)
+            assert thumb["detail"] == "thumb" and thumb["players"][0]["score"] == 2
+
+            # 其他事件兩邊都收到，game_over 之後連線關閉
+            upstream.put_nowait(encode_msg({"type": "game_over", "winner": 1}))
+            for r in (full_r, thumb_r):
+                assert (await recv_msg(r))["type"] == "game_over"
+                assert await r.read() == b""
+            full_w.close()
+            thumb_w.close()
+        finally:
+            await cleanup()
+
+    asyncio.run(run())
+
+
+def test_thumbnails_are_rate_limited(monkeypatch):
+    monkeypatch.setattr(spectator_relay, "THUMB_INTERVAL_MS", 60_000)
+
+    async def run():
+        upstream, relay, watch, cleanup = await relay_fixture()
+        try:
+            thumb_r, thumb_w = await watch("thumb")
+            full_r, full_w = await watch("full")
+            await wait_for(lambda: len(relay.clients) == 2 and "thumb" in relay.detail.values())
+            for n in range(1, 6):
+                upstream.put_nowait(encode_msg(snapshot(n)))
+                assert (await recv_msg(full_r))["server_ms"] == 1000 + n
+            upstream.put_nowait(encode_msg({"type": "game_over"}))
+            # 間隔內只送第一張縮圖，其餘丟掉
+            got = [await recv_msg(thumb_r), await recv_msg(thumb_r)]
+            assert [m["type"] for m in got] == ["snapshot", "game_over"]
+            assert got[0]["players"][0]["score"] == 1
+            thumb_w.close()
+            full_w.close()
+        finally:
+            await cleanup()
+
+    asyncio.run(run())